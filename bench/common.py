@@ -0,0 +1,108 @@
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Helpers shared by the benchmark scripts in this directory."""
+
+import os
+import resource
+import subprocess
+import sys
+import time
+
+try:
+	import json
+except ImportError:
+	import simplejson as json
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+# Lets Qt run without a display where the platform supports it. With Qt 4
+# on X11, run the benchmarks under Xvfb instead.
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+_app = None
+
+def application():
+	"""Return the QApplication, creating it if necessary."""
+	global _app
+	from PyQt4.QtGui import QApplication
+	if _app is None:
+		_app = QApplication.instance() or QApplication(sys.argv[:1])
+	return _app
+
+def peak_rss():
+	"""Return the peak resident set size of this process, in bytes."""
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform.startswith("darwin"):
+		return peak # Already in bytes
+	return peak * 1024
+
+def current_rss():
+	"""Return the current resident set size of this process, in bytes, or
+	the peak size where the current one isn't available."""
+	try:
+		f = open("/proc/self/statm")
+		try:
+			return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+		finally:
+			f.close()
+	except (IOError, OSError):
+		return peak_rss()
+
+def timed(f, *args):
+	"""Call f(*args), and return the wall time it took in seconds."""
+	start = time.time()
+	f(*args)
+	return time.time() - start
+
+_PYTHON_LINES = [
+	u"class Widget%d(object):",
+	u"\t\"\"\"A docstring for a class,",
+	u"\tspanning two lines.\"\"\"",
+	u"\tdef method(self, x, y=None):",
+	u"\t\t# Compute something with x",
+	u"\t\tif x and not y:",
+	u"\t\t\treturn [x * 2 for x in range(10)]",
+	u"\t\tresult = {'key': \"value\", 'other': x}",
+	u"\t\treturn result",
+	u""
+]
+
+def synthetic_python(size):
+	"""Return a unicode string of about 'size' characters of Python code."""
+	lines = []
+	length = 0
+	i = 0
+	while length < size:
+		for each in _PYTHON_LINES:
+			line = each % i if "%d" in each else each
+			lines.append(line)
+			length += len(line) + 1
+		i += 1
+	return u"\n".join(lines)
+
+def run_isolated(script, *args):
+	"""Run a benchmark script in a fresh interpreter, so that its peak memory
+	use isn't affected by what ran before. The script must print a JSON
+	object as the last line of its output, which is returned."""
+	cmd = [sys.executable, script] + [str(x) for x in args]
+	proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+	output = proc.communicate()[0]
+	if proc.returncode != 0:
+		raise RuntimeError("%s exited with status %d" % (" ".join(cmd), proc.returncode))
+	return json.loads(output.strip().splitlines()[-1])
+
+def format_size(n):
+	for unit in ["B", "KB", "MB", "GB"]:
+		if abs(n) < 1024 or unit == "GB":
+			return "%.1f %s" % (n, unit)
+		n /= 1024.
@@ -0,0 +1,143 @@
+#! /usr/bin/env python2.6
+
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Replays typing into the middle of a file, and reports the time from each
+key press to the end of the next paint (see latency.py).
+
+Usage: python bench/keystrokes.py [--size 1000000] [--script FILE]
+                                  [--interval 0] [--repeat 1]
+
+The size of the file is in characters. The keys typed are the characters
+of the script file (by default, a few lines of Python), with newlines typed
+as Return. Each key is posted to the event loop like real input, after the
+previous one has been painted and --interval milliseconds have passed.
+"""
+
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import common
+
+# Must be set before kurt is imported
+os.environ["KURT_LATENCY"] = "1"
+
+DEFAULT_SCRIPT = u"""def typed(self, x):
+	# A comment, typed one key at a time
+	return [x * 2 for x in range(10)]
+"""
+
+# How long to wait for a key press to be painted
+PAINT_TIMEOUT_SECS = 1.0
+
+def key_event(ch):
+	from PyQt4.QtCore import QEvent, Qt
+	from PyQt4.QtGui import QKeyEvent
+	if ch == "\n":
+		return QKeyEvent(QEvent.KeyPress, Qt.Key_Return, Qt.NoModifier, "\r")
+	if ch == "\t":
+		return QKeyEvent(QEvent.KeyPress, Qt.Key_Tab, Qt.NoModifier, "\t")
+	key = ord(ch.upper()) if ord(ch) < 128 else 0
+	return QKeyEvent(QEvent.KeyPress, key, Qt.NoModifier, ch)
+
+def replay(editor, script, interval):
+	"""Type each character of 'script' into 'editor', waiting for it to be
+	painted. Returns the number of keys that were never painted."""
+	from PyQt4.QtGui import QApplication
+	app = common.application()
+	textEdit = editor.textEdit
+	unpainted = 0
+	for ch in script:
+		QApplication.postEvent(textEdit, key_event(ch))
+		deadline = time.time() + PAINT_TIMEOUT_SECS
+		app.processEvents()
+		while textEdit.keyPressTime is not None:
+			if time.time() > deadline:
+				textEdit.keyPressTime = None
+				unpainted += 1
+				break
+			app.processEvents()
+		if interval:
+			time.sleep(interval / 1000.)
+	return unpainted
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--size", type="int", default=1000000,
+		help="Size of the file to type into, in characters")
+	parser.add_option("--script", help="File with the text to type")
+	parser.add_option("--interval", type="float", default=0,
+		help="Milliseconds to wait between keys")
+	parser.add_option("--repeat", type="int", default=1,
+		help="Number of times to type the script")
+	options, args = parser.parse_args()
+
+	script = DEFAULT_SCRIPT
+	if options.script:
+		script = open(options.script, "rb").read().decode("utf-8")
+
+	from PyQt4.QtCore import QSettings
+	from PyQt4.QtGui import QTextCursor
+	app = common.application()
+	import kurt
+	import latency
+	monitor = latency.start()
+
+	directory = tempfile.mkdtemp()
+	try:
+		settings = QSettings(os.path.join(directory, "kurt.ini"), QSettings.IniFormat)
+		settings.setValue("editor/autosave-msecs", 0)
+		path = os.path.join(directory, "bench_keystrokes.py")
+		f = open(path, "wb")
+		f.write(common.synthetic_python(options.size).encode("utf-8"))
+		f.close()
+
+		win = kurt.MainWindow(settings)
+		win.resize(800, 600)
+		win.show()
+		win.new_tab(path)
+		editor = win.currentTab()
+		while editor.isLoading():
+			app.processEvents()
+
+		# Type at the start of a line in the middle of the file
+		doc = editor.textEdit.document()
+		block = doc.findBlockByNumber(doc.blockCount() / 2)
+		editor.textEdit.setTextCursor(QTextCursor(block))
+		editor.textEdit.ensureCursorVisible()
+		app.processEvents()
+
+		unpainted = 0
+		for i in xrange(options.repeat):
+			unpainted += replay(editor, script, options.interval)
+	finally:
+		shutil.rmtree(directory, True)
+
+	samples = []
+	for each in monitor.samples().values():
+		samples.extend(each)
+	samples.sort()
+	if not samples:
+		print "No key presses were painted"
+		sys.exit(1)
+	print "%d keys: p50 %.1f ms, p99 %.1f ms, max %.1f ms" % (len(samples),
+		latency.percentile(samples, 50), latency.percentile(samples, 99), samples[-1])
+	if unpainted:
+		print "%d keys were not painted within %d ms" % (unpainted,
+			PAINT_TIMEOUT_SECS * 1000)
+
+if __name__ == "__main__":
+	main()
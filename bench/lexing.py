@@ -0,0 +1,141 @@
+#! /usr/bin/env python2.6
+
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Measures the throughput of the lexers in lexers.py, and compares the
+Python lexer with the tokenize-based highlighting that Kurt used before.
+
+Usage: python bench/lexing.py [--size 1000000] [--repeat 3]
+
+The size of the text lexed for each language is in characters. Qt isn't
+needed.
+"""
+
+import keyword
+import optparse
+import StringIO
+import time
+import token
+import tokenize
+
+import common
+import lexers
+
+SAMPLES = {
+	"JavaScript": u"""function total(items) {
+	// Add up the prices
+	var sum = 0;
+	for (var i = 0; i < items.length; i++) {
+		sum += items[i].price * 1.5e2; /* a comment */
+	}
+	return `Total: ${sum}` + 'done' + "!";
+}
+""",
+	"C": u"""#include <stdio.h>
+struct point { int x, y; };
+/* Print a point,
+   with a multi-line comment */
+static void print(struct point *p) {
+	printf("(%d, %d)\\n", p->x, p->y); // A comment
+	char c = 'x'; double d = 3.5e2;
+}
+""",
+	"JSON": u"""{"name": "kurt", "version": 1.5, "tags": ["editor", "qt"],
+ "nested": {"enabled": true, "value": null, "count": -42}},
+""",
+	"Markdown": u"""# A heading
+Some *emphasis*, **strong** text and `code`, with a [link](http://x.org).
+- A list item
+> A quote
+```
+code in a fence
+```
+""",
+	"Shell": u"""#!/bin/sh
+# A comment
+for f in "$@"; do
+	if [ -f "$f" ]; then echo "${f} exists: $HOME"; fi
+done
+run() { local x='quoted'; export PATH=$PATH:/usr/bin; }
+"""
+}
+
+def legacy_tokenize(lines):
+	"""The per-line lexing that PythonHighlighter.highlightBlock did with
+	the tokenize module, before lexers.py."""
+	count = 0
+	for line in lines:
+		stripped_line = line.lstrip()
+		if len(stripped_line) > 0 and stripped_line[0] == "#":
+			count += 1
+			continue
+		f = StringIO.StringIO(line)
+		try:
+			awaiting_decl = False
+			for each in tokenize.generate_tokens(f.readline):
+				token_type, text, start, end, line = each
+				name = token.tok_name[token_type]
+				if name == "STRING":
+					count += 1
+				elif name == "NAME":
+					if text in keyword.kwlist:
+						count += 1
+						awaiting_decl = text in ["def", "class"]
+					elif awaiting_decl:
+						count += 1
+						awaiting_decl = False
+		except tokenize.TokenError:
+			pass
+	return count
+
+def lex_all(lexer, lines):
+	state = 0
+	for line in lines:
+		runs, state = lexer.lex(line, state)
+
+def best_of(repeat, f, *args):
+	times = []
+	for i in xrange(repeat):
+		start = time.time()
+		f(*args)
+		times.append(time.time() - start)
+	return min(times)
+
+def sample(text, size):
+	"""Repeat 'text' until it is about 'size' characters long."""
+	return text * max(1, size / len(text))
+
+def report(name, lines, secs):
+	chars = sum(len(x) + 1 for x in lines)
+	print "%-24s %10.0f lines/s %8.2f MB/s" % (name, len(lines) / secs,
+		chars / secs / (1024 * 1024))
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--size", type="int", default=1000000,
+		help="Characters of text to lex for each language")
+	parser.add_option("--repeat", type="int", default=3,
+		help="Number of times to run each measurement")
+	options, args = parser.parse_args()
+
+	lines = common.synthetic_python(options.size).split("\n")
+	report("Python (tokenize)", lines,
+		best_of(options.repeat, legacy_tokenize, [x.encode("utf-8") for x in lines]))
+	report("Python", lines, best_of(options.repeat, lex_all, lexers.PYTHON, lines))
+
+	for lexer in sorted(lexers.lexers(), key=lambda x: x.name):
+		if lexer.name in SAMPLES:
+			lines = sample(SAMPLES[lexer.name], options.size).split("\n")
+			report(lexer.name, lines, best_of(options.repeat, lex_all, lexer, lines))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,89 @@
+#! /usr/bin/env python2.6
+
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Measures the time the line number gutter spends painting, while
+scrolling and typing, in documents of different lengths. The times should
+be about the same for every length.
+
+Usage: python bench/linenumbers.py [--lines 100,10000,1000000] [--steps 200]
+"""
+
+import optparse
+import time
+
+import common
+
+def measure(lines, steps):
+	"""Return the mean gutter paint time in msecs, per scroll step and per
+	key typed, for a document of 'lines' lines."""
+	from PyQt4.QtGui import QTextCursor
+	import kurt
+	from gutter import LineNumberGutter
+
+	app = common.application()
+	textEdit = kurt.KTextEdit()
+	textEdit.resize(800, 600)
+	text = common.synthetic_python(lines * 25)
+	textEdit.setPlainText(u"\n".join(text.split(u"\n")[:lines]))
+	gutter = LineNumberGutter(textEdit)
+	textEdit.show()
+	app.processEvents()
+
+	# Time the paints themselves, rather than the rest of the event loop
+	paints = []
+	original = gutter.paintEvent
+	def timedPaint(event):
+		start = time.time()
+		original(event)
+		paints.append(time.time() - start)
+	gutter.paintEvent = timedPaint
+
+	def run(action):
+		del paints[:]
+		for i in xrange(steps):
+			action(i)
+			app.processEvents()
+		return sum(paints) * 1000 / steps
+
+	scrollBar = textEdit.verticalScrollBar()
+	middle = scrollBar.maximum() / 2
+	scrollBar.setValue(middle)
+	app.processEvents()
+	scrolling = run(lambda i: scrollBar.setValue(middle + i * 20))
+
+	doc = textEdit.document()
+	cursor = QTextCursor(doc.findBlockByNumber(doc.blockCount() / 2))
+	textEdit.setTextCursor(cursor)
+	textEdit.ensureCursorVisible()
+	app.processEvents()
+	def typeKey(i):
+		textEdit.textCursor().insertText(u"\n" if i % 20 == 19 else u"x")
+	typing = run(typeKey)
+	textEdit.close()
+	return scrolling, typing
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--lines", default="100,10000,1000000",
+		help="Comma-separated document lengths, in lines")
+	parser.add_option("--steps", type="int", default=200,
+		help="Number of scroll steps and keys typed")
+	options, args = parser.parse_args()
+
+	print "%10s %16s %16s" % ("lines", "scroll ms/step", "typing ms/key")
+	for lines in [int(x) for x in options.lines.split(",")]:
+		scrolling, typing = measure(lines, options.steps)
+		print "%10d %16.3f %16.3f" % (lines, scrolling, typing)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,118 @@
+#! /usr/bin/env python2.6
+
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Compares the latency and peak memory use of saving a document with
+saver.SaveJob against the old synchronous save in Editor.save.
+
+Usage: python bench/save.py [--sizes 1,50,500] [--dir DIR]
+
+Sizes are in MB. Each measurement runs in its own process. The peak RSS is
+a high-water mark that building the document already pushes up, so the
+extra memory a save needs is found by comparing its process's peak with
+that of a baseline process that does everything but save.
+"""
+
+from __future__ import with_statement
+
+import optparse
+import os
+import sys
+import tempfile
+import time
+
+import common
+
+def legacy_save(doc, path):
+	"""The save path that Editor.save used before SaveJob: back up the
+	original, convert the whole document, and write it synchronously."""
+	overwrite = os.path.exists(path)
+	if overwrite:
+		temp_path = path + "~"
+		if os.path.exists(temp_path):
+			os.remove(temp_path)
+		os.rename(path, temp_path)
+	with open(path, "wb") as f:
+		f.write(unicode(doc.toPlainText()).encode("utf-8"))
+	if overwrite:
+		os.remove(temp_path)
+
+def atomic_save(doc, path):
+	"""Save with a SaveJob, the way Editor.save does. Returns the time spent
+	blocking the calling (UI) thread."""
+	import saver
+	app = common.application()
+	done = []
+	start = time.time()
+	job = saver.SaveJob(path, doc.toPlainText(), "utf-8", "\n")
+	job.saved.connect(lambda encoding: done.append(True))
+	job.failed.connect(lambda message: done.append(False))
+	job.start()
+	blocking = time.time() - start
+	while not done:
+		app.processEvents()
+		time.sleep(0.001)
+	if not done[0]:
+		raise RuntimeError("Save failed")
+	return blocking
+
+def measure(method, size_mb, directory):
+	from PyQt4.QtGui import QTextDocument
+	common.application()
+	doc = QTextDocument()
+	doc.setPlainText(common.synthetic_python(size_mb * 1024 * 1024))
+	path = os.path.join(directory, "bench-save-%s-%d.py" % (method, size_mb))
+	open(path, "w").close() # Both methods overwrite an existing file
+
+	start = time.time()
+	blocking = None
+	if method == "legacy":
+		blocking = legacy_save(doc, path)
+	elif method == "atomic":
+		blocking = atomic_save(doc, path)
+	total = time.time() - start
+	os.remove(path)
+	return {
+		"method": method,
+		"size_mb": size_mb,
+		"total_secs": total,
+		"blocking_secs": total if blocking is None else blocking,
+		"peak_bytes": common.peak_rss()
+	}
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--sizes", default="1,50,500",
+		help="Comma-separated document sizes, in MB")
+	parser.add_option("--dir", default=tempfile.gettempdir(),
+		help="Directory to save the files in")
+	parser.add_option("--run", nargs=2, help=optparse.SUPPRESS_HELP)
+	options, args = parser.parse_args()
+
+	if options.run:
+		method, size = options.run
+		print common.json.dumps(measure(method, int(size), options.dir))
+		return
+
+	print "%8s  %-7s  %12s  %12s  %12s" % ("size", "method", "blocking", "total", "peak extra")
+	for size in [int(x) for x in options.sizes.split(",")]:
+		baseline = common.run_isolated(__file__, "--dir", options.dir,
+			"--run", "baseline", size)
+		for method in ["legacy", "atomic"]:
+			r = common.run_isolated(__file__, "--dir", options.dir, "--run", method, size)
+			extra = max(0, r["peak_bytes"] - baseline["peak_bytes"])
+			print "%6d MB  %-7s  %10.3f s  %10.3f s  %12s" % (size, method,
+				r["blocking_secs"], r["total_secs"], common.format_size(extra))
+			sys.stdout.flush()
+
+if __name__ == "__main__":
+	main()
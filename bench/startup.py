@@ -0,0 +1,88 @@
+#! /usr/bin/env python2.6
+
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Measures how long `kurt FILE` takes when Kurt is already running, going
+through launcher.py (which doesn't import Qt) and through kurt.py.
+
+Usage: python bench/startup.py [--runs 10]
+
+A stand-in for the running instance listens on the socket, in a temporary
+home directory, so a real instance isn't needed (or disturbed).
+"""
+
+import optparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import common
+import launcher
+
+def fake_instance(path):
+	"""Listen on the socket at 'path', and swallow whatever is sent."""
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	sock.bind(path)
+	sock.listen(5)
+	def run():
+		while True:
+			conn, addr = sock.accept()
+			conn.recv(1024)
+			conn.close()
+	thread = threading.Thread(target=run)
+	thread.setDaemon(True)
+	thread.start()
+	return sock
+
+def time_command(cmd, env, runs):
+	"""Run 'cmd' 'runs' times, and return the times it took, in seconds."""
+	times = []
+	for i in xrange(runs):
+		start = time.time()
+		if subprocess.call(cmd, env=env) != 0:
+			raise RuntimeError("%s failed" % " ".join(cmd))
+		times.append(time.time() - start)
+	return times
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--runs", type="int", default=10,
+		help="Number of times to run each command")
+	options, args = parser.parse_args()
+
+	home = tempfile.mkdtemp()
+	try:
+		env = dict(os.environ, HOME=home)
+		env.pop("XDG_CONFIG_HOME", None)
+		env.pop("APPDATA", None)
+		configDir = os.path.join(home, ".config", launcher.ORGANIZATION)
+		os.makedirs(configDir)
+		fake_instance(launcher.socket_path(configDir))
+
+		filename = os.path.join(home, "file.py")
+		print "%-12s  %10s  %10s" % ("entry point", "mean", "best")
+		for script in ["launcher.py", "kurt.py"]:
+			cmd = [sys.executable, os.path.join(common.SRC_DIR, script), filename]
+			times = time_command(cmd, env, options.runs)
+			print "%-12s  %7.1f ms  %7.1f ms" % (script,
+				sum(times) * 1000 / len(times), min(times) * 1000)
+			sys.stdout.flush()
+	finally:
+		shutil.rmtree(home, True)
+
+if __name__ == "__main__":
+	main()
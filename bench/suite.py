@@ -0,0 +1,348 @@
+#! /usr/bin/env python2.6
+
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Times the editor's hot paths on synthetic Python files of several sizes,
+using real MainWindow and Editor instances.
+
+Usage: python bench/suite.py [--sizes 10000,100000,1000000] [--repeat 3]
+                             [--cases open,find] [--output results.json]
+                             [--compare baseline.json] [--threshold 0.2]
+
+Sizes are in characters. Each case is run --repeat times and the best time
+is kept. With --compare, cases that are more than --threshold (a fraction)
+slower than in the baseline are reported, and the exit status is 1 if there
+are any.
+"""
+
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import common
+
+# Differences smaller than this are treated as noise when comparing
+NOISE_SECS = 0.001
+
+class Fixture(object):
+	"""A MainWindow with its own settings, and a directory of files."""
+
+	def __init__(self):
+		from PyQt4.QtCore import QSettings
+		self.app = common.application()
+		import kurt
+		self.kurt = kurt
+		self.directory = tempfile.mkdtemp()
+		self.settings = QSettings(os.path.join(self.directory, "kurt.ini"),
+			QSettings.IniFormat)
+		self.settings.setValue("tabs/max-live", 0)
+		self.settings.setValue("editor/autosave-msecs", 0)
+		self.win = kurt.MainWindow(self.settings)
+		self.win.show()
+		self._files = {}
+
+	def file(self, size):
+		"""Return the path of a synthetic Python file of 'size' characters."""
+		if size not in self._files:
+			path = os.path.join(self.directory, "bench_suite_%d.py" % size)
+			f = open(path, "wb")
+			f.write(common.synthetic_python(size).encode("utf-8"))
+			f.close()
+			self._files[size] = path
+		return self._files[size]
+
+	def editor(self, size):
+		"""Return a new Editor with the file of 'size' characters loaded."""
+		editor = self.kurt.Editor(self.win)
+		editor.open_file(self.file(size))
+		self.wait(editor.isLoading)
+		return editor
+
+	def highlighted(self, size):
+		"""Return a text edit with the file of 'size' characters, and a
+		Python highlighter for it that highlights every block right away
+		(unlike an Editor's, which leaves that to a HighlightScheduler)."""
+		textEdit = self.kurt.KTextEdit()
+		textEdit.setPlainText(common.synthetic_python(size))
+		highlighter = self.kurt.LexerHighlighter(self.kurt.lexers.PYTHON, textEdit)
+		highlighter.rehighlight()
+		return textEdit, highlighter
+
+	def wait(self, busy, timeout=None):
+		"""Process events until busy() returns False. Returns False if that
+		takes more than 'timeout' seconds."""
+		deadline = timeout and time.time() + timeout
+		while busy():
+			if deadline and time.time() > deadline:
+				return False
+			self.app.processEvents()
+			time.sleep(0.001)
+		return True
+
+	def close(self):
+		self.win.close()
+		shutil.rmtree(self.directory, True)
+
+def best_of(repeat, setup, f):
+	"""Call setup() and then f(setup's result) 'repeat' times, and return
+	the shortest time f took, in seconds."""
+	times = []
+	for i in xrange(repeat):
+		arg = setup()
+		start = time.time()
+		f(arg)
+		times.append(time.time() - start)
+	return min(times)
+
+def case_open(fixture, size, repeat):
+	def run(editor):
+		editor.open_file(fixture.file(size))
+		fixture.wait(editor.isLoading)
+	return best_of(repeat, lambda: fixture.kurt.Editor(fixture.win), run)
+
+def case_highlight_full(fixture, size, repeat):
+	textEdit, highlighter = fixture.highlighted(size)
+	def setup():
+		highlighter._cache.clear() # Measure lexing, not cache hits
+	return best_of(repeat, setup, lambda arg: highlighter.rehighlight())
+
+def case_highlight_incremental(fixture, size, repeat):
+	"""The time to type one character in the middle of a highlighted file."""
+	from PyQt4.QtGui import QTextCursor
+	textEdit, highlighter = fixture.highlighted(size)
+	doc = textEdit.document()
+	edits = 50
+	def run(cursor):
+		for i in xrange(edits):
+			cursor.insertText("x")
+	def setup():
+		block = doc.findBlockByNumber(doc.blockCount() / 2)
+		cursor = QTextCursor(block)
+		cursor.movePosition(QTextCursor.EndOfBlock)
+		return cursor
+	return best_of(repeat, setup, run) / edits
+
+def case_find(fixture, size, repeat):
+	"""The time to find a string near the end of the file, from the start."""
+	from PyQt4.QtGui import QTextCursor
+	editor = fixture.editor(size)
+	findBar = editor.getFindBar()
+	doc = editor.textEdit.document()
+	text = unicode(doc.lastBlock().previous().text()).strip() or u"result"
+	def setup():
+		findBar.lineEdit.setText(text)
+		editor.textEdit.moveCursor(QTextCursor.Start)
+	return best_of(repeat, setup, lambda arg: findBar._findText(text))
+
+def case_count_wide(fixture, size, repeat):
+	"""The time to count the matches of "x" in a file with a character
+	outside the BMP on every line. Also checks that the matches are where
+	QTextDocument.find finds them, since such a character is two positions
+	in the document."""
+	textEdit = fixture.kurt.KTextEdit()
+	lines = common.synthetic_python(size).split(u"\n")
+	textEdit.setPlainText(u"\n".join(u"\U0001F600 " + x for x in lines))
+	doc = textEdit.document()
+	index = textEdit.searchIndex
+	def run(arg):
+		index._key = None # Count from scratch
+		index.count(u"x")
+	result = best_of(repeat, lambda: None, run)
+	expected = []
+	cursor = doc.find(u"x")
+	while not cursor.isNull() and len(expected) < 100:
+		expected.append((cursor.selectionStart(), cursor.selectionEnd()))
+		cursor = doc.find(u"x", cursor)
+	found = index.matchesIn(0, doc.characterCount(), u"x")[:len(expected)]
+	assert found == expected, "Match positions don't agree with the document"
+	return result
+
+def case_replace_all(fixture, size, repeat):
+	"""The time to replace every "x" in the file (six in every ten lines)."""
+	editor = fixture.editor(size)
+	findBar = editor.getFindBar()
+	doc = editor.textEdit.document()
+	def setup():
+		if doc.isUndoAvailable():
+			doc.undo() # Undo the previous run
+		findBar.lineEdit.setText("x")
+		findBar.replaceEdit.setText("value")
+	return best_of(repeat, setup, lambda arg: findBar._replaceAll())
+
+def case_indent(fixture, size, repeat):
+	"""The time to indent every line with Tab."""
+	from PyQt4.QtCore import QEvent, Qt
+	from PyQt4.QtGui import QKeyEvent
+	editor = fixture.editor(size)
+	textEdit = editor.textEdit
+	doc = textEdit.document()
+	def setup():
+		if doc.isUndoAvailable():
+			doc.undo() # Undo the previous run
+		textEdit.selectAll()
+	event = QKeyEvent(QEvent.KeyPress, Qt.Key_Tab, Qt.NoModifier)
+	return best_of(repeat, setup, lambda arg: textEdit.keyPressEvent(event))
+
+def case_save(fixture, size, repeat):
+	from PyQt4.QtGui import QTextCursor
+	editor = fixture.editor(size)
+	def setup():
+		# Only modified documents are saved
+		QTextCursor(editor.textEdit.document()).insertText("#")
+	return best_of(repeat, setup, lambda arg: editor.save(wait=True))
+
+def case_reload(fixture, size, repeat):
+	"""The time to bring an open file up to date after another program adds
+	a line at the top of it. Also checks that its symbols move down too."""
+	path = os.path.join(fixture.directory, "bench_reload_%d.py" % size)
+	text = common.synthetic_python(size)
+	index = fixture.win.symbolIndex
+	def write(text):
+		f = open(path, "wb")
+		f.write(text.encode("utf-8"))
+		f.close()
+	times = []
+	for i in xrange(repeat):
+		while fixture.win.tabWidget.count():
+			fixture.win.tabWidget.removeTab(0)
+		index.remove(path) # Left from the last run
+		write(text)
+		editor = fixture.win.new_tab(path)
+		fixture.wait(editor.isLoading)
+		key = editor._symbolKey
+		fixture.wait(lambda: not index.symbols(key))
+		expected = [(name, kind, line + 1) for name, kind, line in index.symbols(key)]
+		write(u"# Changed by another program\n" + text)
+		first = editor.textEdit.document().firstBlock
+		start = time.time()
+		editor.diskChanged()
+		fixture.wait(lambda: not unicode(first().text()).startswith(u"# Changed"))
+		times.append(time.time() - start)
+		assert fixture.wait(lambda: index.symbols(key) != expected, 10), \
+			"The symbols weren't updated when the file was reloaded"
+	return min(times)
+
+def case_restore(fixture, size, repeat):
+	"""The time to restore a session of 50 tabs, of which only the current
+	one is loaded."""
+	tabs = [(fixture.file(size), None)] * 50
+	def setup():
+		while fixture.win.tabWidget.count():
+			fixture.win.tabWidget.removeTab(0)
+	return best_of(repeat, setup, lambda arg: fixture.win.restore_tabs(tabs))
+
+def case_tabs(fixture, size, repeat):
+	"""The time to open the file in a new tab, per tab."""
+	count = 20
+	path = fixture.file(size)
+	def run(arg):
+		for i in xrange(count):
+			fixture.win.new_tab(path)
+		fixture.app.processEvents()
+	def setup():
+		while fixture.win.tabWidget.count():
+			fixture.win.tabWidget.removeTab(0)
+	return best_of(repeat, setup, run) / count
+
+CASES = [
+	("open", case_open),
+	("highlight-full", case_highlight_full),
+	("highlight-incremental", case_highlight_incremental),
+	("find", case_find),
+	("count-wide", case_count_wide),
+	("replace-all", case_replace_all),
+	("indent", case_indent),
+	("save", case_save),
+	("reload", case_reload),
+	("restore", case_restore),
+	("tabs", case_tabs)
+]
+
+def run_suite(names, sizes, repeat):
+	"""Run the named cases for each size, and return a dict mapping
+	"case/size" to the time in seconds."""
+	fixture = Fixture()
+	results = {}
+	try:
+		for name, case in CASES:
+			if name not in names:
+				continue
+			for size in sizes:
+				key = "%s/%d" % (name, size)
+				results[key] = case(fixture, size, repeat)
+				print "%-32s  %10.3f ms" % (key, results[key] * 1000)
+				sys.stdout.flush()
+	finally:
+		fixture.close()
+	return results
+
+def compare(results, baseline, threshold):
+	"""Print how 'results' compare to 'baseline', and return the keys of
+	the cases that regressed by more than 'threshold'."""
+	regressions = []
+	print
+	print "%-32s  %10s  %10s  %8s" % ("case", "baseline", "now", "change")
+	for key in sorted(results):
+		if key not in baseline:
+			continue
+		before, now = baseline[key], results[key]
+		change = (now - before) / before if before else 0
+		flag = ""
+		if change > threshold and now - before > NOISE_SECS:
+			regressions.append(key)
+			flag = "  REGRESSION"
+		print "%-32s  %7.3f ms  %7.3f ms  %+7.1f%%%s" % (key, before * 1000,
+			now * 1000, change * 100, flag)
+	return regressions
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--sizes", default="10000,100000,1000000",
+		help="Comma-separated file sizes, in characters")
+	parser.add_option("--repeat", type="int", default=3,
+		help="Number of times to run each case")
+	parser.add_option("--cases", default=",".join(x[0] for x in CASES),
+		help="Comma-separated names of the cases to run")
+	parser.add_option("--output", help="File to write the results to, as JSON")
+	parser.add_option("--compare", metavar="BASELINE",
+		help="Results file (from --output) to compare against")
+	parser.add_option("--threshold", type="float", default=0.2,
+		help="Slowdown, as a fraction, that counts as a regression")
+	options, args = parser.parse_args()
+
+	names = options.cases.split(",")
+	unknown = set(names) - set(x[0] for x in CASES)
+	if unknown:
+		parser.error("Unknown cases: %s" % ", ".join(sorted(unknown)))
+	sizes = [int(x) for x in options.sizes.split(",")]
+
+	results = run_suite(names, sizes, options.repeat)
+	if options.output:
+		f = open(options.output, "w")
+		try:
+			common.json.dump({"sizes": sizes, "repeat": options.repeat,
+				"results": results}, f, indent=2, sort_keys=True)
+		finally:
+			f.close()
+
+	if options.compare:
+		baseline = common.json.load(open(options.compare))["results"]
+		regressions = compare(results, baseline, options.threshold)
+		if regressions:
+			print "\n%d regressions" % len(regressions)
+			sys.exit(1)
+
+if __name__ == "__main__":
+	main()
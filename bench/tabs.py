@@ -0,0 +1,95 @@
+#! /usr/bin/env python2.6
+
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Measures what each open tab costs: the time to open a file in a new tab,
+and the memory the tab adds.
+
+Usage: python bench/tabs.py [--tabs 1000] [--size 2000] [--hibernate]
+
+The size of each file is in characters. Unless --hibernate is given, tab
+hibernation is turned off, so that every tab stays loaded.
+"""
+
+import optparse
+import os
+import shutil
+import tempfile
+import time
+
+import common
+
+def measure(count, size, hibernate):
+	from PyQt4.QtCore import QSettings
+	app = common.application()
+	import kurt
+
+	directory = tempfile.mkdtemp()
+	try:
+		settings = QSettings(os.path.join(directory, "kurt.ini"), QSettings.IniFormat)
+		if not hibernate:
+			settings.setValue("tabs/max-live", 0)
+
+		text = common.synthetic_python(size).encode("utf-8")
+		paths = []
+		for i in xrange(count):
+			path = os.path.join(directory, "bench_tabs_%d.py" % i)
+			f = open(path, "wb")
+			f.write(text)
+			f.close()
+			paths.append(path)
+
+		win = kurt.MainWindow(settings)
+		win.show()
+		app.processEvents()
+
+		rss_before = common.current_rss()
+		start = time.time()
+		for path in paths:
+			win.new_tab(path)
+		app.processEvents()
+		elapsed = time.time() - start
+		rss_after = common.current_rss()
+	finally:
+		shutil.rmtree(directory, True)
+
+	return {
+		"tabs": count,
+		"total_secs": elapsed,
+		"secs_per_tab": elapsed / count,
+		"bytes_per_tab": max(0, rss_after - rss_before) / count
+	}
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--tabs", type="int", default=1000,
+		help="Number of tabs to open")
+	parser.add_option("--size", type="int", default=2000,
+		help="Size of each file, in characters")
+	parser.add_option("--hibernate", action="store_true",
+		help="Leave tab hibernation on")
+	parser.add_option("--run", action="store_true", help=optparse.SUPPRESS_HELP)
+	options, args = parser.parse_args()
+
+	if options.run:
+		print common.json.dumps(measure(options.tabs, options.size, options.hibernate))
+		return
+
+	args = ["--run", "--tabs", options.tabs, "--size", options.size]
+	if options.hibernate:
+		args.append("--hibernate")
+	r = common.run_isolated(__file__, *args)
+	print "%d tabs in %.2f s: %.2f ms and %s per tab" % (r["tabs"], r["total_secs"],
+		r["secs_per_tab"] * 1000, common.format_size(r["bytes_per_tab"]))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,87 @@
+#! /usr/bin/env python2.6
+
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Measures looking up prefixes in the WordIndex used for completion, and
+updating it as documents are edited.
+
+Usage: python bench/words.py [--words 500000] [--documents 20]
+"""
+
+import optparse
+import random
+import time
+
+import common
+from completion import WordIndex
+
+LETTERS = "abcdefghijklmnopqrstuvwxyz_"
+
+def random_words(count, rnd):
+	words = set()
+	while len(words) < count:
+		words.add("".join(rnd.choice(LETTERS) for i in xrange(rnd.randint(3, 14))))
+	return list(words)
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--words", type="int", default=500000,
+		help="Number of distinct words to index")
+	parser.add_option("--documents", type="int", default=20,
+		help="Number of documents to spread them over")
+	options, args = parser.parse_args()
+
+	rnd = random.Random(0)
+	words = random_words(options.words, rnd)
+	index = WordIndex()
+	start = time.time()
+	per = len(words) / options.documents + 1
+	for i in xrange(options.documents):
+		index.update(i, [], words[i * per:(i + 1) * per])
+	index.complete("")
+	print "Indexed %d words in %.0f ms" % (len(index), (time.time() - start) * 1000)
+
+	for length in (1, 2, 3, 5):
+		prefixes = [x[:length] for x in rnd.sample(words, 1000)]
+		start = time.time()
+		for prefix in prefixes:
+			index.complete(prefix)
+		print "Lookup, %d char prefix: %8.3f ms" % (length,
+			(time.time() - start) * 1000 / len(prefixes))
+
+	# Typing a word: each key press replaces the word being typed
+	word = "completion_benchmark"
+	start = time.time()
+	for i in xrange(3, len(word)):
+		index.update(0, [word[:i]], [word[:i + 1]])
+		index.complete(word[:3])
+	print "Edit and lookup:         %8.3f ms" % ((time.time() - start) * 1000
+		/ (len(word) - 3))
+
+	# Typing a longer word without looking up in between, so that the
+	# sorted list is rebuilt in one go, and most of the words typed along
+	# the way have already gone again
+	word = "Transient_" * 10 # Capitalized, unlike the random words
+	start = time.time()
+	for i in xrange(3, len(word)):
+		index.update(0, [word[:i]], [word[:i + 1]])
+	index.complete(word[:3])
+	print "Edits, then lookup:      %8.3f ms" % ((time.time() - start) * 1000)
+	assert index.complete(word[:3]) == [word], "Words that have gone were offered"
+
+	start = time.time()
+	index.release(0)
+	index.complete("")
+	print "Closing a document:      %8.3f ms" % ((time.time() - start) * 1000)
+
+if __name__ == "__main__":
+	main()
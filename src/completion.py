@@ -0,0 +1,277 @@
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Word completion from the identifiers in all of the open documents.
+
+A WordIndex is shared by all the tabs in a window. Each document has a
+DocumentWords, which keeps the words of each of its blocks and, when the
+document changes, re-tokenizes only the blocks that changed and tells the
+index which words came and went. That includes a file that's loading, so
+each batch of text it's loaded in is tokenized as it's appended. A
+Completer shows the candidates for the word before the cursor in a popup.
+"""
+
+import bisect
+import re
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+
+from util import *
+
+__all__ = ["WordIndex", "DocumentWords", "Completer", "words_in"]
+
+# Shorter words aren't worth completing
+MIN_WORD_LENGTH = 3
+
+_WORD_RE = re.compile(r"\b[^\W\d]\w{%d,}" % (MIN_WORD_LENGTH - 1), re.UNICODE)
+
+def words_in(text):
+	"""Return a tuple of the words (identifiers) in 'text'."""
+	return tuple(_WORD_RE.findall(text))
+
+class WordIndex(object):
+	"""The words of any number of documents, each identified by a key, with
+	how often each word occurs. The distinct words are also kept in a
+	sorted list, so that looking up a prefix is a binary search."""
+
+	# Changes to the sorted list are made one at a time up to this many;
+	# beyond that, it's quicker to rebuild it
+	MAX_SINGLE_UPDATES = 64
+
+	# Most words starting with a prefix that are ranked for completion, which
+	# keeps looking up a short prefix quick
+	MAX_CANDIDATES = 500
+
+	def __init__(self):
+		self._counts = {} # Maps each word to the number of times it occurs
+		self._documents = {} # Maps each key to the counts for its document
+		self._sorted = [] # The distinct words, sorted
+		self._added = [] # Words not yet in _sorted
+		self._removed = set() # Words still in _sorted that have gone
+
+	def __len__(self):
+		return len(self._counts)
+
+	def update(self, key, removed, added):
+		"""Record that the words in the list 'removed' are no longer in the
+		document identified by 'key', and those in 'added' are."""
+		delta = {}
+		for word in removed:
+			delta[word] = delta.get(word, 0) - 1
+		for word in added:
+			delta[word] = delta.get(word, 0) + 1
+		document = self._documents.setdefault(key, {})
+		for word, n in delta.iteritems():
+			if n:
+				self._change(document, word, n)
+
+	def release(self, key):
+		"""Remove all the words of the document identified by 'key'."""
+		document = self._documents.pop(key, {})
+		for word, n in document.items():
+			self._change(document, word, -n)
+
+	def _change(self, document, word, n):
+		count = document.get(word, 0) + n
+		if count > 0:
+			document[word] = count
+		else:
+			document.pop(word, None)
+		total = self._counts.get(word, 0) + n
+		if total > 0:
+			if word not in self._counts:
+				if word in self._removed:
+					self._removed.discard(word)
+				else:
+					self._added.append(word)
+			self._counts[word] = total
+		elif word in self._counts:
+			del self._counts[word]
+			self._removed.add(word)
+
+	def _sync(self):
+		# Bring the sorted list up to date
+		if len(self._added) + len(self._removed) <= self.MAX_SINGLE_UPDATES:
+			for word in self._removed:
+				i = bisect.bisect_left(self._sorted, word)
+				if i < len(self._sorted) and self._sorted[i] == word:
+					del self._sorted[i]
+			for word in self._added:
+				if word in self._counts:
+					bisect.insort(self._sorted, word)
+		else:
+			if self._removed:
+				removed = self._removed
+				self._sorted = [x for x in self._sorted if x not in removed]
+			# Words may have come and gone again since they were added
+			added = [x for x in self._added if x in self._counts]
+			# Sorting two sorted runs is a linear merge
+			added.sort()
+			self._sorted.extend(added)
+			self._sorted.sort()
+		self._added = []
+		self._removed = set()
+
+	def complete(self, prefix, limit=50):
+		"""Return up to 'limit' words that start with 'prefix' (and are
+		longer than it), the most common first."""
+		if self._added or self._removed:
+			self._sync()
+		words = self._sorted
+		i = bisect.bisect_left(words, prefix)
+		end = min(len(words), i + self.MAX_CANDIDATES)
+		candidates = []
+		while i < end and words[i].startswith(prefix):
+			if len(words[i]) > len(prefix):
+				candidates.append((-self._counts[words[i]], words[i]))
+			i += 1
+		if len(candidates) > limit:
+			candidates.sort()
+		return [x[1] for x in candidates[:limit]]
+
+class DocumentWords(QObject):
+	"""Keeps the words of a QTextDocument in a WordIndex as it changes."""
+
+	def __init__(self, index, document, key, parent=None):
+		QObject.__init__(self, parent)
+		self.index = index
+		self.key = key
+		self._document = document
+		self._blocks = [] # The words of each block
+		self._closed = False
+		safe_connect(document.contentsChange, self._contentsChange)
+		self.rescan()
+
+	def rescan(self):
+		"""Re-tokenize the whole document."""
+		old = self._allWords()
+		self._blocks = []
+		block = self._document.begin()
+		while block.isValid():
+			self._blocks.append(words_in(unicode(block.text())))
+			block = block.next()
+		self.index.update(self.key, old, self._allWords())
+
+	def _allWords(self):
+		result = []
+		for each in self._blocks:
+			result.extend(each)
+		return result
+
+	def close(self):
+		"""Remove the document's words from the index."""
+		self._closed = True
+		self._blocks = []
+		self.index.release(self.key)
+
+	def _contentsChange(self, position, removed, added):
+		if self._closed:
+			return
+		doc = self._document
+		end = min(position + added, doc.characterCount() - 1)
+		first = doc.findBlock(position)
+		last = doc.findBlock(end)
+		if not first.isValid() or not last.isValid():
+			self.rescan()
+			return
+		# The changed blocks replaced the blocks from 'first' to 'oldLast'
+		oldLast = last.blockNumber() - (doc.blockCount() - len(self._blocks))
+		if oldLast < first.blockNumber() - 1 or oldLast >= len(self._blocks):
+			self.rescan()
+			return
+		new = []
+		block = first
+		while True:
+			new.append(words_in(unicode(block.text())))
+			if block == last:
+				break
+			block = block.next()
+		start = first.blockNumber()
+		old = self._blocks[start:oldLast + 1]
+		if old == new:
+			return # E.g. only the formatting changed
+		self._blocks[start:oldLast + 1] = new
+		removedWords = []
+		for each in old:
+			removedWords.extend(each)
+		addedWords = []
+		for each in new:
+			addedWords.extend(each)
+		self.index.update(self.key, removedWords, addedWords)
+
+class Completer(QCompleter):
+	"""A popup of the completions for the word before the cursor in a text
+	edit. The text edit must pass on key presses as described in
+	keyPressed()."""
+
+	def __init__(self, textEdit, index):
+		QCompleter.__init__(self, textEdit)
+		self.textEdit = textEdit
+		self.index = index
+		self._start = None # Where the word being completed starts
+		self.setModel(QStringListModel(self))
+		self.setWidget(textEdit)
+		self.setCompletionMode(QCompleter.PopupCompletion)
+		self.setCaseSensitivity(Qt.CaseSensitive)
+		safe_connect(self.activated[str], self._insert)
+
+	def _prefix(self):
+		cursor = self.textEdit.textCursor()
+		block = cursor.block()
+		text = unicode(block.text())[:cursor.position() - block.position()]
+		match = re.search(r"\w+$", text, re.UNICODE)
+		return match.group() if match else u""
+
+	def start(self):
+		"""Complete the word before the cursor. If there is only one
+		candidate, it is inserted right away."""
+		prefix = self._prefix()
+		if not prefix:
+			return
+		candidates = self.index.complete(prefix)
+		if not candidates:
+			return
+		if len(candidates) == 1:
+			self.textEdit.textCursor().insertText(candidates[0][len(prefix):])
+			return
+		self._start = self.textEdit.textCursor().position() - len(prefix)
+		self.model().setStringList(candidates)
+		self._showPopup(prefix)
+
+	def _showPopup(self, prefix):
+		self.setCompletionPrefix(prefix)
+		popup = self.popup()
+		popup.setCurrentIndex(self.completionModel().index(0, 0))
+		rect = self.textEdit.cursorRect()
+		rect.setWidth(popup.sizeHintForColumn(0)
+			+ popup.verticalScrollBar().sizeHint().width())
+		self.complete(rect)
+
+	def keyPressed(self):
+		"""Called by the text edit after it handles a key press while the
+		popup is showing, to narrow down the completions. (It should ignore
+		Return, Enter, Tab, Backtab and Escape in that case, which are
+		handled by QCompleter.)"""
+		prefix = self._prefix()
+		cursor = self.textEdit.textCursor()
+		if not prefix or cursor.position() - len(prefix) != self._start:
+			self.popup().hide()
+			return
+		self._showPopup(prefix)
+		if self.completionCount() == 0:
+			self.popup().hide()
+
+	def _insert(self, completion):
+		completion = unicode(completion)
+		prefix = self._prefix()
+		if completion.startswith(prefix):
+			self.textEdit.textCursor().insertText(completion[len(prefix):])
@@ -0,0 +1,309 @@
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Searching the files in a directory tree.
+
+A thread walks the tree, skipping anything excluded by .gitignore files,
+and hands the files out in batches to a pool of processes. Each process
+memory-maps the files and searches them with the re module, so the GUI
+thread only ever sees the matches.
+
+The pool is shared by all searches, and is started by start_pool() on the
+UI thread before any other threads are. Creating it forks the process, and
+forking while other threads are running can leave the children with locks
+that will never be released (in Qt, the logging module, etc.).
+"""
+
+import fnmatch
+import logging
+import mmap
+import multiprocessing
+import os
+import Queue
+import re
+import thread
+
+from PyQt4.QtCore import *
+
+from util import *
+
+__all__ = ["FindInFilesJob", "IgnoreRules", "find_lines", "start_pool",
+	"stop_pool"]
+
+# Number of files handed to a worker process at a time
+BATCH_SIZE = 64
+
+# Stop searching a file after this many matching lines
+MAX_MATCHES_PER_FILE = 1000
+
+# Matching lines are cut off at this many characters for display
+MAX_LINE_LENGTH = 300
+
+# Files that start with a NUL byte in this many bytes are assumed binary
+BINARY_CHECK_SIZE = 8192
+
+def find_lines(data, compiled, limit=MAX_MATCHES_PER_FILE):
+	"""Search 'data' (a string or mmap) for the compiled regular expression.
+	Returns a list of (line, column, text) for each matching line, where
+	'line' is 1-based and 'text' is the line itself."""
+	results = []
+	line = 1
+	last = 0
+	for match in compiled.finditer(data):
+		start = match.start()
+		line += data[last:start].count("\n")
+		last = start
+		if results and results[-1][0] == line:
+			continue # Only report each line once
+		lineStart = data.rfind("\n", 0, start) + 1
+		lineEnd = data.find("\n", start)
+		if lineEnd < 0:
+			lineEnd = len(data)
+		text = data[lineStart:min(lineEnd, lineStart + MAX_LINE_LENGTH)]
+		results.append((line, start - lineStart, text.rstrip("\r")))
+		if len(results) >= limit:
+			break
+	return results
+
+def _search_file(path, compiled):
+	try:
+		f = open(path, "rb")
+	except IOError:
+		return []
+	try:
+		if os.fstat(f.fileno()).st_size == 0:
+			return []
+		data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	except (EnvironmentError, ValueError):
+		f.close()
+		return []
+	try:
+		if "\0" in data[:BINARY_CHECK_SIZE]:
+			return []
+		results = []
+		for line, column, text in find_lines(data, compiled):
+			column = len(text[:column].decode("utf-8", "replace"))
+			results.append((line, column, text.decode("utf-8", "replace")))
+		return results
+	finally:
+		data.close()
+		f.close()
+
+_compiled = {}
+
+def _search_files(args):
+	"""Search a batch of files. Runs in a worker process."""
+	paths, pattern, flags = args
+	if (pattern, flags) not in _compiled:
+		_compiled[(pattern, flags)] = re.compile(pattern, flags)
+	compiled = _compiled[(pattern, flags)]
+	results = []
+	for path in paths:
+		matches = _search_file(path, compiled)
+		if matches:
+			results.append((path, matches))
+	return len(paths), results
+
+_pool = None
+
+def start_pool():
+	"""Start the worker processes, if they haven't been. Call this on the
+	UI thread before starting any other threads."""
+	global _pool
+	if _pool is None:
+		_pool = multiprocessing.Pool()
+	return _pool
+
+def stop_pool():
+	global _pool
+	if _pool is not None:
+		_pool.terminate()
+		_pool.join()
+		_pool = None
+
+class IgnoreRules(object):
+	"""The exclude patterns that apply to one directory: the ones from its
+	own .gitignore, and the ones inherited from its parents. Supports the
+	common subset of the .gitignore syntax: globs, negation with '!',
+	directory-only patterns ending in '/', and patterns anchored to their
+	directory by a '/'."""
+
+	def __init__(self, rules=()):
+		# A list of (directory, pattern, negated, dirOnly, anchored)
+		self._rules = list(rules)
+
+	def add(self, directory, line):
+		line = line.rstrip("\r\n")
+		if not line.strip() or line.startswith("#"):
+			return
+		line = line.rstrip()
+		negated = line.startswith("!")
+		if negated:
+			line = line[1:]
+		dirOnly = line.endswith("/")
+		line = line.rstrip("/")
+		if line.startswith("**/"):
+			line = line[3:]
+		anchored = "/" in line
+		self._rules.append((directory, line.lstrip("/"), negated, dirOnly, anchored))
+
+	def child(self, directory):
+		"""Return the rules for a subdirectory, including its .gitignore."""
+		rules = self
+		filename = os.path.join(directory, ".gitignore")
+		if os.path.isfile(filename):
+			rules = IgnoreRules(self._rules)
+			try:
+				f = open(filename, "rb")
+				try:
+					for line in f:
+						rules.add(directory, line)
+				finally:
+					f.close()
+			except IOError, e:
+				logging.warning("Couldn't read %s: %s" % (filename, e))
+		return rules
+
+	def ignored(self, path, isDir=False):
+		result = False
+		name = os.path.basename(path)
+		for directory, pattern, negated, dirOnly, anchored in self._rules:
+			if dirOnly and not isDir:
+				continue
+			if anchored:
+				relpath = os.path.relpath(path, directory).replace(os.sep, "/")
+				matched = fnmatch.fnmatch(relpath, pattern)
+			else:
+				matched = fnmatch.fnmatch(name, pattern)
+			if matched:
+				result = not negated
+		return result
+
+class FindInFilesJob(QObject):
+	"""Searches a directory tree in the background. Results are delivered
+	on the UI thread, in batches, through the resultsFound signal."""
+
+	# Emitted with a list of (path, matches), where matches is a list of
+	# (line, column, text) tuples as returned by find_lines
+	resultsFound = pyqtSignal(object)
+
+	# Emitted with the number of files searched so far
+	progress = pyqtSignal(int)
+
+	finished = pyqtSignal()
+
+	DRAIN_INTERVAL_MSECS = 50
+
+	def __init__(self, root, pattern, regex=False, caseSensitive=True,
+			excludes=(), skip=(), parent=None):
+		"""Search for 'pattern' in the files under 'root'. 'excludes' is a
+		list of extra .gitignore-style patterns, and 'skip' is a collection
+		of paths not to search (e.g. because they are open in the editor)."""
+		QObject.__init__(self, parent)
+		self.root = os.path.abspath(root)
+		if not regex:
+			pattern = re.escape(pattern)
+		# Files are searched as bytes, assuming they are UTF-8
+		self._pattern = unicode(pattern).encode("utf-8")
+		self._flags = re.MULTILINE | (0 if caseSensitive else re.IGNORECASE)
+		re.compile(self._pattern, self._flags) # Raise re.error now if invalid
+
+		self._rules = IgnoreRules()
+		for each in excludes:
+			self._rules.add(self.root, each)
+		self._skip = set(skip)
+
+		self._queue = Queue.Queue()
+		self._cancelled = False
+		self._running = False
+		self._searched = 0
+
+		self._timer = QTimer(self)
+		safe_connect(self._timer.timeout, self._drain)
+
+	def start(self):
+		self._running = True
+		# Normally it's already running; see start_pool()
+		pool = start_pool()
+		thread.start_new_thread(self._run, (pool,))
+		self._timer.start(self.DRAIN_INTERVAL_MSECS)
+
+	def cancel(self):
+		"""Stop searching. No more signals will be emitted after this."""
+		self._cancelled = True
+		self._running = False
+		self._timer.stop()
+
+	def isRunning(self):
+		return self._running
+
+	def _batches(self):
+		# os.walk visits a directory before its subdirectories, so the rules
+		# for the parent are always known by the time a child is visited
+		rulesByDir = {}
+		root = self.root
+		paths = []
+		for dirpath, dirnames, filenames in os.walk(root):
+			if self._cancelled:
+				return
+			parent = rulesByDir.pop(dirpath, self._rules)
+			rules = parent.child(dirpath)
+			dirnames[:] = [x for x in sorted(dirnames) if x != ".git"
+				and not rules.ignored(os.path.join(dirpath, x), True)]
+			for name in dirnames:
+				rulesByDir[os.path.join(dirpath, name)] = rules
+			for name in sorted(filenames):
+				path = os.path.join(dirpath, name)
+				if path in self._skip or rules.ignored(path):
+					continue
+				paths.append(path)
+				if len(paths) >= BATCH_SIZE:
+					yield paths, self._pattern, self._flags
+					paths = []
+		if paths:
+			yield paths, self._pattern, self._flags
+
+	def _run(self, pool):
+		# Once cancelled, _batches() stops handing out files, so the pool is
+		# soon free for the next search
+		try:
+			try:
+				for count, results in pool.imap_unordered(_search_files, self._batches()):
+					if self._cancelled:
+						break
+					self._queue.put((count, results))
+			except Exception, e:
+				logging.error("Error searching %s: %s" % (self.root, e))
+		finally:
+			self._queue.put(None)
+
+	def _drain(self):
+		results = []
+		done = False
+		try:
+			while True:
+				item = self._queue.get_nowait()
+				if item is None:
+					done = True
+					break
+				count, batch = item
+				self._searched += count
+				results.extend(batch)
+		except Queue.Empty:
+			pass
+		if self._cancelled:
+			return
+		if results:
+			self.resultsFound.emit(results)
+		self.progress.emit(self._searched)
+		if done:
+			self.cancel()
+			self.finished.emit()
@@ -0,0 +1,172 @@
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""A gutter showing line numbers beside a QTextEdit.
+
+The gutter sits in a viewport margin of the text edit. It only ever looks
+at the blocks on screen: the first one is found by hit-testing the top of
+the viewport, and the rest by walking forward from it. The position and
+number of each visible block is cached until the layout changes or the
+view scrolls. Numbers are drawn from pixmaps of the ten digits, rendered
+once per font.
+
+Repaints are driven by the document layout's update signal, which covers
+only the part of the document that was laid out again, so typing within a
+line repaints (at most) that line's strip of the gutter. Scrolling moves
+the pixels already drawn and only paints the strip that scrolled in.
+"""
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+
+from util import *
+
+__all__ = ["LineNumberGutter"]
+
+class LineNumberGutter(QWidget):
+	"""Line numbers for 'textEdit', drawn in 'font' (by default, the text
+	edit's font)."""
+
+	# Space on either side of the numbers, in pixels
+	PADDING = 4
+
+	# The gutter is always wide enough for this many digits
+	MIN_DIGITS = 3
+
+	def __init__(self, textEdit, font=None):
+		QWidget.__init__(self, textEdit)
+		self.textEdit = textEdit
+		self._digits = None # Pixmaps of 0-9
+		self._digitWidth = 0
+		self._digitCount = 0
+		self._blocks = None # (top, height, number) of each visible block
+		self._scroll = textEdit.verticalScrollBar().value()
+		self.setFont(font or textEdit.font())
+
+		doc = textEdit.document()
+		safe_connect(doc.documentLayout().update, self._layoutUpdated)
+		safe_connect(doc.blockCountChanged, self._blockCountChanged)
+		safe_connect(textEdit.verticalScrollBar().valueChanged, self._scrolled)
+		textEdit.installEventFilter(self)
+		self._blockCountChanged(doc.blockCount())
+
+	@pyqt_override
+	def changeEvent(self, event):
+		if event.type() == QEvent.FontChange:
+			self._digits = None
+			self._updateWidth(True)
+		QWidget.changeEvent(self, event)
+
+	def _renderDigits(self):
+		metrics = self.fontMetrics()
+		self._digitWidth = max(metrics.width(str(x)) for x in xrange(10))
+		color = self.palette().color(QPalette.Disabled, QPalette.Text)
+		self._digits = []
+		for i in xrange(10):
+			pixmap = QPixmap(self._digitWidth, metrics.height())
+			pixmap.fill(Qt.transparent)
+			p = QPainter(pixmap)
+			p.setFont(self.font())
+			p.setPen(color)
+			p.drawText(pixmap.rect(), Qt.AlignRight | Qt.AlignVCenter, str(i))
+			p.end()
+			self._digits.append(pixmap)
+
+	def gutterWidth(self):
+		if self._digits is None:
+			self._renderDigits()
+		return self._digitCount * self._digitWidth + 2 * self.PADDING
+
+	def _blockCountChanged(self, count):
+		digits = max(self.MIN_DIGITS, len(str(count)))
+		if digits != self._digitCount:
+			self._digitCount = digits
+			self._updateWidth(False)
+
+	def _updateWidth(self, force):
+		width = self.gutterWidth()
+		if force or width != self.width():
+			self.textEdit.setViewportMargins(width, 0, 0, 0)
+			self._place()
+			self.update()
+
+	def _place(self):
+		rect = self.textEdit.contentsRect()
+		self.setGeometry(rect.left(), rect.top(), self.gutterWidth(), rect.height())
+
+	@pyqt_override
+	def eventFilter(self, obj, event):
+		if event.type() == QEvent.Resize:
+			self._place()
+			self._blocks = None
+		return False
+
+	def _scrolled(self, value):
+		dy = self._scroll - value
+		self._scroll = value
+		self._blocks = None
+		if abs(dy) < self.height():
+			self.scroll(0, dy)
+		else:
+			self.update()
+
+	def _layoutUpdated(self, rect):
+		# 'rect' is in document coordinates
+		self._blocks = None
+		top = int(rect.top()) - self._scroll
+		if top >= self.height() or rect.bottom() - self._scroll < 0:
+			return
+		height = min(int(rect.height()) + 1, self.height() - max(top, 0))
+		self.update(0, max(top, 0), self.width(), height)
+
+	def _visibleBlocks(self):
+		"""Return (top, height, number) for each block in the viewport, where
+		'top' is in gutter coordinates and 'number' is 1-based."""
+		if self._blocks is not None:
+			return self._blocks
+		blocks = []
+		layout = self.textEdit.document().documentLayout()
+		block = self.textEdit.cursorForPosition(QPoint(0, 0)).block()
+		number = block.blockNumber() + 1
+		bottom = self.height()
+		while block.isValid():
+			if block.isVisible():
+				rect = layout.blockBoundingRect(block)
+				top = int(rect.top()) - self._scroll
+				if top >= bottom:
+					break
+				lines = block.layout()
+				lineHeight = int(lines.lineAt(0).height()) if lines.lineCount() else int(rect.height())
+				blocks.append((top, lineHeight, number))
+			block = block.next()
+			number += 1
+		self._blocks = blocks
+		return blocks
+
+	@pyqt_override
+	def paintEvent(self, event):
+		if self._digits is None:
+			self._renderDigits()
+		p = QPainter(self)
+		exposed = event.rect()
+		p.fillRect(exposed, self.palette().color(QPalette.Window))
+		digitHeight = self._digits[0].height()
+		right = self.width() - self.PADDING
+		for top, height, number in self._visibleBlocks():
+			if top + height <= exposed.top() or top > exposed.bottom():
+				continue
+			y = top + (height - digitHeight) / 2
+			x = right
+			while number:
+				number, digit = divmod(number, 10)
+				x -= self._digitWidth
+				p.drawPixmap(x, y, self._digits[digit])
+		p.end()
@@ -0,0 +1,214 @@
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""A crash-recovery journal of unsaved edits.
+
+Every document with unsaved changes has a journal file in the journal
+directory. The file starts with a header line describing the document
+(its path, and the size and modification time of the file when it was
+loaded or last saved), optionally followed by the text the edits apply to,
+and then one line per edit. All lines are JSON.
+
+Recording an edit just appends it to a list. The list is handed to a
+writer thread at most once per FLUSH_INTERVAL_MSECS, so typing doesn't
+touch the disk at all.
+"""
+
+import glob
+import logging
+import os
+import Queue
+import threading
+import time
+
+try:
+	import json
+except ImportError:
+	import simplejson as json
+
+from PyQt4.QtCore import *
+
+from util import *
+
+__all__ = ["Journal", "JournalEntry"]
+
+class JournalEntry(object):
+	"""The contents of a journal file left behind by a previous session."""
+
+	def __init__(self, filename, header, base, edits):
+		self.filename = filename
+		self.path = header.get("path")
+		stamp = header.get("stamp")
+		self.stamp = tuple(stamp) if stamp else None
+		self.base = base # Text the edits apply to, if not the file's contents
+		# Whether the file had also been changed by another program
+		self.conflict = bool(header.get("conflict"))
+		self.edits = edits # List of (position, removed, added) tuples
+
+def _read_entry(filename):
+	header = None
+	base = None
+	edits = []
+	f = open(filename, "rb")
+	try:
+		for line in f:
+			try:
+				record = json.loads(line)
+			except ValueError:
+				break # Probably cut off by the crash; use what we have
+			if header is None:
+				header = record
+			elif isinstance(record, dict):
+				base = record["base"]
+			else:
+				edits.append(tuple(record))
+	finally:
+		f.close()
+	if header is None:
+		return None
+	return JournalEntry(filename, header, base, edits)
+
+class Journal(QObject):
+
+	FLUSH_INTERVAL_MSECS = 1000
+
+	def __init__(self, directory, *args):
+		QObject.__init__(self, *args)
+		self.directory = directory
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+		self._pending = [] # Operations not yet handed to the writer
+		self._queue = Queue.Queue()
+		self._counter = 0
+		self._writer = None
+
+		self._timer = QTimer(self)
+		self._timer.setSingleShot(True)
+		safe_connect(self._timer.timeout, self.flush)
+
+	def _filename(self, journalId):
+		return os.path.join(self.directory, journalId + ".journal")
+
+	def recover(self):
+		"""Return a JournalEntry for each journal file in the directory, oldest
+		first. Must be called before any journals are started."""
+		filenames = glob.glob(os.path.join(self.directory, "*.journal"))
+		filenames.sort(key=os.path.getmtime)
+		entries = []
+		for each in filenames:
+			try:
+				entry = _read_entry(each)
+			except (IOError, OSError), e:
+				logging.warning("Couldn't read journal %s: %s" % (each, e))
+				continue
+			if entry:
+				entries.append(entry)
+		return entries
+
+	def removeRecovered(self, entries):
+		for each in entries:
+			try:
+				os.remove(each.filename)
+			except OSError, e:
+				logging.warning("Couldn't remove journal %s: %s" % (each.filename, e))
+
+	def begin(self, path, stamp=None, base=None, conflict=False):
+		"""Start a new journal for a document, and return its id. 'stamp' is
+		the (mtime, size) of the file at 'path' that the edits apply to.
+		If 'base' is given, the edits apply to that text instead. 'conflict'
+		means the document shouldn't be saved over the file without asking."""
+		self._counter += 1
+		journalId = "%d-%d-%d" % (os.getpid(), int(time.time()), self._counter)
+		records = [{"path": path, "stamp": stamp}]
+		if conflict:
+			records[0]["conflict"] = True
+		if base is not None:
+			records.append({"base": base})
+		self._pending.append(("begin", journalId, records))
+		self._schedule()
+		return journalId
+
+	def record(self, journalId, position, removed, added):
+		"""Record that 'removed' characters at 'position' were replaced by
+		the string 'added'."""
+		self._pending.append(("edit", journalId, (position, removed, added)))
+		self._schedule()
+
+	def discard(self, journalId):
+		"""Delete a journal, e.g. because its document was saved or closed."""
+		self._pending.append(("discard", journalId, None))
+		self._schedule()
+
+	def _schedule(self):
+		if not self._timer.isActive():
+			self._timer.start(self.FLUSH_INTERVAL_MSECS)
+
+	def flush(self):
+		"""Hand everything recorded so far to the writer thread."""
+		self._timer.stop()
+		if not self._pending:
+			return
+		if self._writer is None:
+			self._writer = threading.Thread(target=self._write)
+			self._writer.setDaemon(True)
+			self._writer.start()
+		self._queue.put(self._pending)
+		self._pending = []
+
+	def close(self, discardAll=False, keep=()):
+		"""Write out anything outstanding and stop the writer thread. If
+		'discardAll' is True, all of the journals are deleted, except for
+		those whose ids are in 'keep'."""
+		self.flush()
+		if self._writer:
+			self._queue.put(None)
+			self._writer.join()
+			self._writer = None
+		if discardAll:
+			kept = set(self._filename(x) for x in keep)
+			self.removeRecovered([x for x in self.recover() if x.filename not in kept])
+
+	def _write(self):
+		files = {}
+		try:
+			while True:
+				batch = self._queue.get()
+				if batch is None:
+					break
+				touched = set()
+				for op, journalId, data in batch:
+					try:
+						if op == "begin":
+							f = files[journalId] = open(self._filename(journalId), "wb")
+							for each in data:
+								f.write(json.dumps(each) + "\n")
+						elif op == "edit":
+							f = files.get(journalId)
+							if f:
+								f.write(json.dumps(data) + "\n")
+						elif op == "discard":
+							f = files.pop(journalId, None)
+							if f:
+								f.close()
+							filename = self._filename(journalId)
+							if os.path.exists(filename):
+								os.remove(filename)
+							continue
+						touched.add(journalId)
+					except (IOError, OSError), e:
+						logging.error("Error writing journal %s: %s" % (journalId, e))
+				for journalId in touched:
+					if journalId in files:
+						files[journalId].flush()
+		finally:
+			for f in files.values():
+				f.close()
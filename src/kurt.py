@@ -14,21 +14,37 @@
 from __future__ import with_statement
 
 import inspect
-import keyword
 import logging
 import optparse
 import os
+import re
 import shutil
-import StringIO
 import sys
-import token
-import tokenize
+import tempfile
+import time
 import traceback
 
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
-
+import sip
+
+import completion
+import findinfiles
+import gutter
+import journal
+import latency
+import launcher
+import lexers
+import loader
 import pipe
+import saver
+import search
+import session
+import structure
+import symbols
+import watcher
+from util import *
+from viewer import LargeFileViewer
 
 MAC_OS = sys.platform.startswith("darwin")
 
@@ -36,37 +52,6 @@ logging.basicConfig(
 	level=logging.DEBUG,
 	format="[%(levelname)s] %(message)s")
 
-def abs_path(relpath):
-	"""Given a path relative to this script, return the absolute path."""
-	return os.path.join(os.path.dirname(__file__), relpath)
-
-def pyqt_guarded(f):
-	"""A decorator to prevent unhandled exceptions to be thrown outside of
-	Python code. Should be used for any methods that are called directly
-	from PyQt."""
-	def wrapper(*args):
-		try:
-			return f(*args)
-		except Exception, e:
-			sys.stderr.write("Unhandled exception in wrapper around %s\n" % f)
-			traceback.print_exc()
-	return wrapper
-
-# A decorator to be used for Python methods which override a Qt method.
-pyqt_override = pyqt_guarded
-
-def safe_connect(signal, slot):
-	"""Connects a PyQt signal to a slot (a Python callable), while ensuring
-	that no unhandled exceptions are raised in the slot.
-	"""
-	signal.connect(pyqt_guarded(slot))
-	
-def signal_connect(signal1, signal2):
-	"""Connects two PyQt signals together. Not necessary, but here to provide
-	symmetry with safe_connect().
-	"""
-	signal1.connect(signal2)
-
 def keyEventMatches(event, key, modifier="No"):
 	"""Helper for hanlding Qt key events. 'key' is a string representing
 	the key to look for, and 'modifier' is one of "Shift", "Control", etc.
@@ -76,27 +61,71 @@ def keyEventMatches(event, key, modifier="No"):
 		return False
 	return event.modifiers() == getattr(Qt, modifier + "Modifier")
 
+_editorFont = []
+
+def editorFont():
+	"""Return the font to display file contents in, or None if none of the
+	preferred fonts are available."""
+	if _editorFont:
+		return _editorFont[0]
+	# TODO: The font should be a style/config option
+	fonts = [
+		("Menlo", 12),
+		("Monaco",  12),
+		("Consolas", 10),
+		("Courier New", 12)
+	]
+	_editorFont.append(None)
+	for name, size in fonts:
+		font = QFont(name, size, QFont.Normal)
+		if font.exactMatch():
+			_editorFont[0] = font
+			break
+	return _editorFont[0]
+
+# Styles for the widgets in the tabs. They're set once on the MainWindow,
+# rather than on every widget.
+STYLESHEET = """
+	QTextEdit {
+		color: #eeeeee;
+		background-color: #303030;
+		border: 0;
+	}
+	#findBar { border: 0; border-bottom: 1px solid #737373; }
+	#findBar QLabel { font-size: 10pt; padding-top: 2px; }
+	#findBar QLineEdit { font-size: 10pt; border: 1px solid DarkGray; }
+	#findBar QToolButton { font-size: 9pt; border: 1px solid transparent; }
+	#findBar QToolButton:checked { border: 1px solid DarkGray; }
+"""
+
 class KeyFilter(QObject):
+	"""Handles the keyboard shortcuts. There is one per window, installed on
+	the widgets in all of its tabs; shortcuts that act on a tab go to the
+	current one."""
 
-	def __init__(self, win, tab, *args):
+	def __init__(self, win, *args):
 		QObject.__init__(self, *args)
 		self._handlers = {}
+		self._win = win
 
 		shortcuts = {
 			("Control", "T"): win.new_tab,
 			("Control", "O"): win.open_file,
-			("Control", "S"): tab.save,
-			("Control", "W"): tab.closeTab,
+			("Control", "S"): self._tabAction("save"),
+			("Control", "W"): self._tabAction("closeTab"),
 #			("Control", "R"): win.reloadAndRestart,
-			("Control", "F"): tab.find,
-			("Control", "L"): tab.gotoLine
+			("Control", "F"): self._tabAction("find"),
+			("Control", "H"): self._tabAction("replace"),
+			(("Control", "Shift"), "F"): win.findInFiles,
+			(("Control", "Shift"), "O"): win.gotoSymbol,
+			("Control", "L"): self._tabAction("gotoLine")
 		}
 		
 		# Map from our simplified shortcut representation to an internal one,
 		# which will make it easier to look up handlers for Qt events
 		for shortcut, handler in shortcuts.iteritems():
 			modifiers = shortcut[0]
-			if not isinstance(modifiers, list):
+			if isinstance(modifiers, basestring):
 				modifiers = [modifiers]
 			# See the Qt::KeyboardModifiers enum
 			qt_mod_code = Qt.NoModifier
@@ -113,6 +142,9 @@ class KeyFilter(QObject):
 			handlers.append((qt_mod_code, handler))
 			self._handlers[qt_keycode] = handlers
 
+	def _tabAction(self, name):
+		return lambda: getattr(self._win.currentTab(), name)()
+
 	def get_handler(self, key, modifier):
 		for modifiers, handler in self._handlers.get(key, []):
 			if modifiers == modifier:
@@ -153,60 +185,282 @@ class ImageButton(QPushButton):
 		self.setFlat(True)
 		self.setFixedSize(width, height)
 
-class PythonHighlighter(QSyntaxHighlighter):
-	def __init__(self, *args):
+class LexerHighlighter(QSyntaxHighlighter):
+	"""Highlights a document with one of the lexers in lexers.py."""
+
+	# Upper bound on the number of entries in the token cache
+	CACHE_SIZE = 20000
+
+	# The formats for each kind of token, shared by all highlighters
+	_sharedFormats = None
+
+	def __init__(self, lexer, *args):
 		QSyntaxHighlighter.__init__(self, *args)
+		self.lexer = lexer
+
+		if LexerHighlighter._sharedFormats is None:
+			LexerHighlighter._sharedFormats = self._createFormats()
+		self._formats = LexerHighlighter._sharedFormats
+
+		# Maps (input state, block text) to the (runs, end state) that the
+		# lexer produced for it. QSyntaxHighlighter only calls highlightBlock
+		# for blocks that were edited, or whose previous block's state
+		# changed, so a hit here means the block doesn't need to be re-lexed.
+		self._cache = {}
+
+		# If set, a HighlightScheduler which decides which blocks may be
+		# highlighted right now
+		self.scheduler = None
+
+		# If set, a structure.NestingIndex to tell when the brackets of a
+		# block change because of how it's highlighted
+		self.nesting = None
+
+	def _createFormats(self):
+		commentFmt = QTextCharFormat()
+		commentFmt.setForeground(QColor("#0065ff"))
 
-		self.commentFmt = QTextCharFormat()
-		self.commentFmt.setForeground(QColor("#0065ff"))
+		stringFmt = QTextCharFormat()
+		stringFmt.setForeground(QColor("#009900"))
 
-		self.keywordFmt = QTextCharFormat()
-		self.keywordFmt.setForeground(QColor("#215ee6"))
+		identifierFmt = QTextCharFormat()
+		identifierFmt.setForeground(QColor("#ff8e4b"))
 
-		self.stringFmt = QTextCharFormat()
-		self.stringFmt.setForeground(QColor("#009900"))
+		keywordFmt = QTextCharFormat()
+		keywordFmt.setForeground(QColor("#33bbff"))
+		keywordFmt.setProperty(QTextFormat.FontWeight, 600)
 
-		self.identifierFmt = QTextCharFormat()
-		self.identifierFmt.setForeground(QColor("#ff8e4b"))
+		numberFmt = QTextCharFormat()
+		numberFmt.setForeground(QColor("#cc6600"))
 
-		self.keywordFmt = QTextCharFormat()
-		self.keywordFmt.setForeground(QColor("#33bbff"))
-		self.keywordFmt.setProperty(QTextFormat.FontWeight, 600)
+		headingFmt = QTextCharFormat()
+		headingFmt.setProperty(QTextFormat.FontWeight, 600)
+
+		emphasisFmt = QTextCharFormat()
+		emphasisFmt.setFontItalic(True)
+
+		codeFmt = QTextCharFormat()
+		codeFmt.setForeground(QColor("#666666"))
+
+		return {
+			"comment": commentFmt,
+			"keyword": keywordFmt,
+			"string": stringFmt,
+			"identifier": identifierFmt,
+			"number": numberFmt,
+			"heading": headingFmt,
+			"emphasis": emphasisFmt,
+			"code": codeFmt
+		}
+
+	def _lex(self, text, state):
+		key = (state, text)
+		result = self._cache.get(key)
+		if result is None:
+			if len(self._cache) >= self.CACHE_SIZE:
+				self._cache.clear()
+			result = self._cache[key] = self.lexer.lex(text, state)
+		return result
+
+	def memoryUsage(self):
+		"""Return a rough estimate of the memory used by the cache, in bytes."""
+		return sum(len(text) * 2 + 100 for state, text in self._cache)
 
 	@pyqt_override
 	def highlightBlock(self, text):
-		stripped_line = str(text).lstrip()
-		if len(stripped_line) > 0 and stripped_line[0] == "#":
-			self.setFormat(0, len(text), self.commentFmt)
+		state = self.previousBlockState()
+		if state < 0:
+			state = 0 # The lexer's root state
+		text = unicode(text)
+		scheduler = self.scheduler
+		if scheduler and not scheduler.mayHighlight(self.currentBlock()):
+			# Keep the block's old state, so that Qt doesn't carry on into
+			# the following blocks. Reuse the formats if they're known.
+			self.setCurrentBlockState(self.currentBlockState())
+			result = self._cache.get((state, text))
+			if result:
+				for start, length, kind in result[0]:
+					self.setFormat(start, length, self._formats[kind])
+			self._updateStructure(text, result and result[0])
+			return
+		runs, end_state = self._lex(text, state)
+		for start, length, kind in runs:
+			self.setFormat(start, length, self._formats[kind])
+		self.setCurrentBlockState(end_state)
+		self._updateStructure(text, runs)
+
+	def _updateStructure(self, text, runs):
+		# The brackets outside of strings and comments, for bracket matching
+		# and folding. The runs come from the cache, so if they're the same
+		# object, so is the structure.
+		block = self.currentBlock()
+		data = block.userData()
+		if isinstance(data, structure.BlockData) and data.runs is runs and runs:
+			data.revision = block.revision()
+			return
+		new = structure.BlockData(text, runs, block.revision())
+		if isinstance(data, structure.BlockData):
+			new.folded = data.folded
+		self.setCurrentBlockUserData(new)
+		if self.nesting is not None and (not isinstance(data, structure.BlockData)
+				or data.brackets != new.brackets):
+			self.nesting.blockChanged(block)
+
+class HighlightScheduler(QObject):
+	"""Drives a highlighter over a document without blocking the UI.
+
+	The blocks in the viewport of the text edit are highlighted first, and
+	the rest of the document is highlighted in time-boxed slices from the
+	event loop. Whenever the highlighter is asked to format a block outside
+	of the viewport, and outside of a slice (for example, when an edit
+	changes the state of all the following blocks), the block is deferred
+	to the background pass instead.
+	"""
+
+	# How long to hold off the background pass after an edit
+	EDIT_DELAY_MSECS = 150
+
+	def __init__(self, textEdit, highlighter, budget_msecs):
+		QObject.__init__(self, textEdit)
+		self.textEdit = textEdit
+		self.highlighter = highlighter
+		self.budget = budget_msecs / 1000.
+
+		# The background pass resumes at block number _pending, and must
+		# re-lex every block up to _through, even if the states of the
+		# blocks before it didn't change.
+		self._pending = 0
+		self._through = -1
+		self._deadline = None # Set while a slice is running
+		self._last = -1 # Last block highlighted in the current slice
+		self._visible = (0, -1)
+
+		doc = textEdit.document()
+		self._blockCount = doc.blockCount()
+
+		self._timer = QTimer(self)
+		self._timer.setSingleShot(True)
+		safe_connect(self._timer.timeout, self._runSlice)
+
+		# Scrolling generates many events in a row, so coalesce them
+		self._viewportTimer = QTimer(self)
+		self._viewportTimer.setSingleShot(True)
+		safe_connect(self._viewportTimer.timeout, self.highlightViewport)
+
+		safe_connect(textEdit.verticalScrollBar().valueChanged, self._viewportChanged)
+		safe_connect(doc.contentsChange, self._contentsChange)
+
+		highlighter.scheduler = self
+		# This also cancels the full rehighlight that QSyntaxHighlighter
+		# schedules when it is attached to a document.
+		self.highlightViewport()
+		self._timer.start(0)
+
+	def _visibleBlocks(self):
+		viewport = self.textEdit.viewport()
+		first = self.textEdit.cursorForPosition(QPoint(0, 0)).block()
+		last = self.textEdit.cursorForPosition(
+			QPoint(viewport.width() - 1, viewport.height() - 1)).block()
+		# Include the page below the viewport as well, so that typing near
+		# the bottom doesn't defer the blocks that are about to scroll in
+		first, last = first.blockNumber(), last.blockNumber()
+		return first, last + (last - first)
+
+	def _defer(self, blockNumber):
+		if self._pending is None or blockNumber < self._pending:
+			self._pending = blockNumber
+		self._through = max(self._through, blockNumber)
+		if not self._timer.isActive():
+			self._timer.start(self.EDIT_DELAY_MSECS)
+
+	def mayHighlight(self, block):
+		"""Called by the highlighter for every block it is asked to format.
+		Returns False if the block should be left for later."""
+		n = block.blockNumber()
+		if self._deadline is not None:
+			if time.time() < self._deadline:
+				self._last = max(self._last, n)
+				return True
 		else:
-			f = StringIO.StringIO(str(text))
-			try:
-				awaiting_decl = False
-				for each in tokenize.generate_tokens(f.readline):
-					token_type, text, start, end, line = each
-					_, start_col = start
-					_, end_col = end
-					length  = end_col - start_col
-					name = token.tok_name[token_type]
-					if name == "STRING":
-						self.setFormat(start_col, length, self.stringFmt)
-					elif name == "NAME":
-						if text in keyword.kwlist:
-							self.setFormat(start_col, length, self.keywordFmt)
-							awaiting_decl = text in ["def", "class"]
-						else:
-							if awaiting_decl:
-								self.setFormat(start_col, length, self.identifierFmt)
-								awaiting_decl = False
-					prev_tok_name = name
-			except tokenize.TokenError:
-				pass
+			first, last = self._visible
+			if first <= n <= last:
+				return True
+		self._defer(n)
+		return False
+
+	def highlightViewport(self):
+		self._visible = self._visibleBlocks()
+		first, last = self._visible
+		block = self.textEdit.document().findBlockByNumber(first)
+		while block.isValid() and block.blockNumber() <= last:
+			n = block.blockNumber()
+			if (block.userState() == -1
+			or (self._pending is not None and self._pending <= n <= self._through)):
+				self.highlighter.rehighlightBlock(block)
+			block = block.next()
+
+	def _viewportChanged(self, value):
+		self._viewportTimer.start(0)
+		if self._pending is not None:
+			self._timer.start(self.EDIT_DELAY_MSECS)
+
+	def _contentsChange(self, position, removed, added):
+		# The highlighter has already seen this change; just keep track of
+		# the block numbers, and hold off the background pass while typing.
+		doc = self.textEdit.document()
+		delta = doc.blockCount() - self._blockCount
+		self._blockCount = doc.blockCount()
+		if self._pending is not None:
+			if delta > 0 and self._through >= doc.findBlock(position).blockNumber():
+				self._through += delta
+			self._timer.start(self.EDIT_DELAY_MSECS)
+
+	def _runSlice(self):
+		if self._pending is None:
+			return
+		doc = self.textEdit.document()
+		block = doc.findBlockByNumber(self._pending)
+		self._pending = None
+		self._deadline = deadline = time.time() + self.budget
+		try:
+			while block.isValid() and self._pending is None:
+				# The highlighter carries on into the following blocks for as
+				# long as their state changes, or until the deadline passes.
+				self._last = block.blockNumber()
+				self.highlighter.rehighlightBlock(block)
+				if self._pending is not None:
+					break
+				block = block.next()
+				if block.isValid() and block.blockNumber() <= self._last:
+					block = doc.findBlockByNumber(self._last + 1)
+
+				# Past the deferred region, skip blocks that are already done
+				count = 0
+				while (block.isValid() and block.blockNumber() > self._through
+				and block.userState() != -1):
+					count += 1
+					if count % 256 == 0 and time.time() >= deadline:
+						self._pending = block.blockNumber()
+						break
+					block = block.next()
+		finally:
+			self._deadline = None
+		if self._pending is None:
+			self._through = -1
+		else:
+			self._timer.start(0)
 
 class FindBar(QWidget):
+
+	# The pixmaps for the bottom corners, shared by all FindBars
+	_corners = None
+
 	def __init__(self, parent, textEdit, *args):
 		QWidget.__init__(self, parent, *args)
-		self._leftCorner = QPixmap(abs_path("graphics/bottom-left.png"))
-		self._rightCorner = QPixmap(abs_path("graphics/bottom-right.png"))
+		if FindBar._corners is None:
+			FindBar._corners = (QPixmap(abs_path("graphics/bottom-left.png")),
+				QPixmap(abs_path("graphics/bottom-right.png")))
+		self._leftCorner, self._rightCorner = FindBar._corners
 
 		self.textEdit = textEdit
 		layout = QHBoxLayout()
@@ -219,6 +473,34 @@ class FindBar(QWidget):
 
 		self.lineEdit = QLineEdit()
 		layout.addWidget(self.lineEdit)
+
+		# Shows "n of m" for the current match
+		self.countLabel = QLabel()
+		layout.addWidget(self.countLabel)
+
+		self.caseButton = self._optionButton("Aa", "Match case")
+		layout.addWidget(self.caseButton)
+		self.regexButton = self._optionButton(".*", "Regular expression")
+		layout.addWidget(self.regexButton)
+
+		# Only shown when the bar is opened for replacing
+		replaceLabel = QLabel(text="Replace:")
+		self.replaceEdit = QLineEdit()
+		self.replaceEdit.setToolTip("With a regular expression, \\1 etc. "
+			"refer to its groups")
+		replaceButton = QPushButton("Replace")
+		replaceButton.setFocusPolicy(Qt.NoFocus)
+		safe_connect(replaceButton.clicked, self._replace)
+		replaceAllButton = QPushButton("All")
+		replaceAllButton.setToolTip("Replace all")
+		replaceAllButton.setFocusPolicy(Qt.NoFocus)
+		safe_connect(replaceAllButton.clicked, self._replaceAll)
+		self._replaceWidgets = [replaceLabel, self.replaceEdit, replaceButton,
+			replaceAllButton]
+		for each in self._replaceWidgets:
+			layout.addWidget(each)
+			each.hide()
+		self.replaceEdit.installEventFilter(self)
 		
 		closeButton = ImageButton("close", 16, 16)
 		safe_connect(closeButton.clicked, self.closeButtonClicked)
@@ -228,14 +510,16 @@ class FindBar(QWidget):
 		safe_connect(self.lineEdit.textEdited, self._findText)
 		self.setFocusProxy(self.lineEdit)
 		
-		self.setObjectName("findBar") # For styling purposes
-		self.setStyleSheet("""
-			#findBar { border: 0; border-bottom: 1px solid #737373; }
-			QLabel { font-size: 10pt; padding-top: 2px; }
-			QLineEdit { font-size: 10pt; border: 1px solid DarkGray; }
-		""")
+		self.setObjectName("findBar") # For styling; see STYLESHEET
 		
 		self._originalCursor = None
+
+		# The matches on screen are highlighted a moment after scrolling or
+		# editing stops, rather than on every change
+		self._refreshTimer = QTimer(self)
+		self._refreshTimer.setSingleShot(True)
+		safe_connect(self._refreshTimer.timeout, self._refresh)
+		self._watchTextEdit()
 		
 		self._animationTimer = QTimer(self)
 		safe_connect(self._animationTimer.timeout, self._animationCallback)
@@ -252,6 +536,9 @@ class FindBar(QWidget):
 				self._clearSelection()
 				self.hideThyself()
 				return True
+			elif key == Qt.Key_Return and obj is self.replaceEdit:
+				self._replace()
+				return True
 			elif key == Qt.Key_Return or key == Qt.Key_Down:
 				# Go to the next match
 				self._findText(self.lineEdit.text(), False)
@@ -287,6 +574,81 @@ class FindBar(QWidget):
 			rect.bottom())
 		QWidget.paintEvent(self, event)
 		
+	def _optionButton(self, text, toolTip):
+		button = QToolButton()
+		button.setText(text)
+		button.setToolTip(toolTip)
+		button.setCheckable(True)
+		button.setFocusPolicy(Qt.NoFocus)
+		safe_connect(button.toggled, self._optionToggled)
+		return button
+
+	def _optionToggled(self, checked):
+		self._findText(self.lineEdit.text())
+
+	def _watchTextEdit(self):
+		safe_connect(self.textEdit.verticalScrollBar().valueChanged,
+			self._scheduleRefresh)
+		safe_connect(self.textEdit.document().contentsChanged,
+			self._scheduleRefresh)
+
+	def _scheduleRefresh(self, *args):
+		if self.isVisible() and not self._refreshTimer.isActive():
+			self._refreshTimer.start(100)
+
+	def _query(self):
+		"""Return the arguments for the SearchIndex methods, other than the
+		position."""
+		return (unicode(self.lineEdit.text()), self.regexButton.isChecked(),
+			self.caseButton.isChecked())
+
+	def _refresh(self):
+		"""Update the match count, and highlight the matches on screen."""
+		self._refreshTimer.stop()
+		pattern, regex, caseSensitive = self._query()
+		if not pattern or not self.isVisible():
+			self._clearMatches()
+			return
+
+		index = self.textEdit.searchIndex
+		try:
+			count, exact = index.count(pattern, regex, caseSensitive)
+		except re.error:
+			self.countLabel.setText("Invalid")
+			self.textEdit.setExtraSelectionGroup("find", [])
+			return
+		total = str(count) if exact else "%d+" % count
+		cursor = self.textEdit.textCursor()
+		current = None
+		if cursor.hasSelection():
+			current = index.indexOf(cursor.selectionStart(), pattern, regex, caseSensitive)
+		if current is None:
+			self.countLabel.setText("%s matches" % total)
+		else:
+			self.countLabel.setText("%d of %s" % (current + 1, total))
+
+		viewport = self.textEdit.viewport()
+		first = self.textEdit.cursorForPosition(QPoint(0, 0))
+		last = self.textEdit.cursorForPosition(
+			QPoint(viewport.width(), viewport.height()))
+		last.movePosition(QTextCursor.EndOfBlock)
+		format = QTextCharFormat()
+		format.setBackground(QColor("#5c5c30"))
+		selections = []
+		for start, end in index.matchesIn(first.position(), last.position(),
+				pattern, regex, caseSensitive):
+			selection = QTextEdit.ExtraSelection()
+			selection.cursor = QTextCursor(self.textEdit.document())
+			selection.cursor.setPosition(start)
+			selection.cursor.setPosition(end, QTextCursor.KeepAnchor)
+			selection.format = format
+			selections.append(selection)
+		self.textEdit.setExtraSelectionGroup("find", selections)
+
+	def _clearMatches(self):
+		self.countLabel.clear()
+		self.textEdit.setExtraSelectionGroup("find", [])
+
 	def _clearSelection(self):
 		cursor = self.textEdit.textCursor()
 		cursor.clearSelection()
@@ -310,14 +672,64 @@ class FindBar(QWidget):
 				start = cursor.selectionStart()
 			else:
 				start = cursor.selectionEnd()
-			flags = QTextDocument.FindFlags()
-			if not forwards:
-				flags = QTextDocument.FindBackward
-			cursor = self.textEdit.document().find(text, start, flags)
-			if not cursor.isNull():
+			pattern, regex, caseSensitive = self._query()
+			try:
+				match = self.textEdit.searchIndex.find(
+					pattern, start, forwards, regex, caseSensitive)
+			except re.error:
+				match = None
+			if match:
+				cursor.setPosition(match[0])
+				cursor.setPosition(match[1], QTextCursor.KeepAnchor)
 				self.textEdit.setTextCursor(cursor)
-			self._setBackground(found=not cursor.isNull())
+			self._setBackground(found=match is not None)
+		self._refresh()
 			
+	def _replace(self, *args):
+		"""Replace the selected match, if there is one, and go to the next."""
+		pattern, regex, caseSensitive = self._query()
+		cursor = self.textEdit.textCursor()
+		if pattern and cursor.hasSelection():
+			try:
+				text = self.textEdit.searchIndex.replacement(cursor.selectionStart(),
+					cursor.selectionEnd(), pattern, unicode(self.replaceEdit.text()),
+					regex, caseSensitive)
+			except re.error:
+				self.countLabel.setText("Invalid")
+				return
+			if text is not None:
+				cursor.insertText(text)
+				self.textEdit.setTextCursor(cursor)
+		self._findText(self.lineEdit.text(), False)
+
+	def _replaceAll(self, *args):
+		"""Replace every match, as a single edit that can be undone in one
+		step."""
+		pattern, regex, caseSensitive = self._query()
+		if not pattern:
+			return
+		try:
+			edits = self.textEdit.searchIndex.replacements(pattern,
+				unicode(self.replaceEdit.text()), regex, caseSensitive)
+		except re.error:
+			self.countLabel.setText("Invalid")
+			return
+		if not edits:
+			self._setBackground(found=False)
+			return
+		# Inside an edit block, the document is only laid out again (and
+		# contentsChange only emitted) once, at the end. Going backwards
+		# keeps the positions of the earlier matches valid.
+		cursor = QTextCursor(self.textEdit.document())
+		cursor.beginEditBlock()
+		for start, end, text in reversed(edits):
+			cursor.setPosition(start)
+			cursor.setPosition(end, QTextCursor.KeepAnchor)
+			cursor.insertText(text)
+		cursor.endEditBlock()
+		self._refresh()
+		self.countLabel.setText("Replaced %d" % len(edits))
+
 	def _updatePos(self):
 		self.move(self.x(), self.offsetY)
 			
@@ -357,13 +769,18 @@ class FindBar(QWidget):
 		
 	def hideThyself(self, animated=True):
 		self.textEdit.setFocus()
+		self._refreshTimer.stop()
+		self._clearMatches()
 		duration = 200 if animated else 0
 		self._animate(duration, False)
 
-	def open(self, text=None):
-		"""Basically just a synonym for show(), but allows the text to be set."""
+	def open(self, text=None, replacing=False):
+		"""Basically just a synonym for show(), but allows the text to be set,
+		and the replace field to be shown."""
 		if text:
 			self.lineEdit.setText(text)
+		for each in self._replaceWidgets:
+			each.setVisible(replacing)
 		self.lineEdit.selectAll()
 		self.setFocus()
 		self.showThyself()
@@ -375,68 +792,191 @@ class FindBar(QWidget):
 	def focusEvent(self, event):
 		self._originalCursor = self.textEdit.textCursor()
 
+class ViewerFindBar(FindBar):
+	"""A FindBar which searches the mapped file of a LargeFileViewer."""
+
+	def _watchTextEdit(self):
+		# The viewer only does plain, case-sensitive searches, one at a time,
+		# in the background
+		self.caseButton.hide()
+		self.regexButton.hide()
+		safe_connect(self.textEdit.searchFinished, self._searchFinished)
+
+	def _refresh(self):
+		pass
+
+	def _clearMatches(self):
+		pass
+
+	def _clearSelection(self):
+		self.textEdit.clearMatch()
+
+	def _findText(self, text, includeSelection=True, forwards=True):
+		if len(text) == 0:
+			self.textEdit.cancelSearch()
+			self._setBackground(found=True)
+			self._clearSelection()
+		else:
+			self.textEdit.find(text, forwards, includeSelection)
+
+	def _searchFinished(self, found):
+		self._setBackground(found=found)
+
 class KTextEdit(QTextEdit):
 	
 	def __init__(self, *args):
 		QTextEdit.__init__(self, *args)
-		# TODO: This should be a config option
-		self.setStyleSheet("""
-			QTextEdit {
-				color: #eeeeee;
-				background-color: #303030;
-				border: 0;
-			}
-		""")
-
-	def _unindentAt(self, cursor):
-		# Helper for un-indenting a line.
-		# TODO: Make this function smarter than just deleting leading tab
-		if self.document().characterAt(cursor.position()) == QChar("\t"):
-			cursor.deleteChar()
+		self.searchIndex = search.SearchIndex(self.document())
+		self._extraSelectionGroups = {}
+		self._indentUnit = None # Detected the first time it's needed
+		self.completer = None # A completion.Completer, if completion is on
+
+	def setExtraSelectionGroup(self, name, selections):
+		"""Set the extra selections belonging to 'name' (e.g. the find bar's
+		highlighted matches), leaving the other groups alone."""
+		if not selections and name not in self._extraSelectionGroups:
+			return
+		self._extraSelectionGroups[name] = selections
+		combined = []
+		for key in sorted(self._extraSelectionGroups):
+			combined.extend(self._extraSelectionGroups[key])
+		self.setExtraSelections(combined)
+
+	# Lines sampled to work out how a file is indented
+	INDENT_SAMPLE_LINES = 1000
+
+	# Width of a tab, in spaces
+	TAB_WIDTH = 4
+
+	def indentUnit(self):
+		"""Return the string for one level of indentation: a tab, or as many
+		spaces as the file seems to use."""
+		if self._indentUnit is not None:
+			return self._indentUnit
+		tabs = 0
+		widths = {} # Number of times each increase in indentation was seen
+		previous = 0
+		block = self.document().begin()
+		for i in xrange(self.INDENT_SAMPLE_LINES):
+			if not block.isValid():
+				break
+			text = unicode(block.text())
+			block = block.next()
+			if not text.strip():
+				continue
+			if text.startswith(u"\t"):
+				tabs += 1
+				continue
+			width = len(text) - len(text.lstrip(u" "))
+			if width > previous:
+				widths[width - previous] = widths.get(width - previous, 0) + 1
+			previous = width
+		spaces = sum(widths.values())
+		if tabs == 0 and spaces == 0:
+			return u"\t" # Nothing to go on yet, so don't remember it
+		if tabs >= spaces:
+			self._indentUnit = u"\t"
+		else:
+			# The most common increase, preferring the smaller one on a tie
+			width = min(widths, key=lambda x: (-widths[x], x))
+			self._indentUnit = u" " * min(width, 8)
+		return self._indentUnit
+
+	def _indentWidth(self):
+		unit = self.indentUnit()
+		return self.TAB_WIDTH if unit == u"\t" else len(unit)
+
+	def indentBlocks(self, first, last, unindent=False):
+		"""Indent (or unindent) the lines from the block 'first' to the block
+		'last', inclusive, as a single undoable edit. Only the lines that
+		change are touched, and blank lines are left alone."""
+		unit = self.indentUnit()
+		width = self._indentWidth()
+		count = last.blockNumber() - first.blockNumber() + 1
+		cursor = QTextCursor(self.document())
+		cursor.beginEditBlock()
+		block = first
+		for i in xrange(count):
+			text = unicode(block.text())
+			position = block.position()
+			if unindent:
+				if text.startswith(u"\t"):
+					length = 1
+				else:
+					length = len(text[:width]) - len(text[:width].lstrip(u" "))
+				if length > 0:
+					cursor.setPosition(position)
+					cursor.setPosition(position + length, QTextCursor.KeepAnchor)
+					cursor.removeSelectedText()
+			elif text.strip():
+				cursor.setPosition(position)
+				cursor.insertText(unit)
+			block = block.next()
+		cursor.endEditBlock()
+
+	if latency.enabled:
+		# Only overridden in latency mode, to avoid a call into Python for
+		# every paint otherwise
+		@pyqt_override
+		def paintEvent(self, event):
+			QTextEdit.paintEvent(self, event)
+			latency.monitor.painted(self)
 
 	@pyqt_override
 	def keyPressEvent(self, event):
+		completing = self.completer and self.completer.popup().isVisible()
+		if completing and event.key() in (Qt.Key_Return, Qt.Key_Enter,
+		Qt.Key_Tab, Qt.Key_Backtab, Qt.Key_Escape):
+			event.ignore() # Handled by the completion popup
+			return
+
 		# Handle tabs specially: if there's a selection spanning multiple 
 		# lines, hitting tab indents all the spanned lines.
 
 		indent = keyEventMatches(event, "Tab")
 		unindent = keyEventMatches(event, "Backtab", "Shift")
 
-		# TODO: Both of these handlers should be smarter, and detect/insert
-		# a logical tab (e.g. 4 spaces) rather than looking for \t
-
 		if indent or unindent:
 			cursor = self.textCursor()
-			# Don't use cursor.selectedText(), it uses \u2029 instead of \n
-			if cursor.selection().toPlainText().contains("\n"):
-				# Append a tab at the beginning of every line in the selection,
-				# except the last line if the cursor is at position 0.
-				ins_cursor = QTextCursor(cursor)
-				ins_cursor.beginEditBlock()
-				ins_cursor.setPosition(cursor.selectionStart())
-				ins_cursor.movePosition(QTextCursor.StartOfLine)
-				while ins_cursor.position() < cursor.position():
-					if indent:
-						ins_cursor.insertText("\t")
-					else:
-						self._unindentAt(ins_cursor)
-					# Move to the beginning of the next line
-					ins_cursor.movePosition(QTextCursor.NextBlock)
-				ins_cursor.endEditBlock()
+			doc = self.document()
+			first = doc.findBlock(cursor.selectionStart())
+			last = doc.findBlock(cursor.selectionEnd())
+			if first != last:
+				# Leave out the last line if the selection ends at its start
+				if cursor.selectionEnd() == last.position():
+					last = last.previous()
+				self.indentBlocks(first, last, unindent)
 				return # Swallow the event
+			if unindent:
+				self.indentBlocks(first, first, True)
+				return
+			if self.indentUnit() != u"\t":
+				# Insert spaces up to the next indentation stop
+				width = self._indentWidth()
+				column = cursor.position() - first.position()
+				cursor.insertText(u" " * (width - column % width))
+				return
 		elif keyEventMatches(event, "Return"):
-			# Check the indentation level of the current line
+			# Insert a line break and match the indentation of the current line
 			cursor = self.textCursor()
-			cursor.movePosition(QTextCursor.StartOfLine)
-			while self.document().characterAt(cursor.position()) == QChar("\t"):
-				cursor.movePosition(QTextCursor.Right)
-			indent_level = cursor.columnNumber()
-
-			# Insert a line break and match the indentation level
-			self.textCursor().insertText("\n" + indent_level * "\t")
+			block = cursor.block()
+			text = unicode(block.text())[:cursor.position() - block.position()]
+			indentation = text[:len(text) - len(text.lstrip(u" \t"))]
+			cursor.insertText(u"\n" + indentation)
+			return
+		elif keyEventMatches(event, "Space", "Control") and self.completer:
+			self.completer.start()
+			return
+		elif keyEventMatches(event, "BracketLeft", "Control"):
+			structure.fold(self)
+			return
+		elif keyEventMatches(event, "BracketRight", "Control"):
+			structure.unfold(self)
 			return
 			
 		QTextEdit.keyPressEvent(self, event)
+		if completing:
+			self.completer.keyPressed()
 
 class Editor(QWidget):
 
@@ -446,11 +986,51 @@ class Editor(QWidget):
 	# Emitted when the document modification state has changed
 	modificationChanged = pyqtSignal(bool)
 
+	# Emitted when the cursor moves or the view scrolls
+	viewChanged = pyqtSignal()
+
+	# Emitted with an error message when the file couldn't be saved
+	saveFailed = pyqtSignal(str)
+
+	# Emitted when the file has changed on disk, but the document has
+	# unsaved changes, so it can't be reloaded
+	diskConflict = pyqtSignal()
+
 	def __init__(self, window, *args):
 		QWidget.__init__(self, *args)
 		
 		self.window = window
 		self.path = None # Path to the file that is open in this tab
+		self.highlighter = None
+
+		# How the file is stored on disk. Detected when it is opened.
+		self.encoding = "utf-8"
+		self.lineEnding = os.linesep
+
+		self._loader = None # A FileLoader, while the file is loading
+		self._loadProgress = 0
+
+		self._saveJob = None # The SaveJob in progress, if any
+		self._saveAgain = False
+		self._savedRevision = None
+
+		# The (mtime, size) of the file when it was last loaded or saved
+		self._diskStamp = None
+		self._conflict = False # Changed on disk while modified here
+
+		# Edits are recorded in the window's crash-recovery journal (if it
+		# has one), unless they come from loading the file
+		self._recording = True
+		self._journalId = None
+		self._journalTail = [] # Edits made while a save is in progress
+		self._pendingJournal = None # Recovered edits to apply once loaded
+		self._pendingLine = None # Line to move to once loaded
+		self._pendingView = None # View state to restore once loaded
+
+		# What the document's symbols are indexed under in the window's
+		# SymbolIndex, if they are (only for Python files)
+		self._symbolKey = None
+		self._symbolTimer = None
 		
 		layout = QVBoxLayout()
 		layout.setContentsMargins(0, 0, 0, 0)
@@ -463,28 +1043,33 @@ class Editor(QWidget):
 		doc = self.textEdit.document()
 		signal_connect(doc.modificationChanged, self.modificationChanged)
 		safe_connect(doc.contentsChanged, self._contentsChanged)
-
-		# TODO: The font should be a style/config option
-		fonts = [
-			("Menlo", 12),
-			("Monaco",  12),
-			("Consolas", 10),
-			("Courier New", 12)
-		]
-		for name, size in fonts:
-			font = QFont(name, size, QFont.Normal)
-			if font.exactMatch():
-				self.textEdit.setCurrentFont(font)
-				break
+		safe_connect(doc.contentsChange, self._recordEdit)
+		signal_connect(self.textEdit.cursorPositionChanged, self.viewChanged)
+		signal_connect(self.textEdit.verticalScrollBar().valueChanged, self.viewChanged)
+
+		# Words for completion, from this and the window's other documents
+		self._words = completion.DocumentWords(window.wordIndex, doc, self, self)
+		self.textEdit.completer = completion.Completer(self.textEdit, window.wordIndex)
+		self._brackets = structure.BracketMatcher(self.textEdit)
+
+		font = editorFont()
+		if font:
+			self.textEdit.setCurrentFont(font)
+
+		self.gutter = None
+		if window.setting("editor/line-numbers", True):
+			self.gutter = gutter.LineNumberGutter(self.textEdit, font)
 		
 		layout.addWidget(self.textEdit)
 		self.setFocusProxy(self.textEdit)
 
-		# Note: FindBar is not added to the layout; we place it manually
-		self.findBar = FindBar(self, self.textEdit)
+		# Note: FindBar is not added to the layout; we place it manually.
+		# It's created the first time it's needed.
+		self._findBar = None
 		
-		self.keyFilter = KeyFilter(window, self)
-		self.textEdit.installEventFilter(self.keyFilter)
+		self.textEdit.installEventFilter(window.keyFilter)
+		if latency.monitor:
+			latency.monitor.watch(self.textEdit, self)
 		
 		self._save_timer = QTimer(self)		
 		safe_connect(self._save_timer.timeout, self._saveTimeout)
@@ -496,32 +1081,179 @@ class Editor(QWidget):
 		# Set the tab width to 4 chars (assuming monospace font)
 		# If we do this in the constructor, it's not calculated correctly
 		fontMetrics = self.textEdit.fontMetrics()
-		self.textEdit.setTabStopWidth(fontMetrics.width("0000"))
+		self.textEdit.setTabStopWidth(fontMetrics.width("0" * KTextEdit.TAB_WIDTH))
 		
 	@pyqt_override
 	def resizeEvent(self, event):
-		# Lay out the FindBar
-		sizeHint = self.findBar.sizeHint()
-		self.findBar.setGeometry(
+		if self._findBar:
+			self._layoutFindBar()
+
+	def _layoutFindBar(self):
+		sizeHint = self._findBar.sizeHint()
+		self._findBar.setGeometry(
 			self.width() - sizeHint.width() - 20,
-			self.findBar.offsetY,
+			self._findBar.offsetY,
 			sizeHint.width(),
 			sizeHint.height())
+
+	def getFindBar(self):
+		if self._findBar is None:
+			self._findBar = FindBar(self, self.textEdit)
+			self._layoutFindBar()
+		return self._findBar
 	
 	def _contentsChanged(self):
-		# When the contents of the document change, save the document if no
-		# more changes are made after 500 seconds have elapsed
-		# Autosave is disabled for now
-		if False:
+		# When the contents of the document change, save the document once
+		# no more changes have been made for a little while
+		delay = self.window.setting("editor/autosave-msecs", 2000)
+		if delay > 0 and self.path and self._recording:
 			self._save_timer.stop()
-			self._save_timer.start(500)
+			self._save_timer.start(delay)
+		if self._symbolKey is not None and self._recording:
+			self._symbolTimer.start(self.SYMBOL_DELAY_MSECS)
+
+	# How long to wait after an edit before indexing the symbols again
+	SYMBOL_DELAY_MSECS = 500
+
+	def _indexSymbols(self):
+		# Parsing happens on the SymbolIndex's thread
+		key = self.path or self
+		index = self.window.symbolIndex
+		if self._symbolKey is not None and self._symbolKey != key:
+			index.remove(self._symbolKey)
+		if self._symbolTimer is None:
+			self._symbolTimer = QTimer(self)
+			self._symbolTimer.setSingleShot(True)
+			safe_connect(self._symbolTimer.timeout, self._indexSymbols)
+		self._symbolKey = key
+		index.update(key, key, self.textEdit.document().toPlainText())
 		
 	def _saveTimeout(self):
-		if self.path:
+		self._save_timer.stop()
+		# Don't quietly overwrite changes made by someone else
+		if self.path and not self._conflict:
 			self.save()
+
+	def _textAt(self, position, length):
+		return search.text_at(self.textEdit.document(), position, length)
+
+	def _recordEdit(self, position, removed, added):
+		journal = self.window.journal
+		if journal is None or not self._recording:
+			return
+		text = self._textAt(position, added)
+		self._journal(position, removed, text)
+		if self._saveJob:
+			self._journalTail.append((position, removed, text))
+
+	def _journal(self, position, removed, text):
+		journal = self.window.journal
+		if self._journalId is None:
+			self._journalId = journal.begin(self.path, self._diskStamp)
+		journal.record(self._journalId, position, removed, text)
+
+	def _discardJournal(self):
+		if self._journalId is not None:
+			self.window.journal.discard(self._journalId)
+			self._journalId = None
+
+	# Rough memory cost of a block and its layout, and of an undo step
+	BLOCK_BYTES = 256
+	UNDO_STEP_BYTES = 64
+
+	def memoryUsage(self):
+		"""Return a rough estimate of the memory used by the document, its
+		layout, highlighting and undo history, in bytes."""
+		doc = self.textEdit.document()
+		usage = doc.characterCount() * 2 + doc.blockCount() * self.BLOCK_BYTES
+		usage += doc.availableUndoSteps() * self.UNDO_STEP_BYTES
+		usage += self.textEdit.searchIndex.memoryUsage()
+		if self.highlighter:
+			usage += self.highlighter.memoryUsage()
+		return usage
+
+	def hibernate(self, directory):
+		"""Get ready to be replaced by a TabPlaceholder, to free the memory
+		used by the document. If the document isn't just the file on disk,
+		its text is written to a snapshot file in 'directory'. Returns what
+		restoreHibernated needs to bring the document back, or None if the
+		editor can't be hibernated right now."""
+		doc = self.textEdit.document()
+		if self._loader or self._saveJob or self._save_timer.isActive():
+			return None
+		state = {
+			"modified": doc.isModified(),
+			"encoding": self.encoding,
+			"lineEnding": self.lineEnding,
+			"diskStamp": self._diskStamp,
+			"journalId": self._journalId,
+			"snapshot": None
+		}
+		if doc.isModified() or self.path is None:
+			if directory is None:
+				return None
+			try:
+				if not os.path.isdir(directory):
+					os.makedirs(directory)
+				fd, filename = tempfile.mkstemp(suffix=".snapshot", dir=directory)
+				os.close(fd)
+				saver.write_atomically(filename,
+					[unicode(doc.toPlainText()).encode("utf-8")])
+			except (IOError, OSError), e:
+				logging.error("Couldn't write snapshot of %s: %s"
+					% (self.path or "a new file", e))
+				return None
+			state["snapshot"] = filename
+		# The journal carries on in the restored editor
+		self._journalId = None
+		# Hibernated documents aren't offered for completion
+		self._words.close()
+		return state
+
+	def restoreHibernated(self, path, state):
+		"""Bring back a document that was hibernated with a snapshot."""
+		self.path = path
+		self.encoding = state["encoding"]
+		self.lineEnding = state["lineEnding"]
+		try:
+			text = open(state["snapshot"], "rb").read().decode("utf-8")
+		except IOError, e:
+			QMessageBox.warning(self.window, "Kurt",
+				"Could not restore %s from %s:\n%s"
+				% (path or "a new file", state["snapshot"], e))
+			return
+		self._recording = False
+		self.textEdit.setPlainText(text)
+		os.remove(state["snapshot"])
+		self._diskStamp = state["diskStamp"]
+		self._journalId = state["journalId"]
+		self._recording = True
+		self.textEdit.document().setModified(state["modified"])
+		self.titleChanged.emit(self.getTitle())
+
+	def applyJournal(self, base, edits):
+		"""Apply edits recovered from a crash-recovery journal. If 'base'
+		isn't None, it replaces the document text first."""
+		if self._loader:
+			self._pendingJournal = (base, edits)
+			return
+		doc = self.textEdit.document()
+		cursor = QTextCursor(doc)
+		cursor.beginEditBlock()
+		if base is not None:
+			cursor.select(QTextCursor.Document)
+			cursor.insertText(base)
+		for position, removed, added in edits:
+			last = doc.characterCount() - 1
+			cursor.setPosition(min(position, last))
+			cursor.setPosition(min(position + removed, last), QTextCursor.KeepAnchor)
+			cursor.insertText(added)
+		cursor.endEditBlock()
 			
 	def getTitle(self):
 		if self.path:
+			if self._loader:
+				return "%s (%d%%)" % (os.path.basename(self.path), self._loadProgress)
 			return os.path.basename(self.path)
 		return "New File"
 		
@@ -530,16 +1262,178 @@ class Editor(QWidget):
 		
 	def open_file(self, path):
 		"""Open the file indicated by 'path' into this editor. 'path' may be
-		an absolute path, or relative to the current working directory."""
-		if os.path.exists(path):
-			self.textEdit.setPlainText(open(path, "r").read())
-			self.textEdit.document().setModified(False)
+		an absolute path, or relative to the current working directory.
+		Large files are loaded in the background."""
 		self.path = os.path.abspath(path) # Always save as absolute
+		if os.path.exists(path):
+			self._recording = False
+			if os.path.getsize(path) > loader.SYNC_LOAD_LIMIT:
+				self._startLoading()
+			else:
+				text, self.encoding, self.lineEnding = loader.read_file(path)
+				self.textEdit.setPlainText(text)
+				self.textEdit.document().setModified(False)
+				self._opened()
 		self.titleChanged.emit(self.getTitle())
 
-	def save(self):
-		if not self.textEdit.document().isModified():
+	def _opened(self):
+		# Called once the file has been completely loaded
+		self._diskStamp = loader.file_stamp(self.path)
+		self._recording = True
+		if self._pendingJournal:
+			self.applyJournal(*self._pendingJournal)
+			self._pendingJournal = None
+		if self._pendingView is not None:
+			self.restoreViewState(self._pendingView)
+			self._pendingView = None
+		if self._pendingLine is not None:
+			self.setCursorLine(self._pendingLine)
+			self._pendingLine = None
+
+	def isLoading(self):
+		return self._loader is not None
+
+	def diskChanged(self):
+		"""Called when the file may have changed on disk. If the document
+		hasn't been modified, it is brought up to date with the file;
+		otherwise, it is flagged as a conflict."""
+		if self._loader or self._saveJob or not self.path:
+			return # _diskStamp is about to change anyway
+		stamp = loader.file_stamp(self.path)
+		if stamp is None or stamp == self._diskStamp:
+			return # Deleted, or our own save
+		if self.isModified():
+			self.markConflict()
+			return
+		doc = self.textEdit.document()
+		self.window.reloader.request(self, self.path, doc.toPlainText(), doc.revision())
+
+	def markConflict(self):
+		"""Flag the document as changed both here and on disk, so that it
+		isn't saved until the user does so explicitly."""
+		if not self._conflict:
+			self._conflict = True
+			self.diskConflict.emit()
+
+	def hasConflict(self):
+		return self._conflict
+
+	def keepInJournal(self):
+		"""Record the whole document in a new journal, to be recovered the
+		next time Kurt starts, and return its id. Used at shutdown for
+		documents that can't be saved because of a conflict."""
+		journal = self.window.journal
+		self._discardJournal()
+		self._journalId = journal.begin(self.path, loader.file_stamp(self.path),
+			unicode(self.textEdit.document().toPlainText()), conflict=True)
+		return self._journalId
+
+	def applyReload(self, edits, encoding, lineEnding, stamp, revision):
+		"""Apply the edits computed by the window's Reloader, which bring
+		the document up to date with the file. Unlike setPlainText, this
+		keeps the cursor, scroll position, undo history and highlighting of
+		the unchanged parts."""
+		doc = self.textEdit.document()
+		if doc.revision() != revision:
+			# Edited while the file was being read; try again
+			self.diskChanged()
 			return
+		self._recording = False
+		cursor = QTextCursor(doc)
+		cursor.beginEditBlock()
+		for position, removed, text in edits:
+			cursor.setPosition(position)
+			cursor.setPosition(position + removed, QTextCursor.KeepAnchor)
+			cursor.insertText(text)
+		cursor.endEditBlock()
+		self._recording = True
+		# The symbols aren't indexed again for edits that aren't recorded
+		if self._symbolKey is not None:
+			self._indexSymbols()
+		doc.setModified(False)
+		self.encoding = encoding
+		self.lineEnding = lineEnding
+		self._diskStamp = stamp
+
+	def _startLoading(self):
+		self._loader = loader.FileLoader(self.path, self)
+		safe_connect(self._loader.textLoaded, self._appendLoadedText)
+		safe_connect(self._loader.progress, self._loadProgressed)
+		safe_connect(self._loader.restarted, self._loadRestarted)
+		safe_connect(self._loader.finished, self._loadFinished)
+		safe_connect(self._loader.failed, self._loadFailed)
+
+		# Don't let the user edit a half-loaded document, and don't keep
+		# undo history for the load itself
+		self.textEdit.setReadOnly(True)
+		self.textEdit.document().setUndoRedoEnabled(False)
+		self.textEdit.installEventFilter(self) # To cancel with Escape
+		self._loadProgress = 0
+		self._loader.start()
+
+	def _stopLoading(self):
+		self._loader = None
+		self.textEdit.removeEventFilter(self)
+		self.textEdit.document().setUndoRedoEnabled(True)
+		self.textEdit.setReadOnly(False)
+
+	def _appendLoadedText(self, text):
+		cursor = QTextCursor(self.textEdit.document())
+		cursor.movePosition(QTextCursor.End)
+		cursor.insertText(text)
+
+	def _loadRestarted(self):
+		cursor = QTextCursor(self.textEdit.document())
+		cursor.select(QTextCursor.Document)
+		cursor.removeSelectedText()
+
+	def _loadProgressed(self, percent):
+		self._loadProgress = percent
+		self.titleChanged.emit(self.getTitle())
+
+	def _loadFinished(self):
+		self.encoding = self._loader.encoding
+		self.lineEnding = self._loader.lineEnding
+		self._stopLoading()
+		self.textEdit.document().setModified(False)
+		self.textEdit.moveCursor(QTextCursor.Start)
+		self._opened()
+		self.titleChanged.emit(self.getTitle())
+
+	def _loadFailed(self, message):
+		# Don't leave a partially loaded file around to be saved over
+		# the original
+		self.cancelLoad()
+		QMessageBox.warning(self.window, "Kurt",
+			"Could not open %s:\n%s" % (self.path, message))
+
+	def cancelLoad(self):
+		"""Stop loading the file, and close the tab."""
+		if self._loader:
+			self._loader.cancel()
+			self._stopLoading()
+			self.closeTab()
+
+	@pyqt_override
+	def eventFilter(self, obj, event):
+		# Only installed on the text edit while the file is loading
+		if (event.type() == QEvent.KeyPress
+		and event.key() == Qt.Key_Escape):
+			self.cancelLoad()
+			return True
+		return False
+
+	def save(self, wait=False):
+		"""Save the document to disk. Unless 'wait' is True, the file is
+		written in the background, and saveFailed is emitted on failure."""
+		if self._loader or not self.textEdit.document().isModified():
+			return
+		if self._saveJob:
+			if not wait:
+				# Save again once the current save is done
+				self._saveAgain = True
+				return
+			self._saveJob.wait()
 
 		if self.path is None:
 			self.path = str(QFileDialog.getSaveFileName(self.window))
@@ -551,37 +1445,112 @@ class Editor(QWidget):
 				
 			self.titleChanged.emit(self.getTitle())
 
-		# Rename the original file, if it exists
-		overwrite = os.path.exists(self.path)
-		if overwrite:
-			temp_path = self.path + "~"
-			if os.path.exists(temp_path):
-				os.remove(temp_path)
-			os.rename(self.path, temp_path)			
+		# QTextDocument can only be used from the UI thread, so take a copy of
+		# its text here. The rest happens on the SaveJob's thread.
+		doc = self.textEdit.document()
+		self._savedRevision = doc.revision()
+		job = saver.SaveJob(self.path, doc.toPlainText(), self.encoding,
+			self.lineEnding, self)
+		safe_connect(job.saved, lambda encoding: self._saveFinished(job, encoding))
+		safe_connect(job.failed, lambda message: self._saveFailed(job, message))
+		self._saveJob = job
+		self._journalTail = []
+		if wait:
+			job.run()
+		else:
+			job.start()
+
+	def _saveFinished(self, job, encoding):
+		if job is not self._saveJob:
+			return # Superseded by a synchronous save
+		self._saveJob = None
+		self.encoding = str(encoding)
+		self._diskStamp = loader.file_stamp(self.path)
+		self._conflict = False
+
+		# The journal only needs the edits made since the snapshot was taken
+		if self._journalId is not None:
+			self._discardJournal()
+			for edit in self._journalTail:
+				self._journal(*edit)
+		self._journalTail = []
+
+		# Only mark the document as saved if it hasn't changed in the meantime
+		doc = self.textEdit.document()
+		if doc.revision() == self._savedRevision:
+			doc.setModified(False)
+		if self._saveAgain:
+			self._saveAgain = False
+			self.save()
 
-		try:
-			# Save the new contents
-			with open(self.path, "w") as f:
-				f.write(self.textEdit.document().toPlainText())
-
-			if overwrite:
-				os.remove(temp_path)
-		except:
-			if overwrite and os.path.exists(temp_path):
-				os.remove(self.path)
-				os.rename(temp_path, self.path)
-			
-		self.textEdit.document().setModified(False)
+	def _saveFailed(self, job, message):
+		if job is not self._saveJob:
+			return
+		self._saveJob = None
+		self._saveAgain = False
+		self._journalTail = []
+		self.saveFailed.emit(message)
 
-	def find(self):
+	def find(self, replacing=False):
 		cursor = self.textEdit.textCursor()
 		if cursor.hasSelection():
-			self.findBar.open(cursor.selectedText())
+			self.getFindBar().open(cursor.selectedText(), replacing)
 		else:
-			self.findBar.open()
+			self.getFindBar().open(None, replacing)
+		self._layoutFindBar() # Its size depends on whether it's replacing
+
+	def replace(self):
+		self.find(True)
 
 	def closeTab(self):
-		self.window.close_tab(self)
+		if self._loader:
+			self.cancelLoad() # Closes the tab
+		else:
+			self._save_timer.stop()
+			self._discardJournal()
+			if self._symbolKey is not None:
+				self.window.symbolIndex.remove(self._symbolKey)
+			self._words.close()
+			self.window.close_tab(self)
+
+	def viewState(self):
+		"""Return the cursor and scroll positions, as a dict that can be
+		passed to restoreViewState."""
+		if self._loader and self._pendingView:
+			return self._pendingView
+		cursor = self.textEdit.textCursor()
+		return {
+			"cursor": cursor.position(),
+			"anchor": cursor.anchor(),
+			"scroll": self.textEdit.verticalScrollBar().value()
+		}
+
+	def restoreViewState(self, state):
+		"""Restore the state returned by viewState. If the file is still
+		loading, this happens once it is loaded."""
+		if self._loader:
+			self._pendingView = state
+			return
+		doc = self.textEdit.document()
+		end = doc.characterCount() - 1
+		cursor = QTextCursor(doc)
+		cursor.setPosition(min(state.get("anchor", 0), end))
+		cursor.setPosition(min(state.get("cursor", 0), end), QTextCursor.KeepAnchor)
+		self.textEdit.setTextCursor(cursor)
+		# The document isn't laid out yet, so the scroll range isn't known
+		scroll = state.get("scroll", 0)
+		QTimer.singleShot(0,
+			lambda: self.textEdit.verticalScrollBar().setValue(scroll))
+
+	def setCursorLine(self, line):
+		"""Move the cursor to the start of the given (1-based) line. If the
+		file is still loading, this happens once it is loaded."""
+		if self._loader:
+			self._pendingLine = line
+			return
+		block = self.textEdit.document().findBlockByNumber(line - 1)
+		if block.isValid():
+			self.textEdit.setTextCursor(QTextCursor(block))
 
 	def gotoLine(self):
 		linecount = self.textEdit.document().lineCount()
@@ -592,9 +1561,465 @@ class Editor(QWidget):
 			self.textEdit.setTextCursor(QTextCursor(block))
 
 	def updateMode(self, title):
-		if self.path and self.path.endswith(".py"):
-			self.highlighter = PythonHighlighter(self.textEdit)
-			self.highlighter.rehighlight()
+		if self._loader:
+			return # Wait until the whole file is there
+		lexer = lexers.for_path(self.path) if self.path else None
+		if self.highlighter is None and lexer:
+			self.highlighter = LexerHighlighter(lexer, self.textEdit)
+			self.highlighter.nesting = self._brackets.index
+			budget = self.window.setting("highlighting/slice-msecs", 10)
+			if budget > 0:
+				HighlightScheduler(self.textEdit, self.highlighter, budget)
+			else:
+				self.highlighter.rehighlight()
+		if lexer is lexers.PYTHON:
+			self._indexSymbols()
+
+class LargeFileTab(QWidget):
+	"""A read-only tab for files that are too big to load into a KTextEdit.
+	To the MainWindow, it looks just like an Editor."""
+
+	titleChanged = pyqtSignal(str)
+	modificationChanged = pyqtSignal(bool)
+	viewChanged = pyqtSignal()
+
+	def __init__(self, window, *args):
+		QWidget.__init__(self, *args)
+		self.window = window
+		self.path = None
+		self.view = None
+		self.findBar = None
+
+		layout = QVBoxLayout()
+		layout.setContentsMargins(0, 0, 0, 0)
+		layout.setSpacing(0)
+		self.setLayout(layout)
+
+		self._indexTimer = QTimer(self)
+		safe_connect(self._indexTimer.timeout, self._indexProgressed)
+		self._indexProgress = 0
+
+	def open_file(self, path):
+		self.path = os.path.abspath(path)
+		self.view = LargeFileViewer(self.path, self)
+		font = editorFont()
+		if font:
+			self.view.setFont(font)
+		self.layout().addWidget(self.view)
+		self.setFocusProxy(self.view)
+		signal_connect(self.view.verticalScrollBar().valueChanged, self.viewChanged)
+
+		# Note: FindBar is not added to the layout; we place it manually
+		self.findBar = ViewerFindBar(self, self.view)
+
+		self.view.installEventFilter(self.window.keyFilter)
+
+		self.view.startIndexing()
+		self._indexTimer.start(250)
+		self.titleChanged.emit(self.getTitle())
+
+	def _indexProgressed(self):
+		self.view.updateScrollBars()
+		index = self.view.index
+		if index.isComplete():
+			self._indexTimer.stop()
+		if index.progress() != self._indexProgress:
+			self._indexProgress = index.progress()
+			self.titleChanged.emit(self.getTitle())
+
+	@pyqt_override
+	def resizeEvent(self, event):
+		if self.findBar:
+			sizeHint = self.findBar.sizeHint()
+			self.findBar.setGeometry(
+				self.width() - sizeHint.width() - 20,
+				self.findBar.offsetY,
+				sizeHint.width(),
+				sizeHint.height())
+
+	def getTitle(self):
+		title = os.path.basename(self.path) if self.path else "New File"
+		if self.view and not self.view.index.isComplete():
+			return "%s (indexing %d%%)" % (title, self._indexProgress)
+		return title
+
+	def isModified(self):
+		return False
+
+	def save(self, wait=False):
+		pass # Read-only
+
+	def find(self):
+		self.findBar.open()
+
+	def replace(self):
+		self.find() # Read-only
+
+	def closeTab(self):
+		if self.view:
+			self.view.close()
+		self.window.close_tab(self)
+
+	def viewState(self):
+		return {"scroll": self.view.topLine() if self.view else 0}
+
+	def restoreViewState(self, state):
+		self.view.verticalScrollBar().setValue(state.get("scroll", 0))
+
+	def setCursorLine(self, line):
+		self.view.scrollToLine(line - 1)
+
+	def gotoLine(self):
+		linecount = self.view.index.lineCount()
+		line_num, ok = QInputDialog.getInt(self, "Go to Line", "Line number:", min=0, max=linecount)
+		if ok:
+			self.view.scrollToLine(line_num - 1)
+
+class TabPlaceholder(QWidget):
+	"""Stands in for a tab restored from the last session until the tab is
+	first shown, so that restoring a session doesn't read every file up
+	front. The MainWindow replaces it with a real tab when it's activated."""
+
+	titleChanged = pyqtSignal(str)
+	modificationChanged = pyqtSignal(bool)
+
+	def __init__(self, window, path, state=None, hibernated=None, *args):
+		QWidget.__init__(self, *args)
+		self.window = window
+		self.path = os.path.abspath(path) if path else None
+		self.state = state # The view state to restore, if any
+
+		# If the tab was hibernated, what Editor.hibernate returned
+		self.hibernated = hibernated
+
+	def getTitle(self):
+		return os.path.basename(self.path) if self.path else "New File"
+
+	def isModified(self):
+		return bool(self.hibernated and self.hibernated["modified"])
+
+	def save(self, wait=False):
+		pass
+
+	def viewState(self):
+		return self.state
+
+	def memoryUsage(self):
+		return 0
+
+	def closeTab(self):
+		if self.hibernated:
+			if self.hibernated["snapshot"]:
+				os.remove(self.hibernated["snapshot"])
+			if self.hibernated["journalId"] is not None:
+				self.window.journal.discard(self.hibernated["journalId"])
+		if self.path:
+			self.window.symbolIndex.remove(self.path)
+		self.window.close_tab(self)
+
+class SymbolPicker(QDialog):
+	"""A popup for jumping to a class, function or variable in any of the
+	open Python files, using the window's SymbolIndex."""
+
+	MAX_RESULTS = 200
+
+	def __init__(self, window, text="", *args):
+		QDialog.__init__(self, window, *args)
+		self.window = window
+		self.setWindowTitle("Go to Symbol")
+		self.setAttribute(Qt.WA_DeleteOnClose)
+		self._results = [] # The (location, line) of each item in the list
+
+		layout = QVBoxLayout()
+		layout.setContentsMargins(4, 4, 4, 4)
+		layout.setSpacing(4)
+		self.setLayout(layout)
+
+		self.lineEdit = QLineEdit(text)
+		self.lineEdit.installEventFilter(self)
+		safe_connect(self.lineEdit.textChanged, self._refresh)
+		safe_connect(self.lineEdit.returnPressed, self._accept)
+		layout.addWidget(self.lineEdit)
+
+		self.list = QListWidget()
+		self.list.setUniformItemSizes(True)
+		safe_connect(self.list.itemActivated, self._accept)
+		layout.addWidget(self.list)
+
+		# Like safe_connect, but kept so that it can be disconnected; PyQt
+		# doesn't do that when the dialog is deleted, since the slot isn't a
+		# bound method
+		self._updatedSlot = pyqt_guarded(self._refresh)
+		window.symbolIndex.updated.connect(self._updatedSlot)
+		self.resize(500, 400)
+		self._refresh()
+
+	def _disconnect(self):
+		if self._updatedSlot:
+			self.window.symbolIndex.updated.disconnect(self._updatedSlot)
+			self._updatedSlot = None
+
+	@pyqt_override
+	def closeEvent(self, event):
+		self._disconnect()
+		QDialog.closeEvent(self, event)
+
+	@pyqt_override
+	def done(self, result):
+		# Escape closes the dialog without a closeEvent
+		self._disconnect()
+		QDialog.done(self, result)
+
+	def _refresh(self, *args):
+		query = unicode(self.lineEdit.text())
+		self.list.clear()
+		self._results = []
+		if not query:
+			return
+		for name, kind, line, location in self.window.symbolIndex.search(
+				query, self.MAX_RESULTS):
+			if isinstance(location, basestring):
+				where = os.path.basename(location)
+			else:
+				where = location.getTitle()
+			self.list.addItem("%s  (%s, %s:%d)" % (name, kind, where, line + 1))
+			self._results.append((location, line))
+		self.list.setCurrentRow(0)
+
+	@pyqt_override
+	def eventFilter(self, obj, event):
+		# Let the arrow keys move through the list while typing
+		if (event.type() == QEvent.KeyPress
+		and event.key() in (Qt.Key_Up, Qt.Key_Down, Qt.Key_PageUp, Qt.Key_PageDown)):
+			self.list.event(event)
+			return True
+		return False
+
+	def _accept(self, *args):
+		row = self.list.currentRow()
+		if 0 <= row < len(self._results):
+			self.close()
+			self.window.showSymbol(*self._results[row])
+
+class FindInFilesTab(QWidget):
+	"""A tab for searching all of the open files, and the files in a
+	directory tree. Like a LargeFileTab, it looks like an Editor to the
+	MainWindow."""
+
+	titleChanged = pyqtSignal(str)
+	modificationChanged = pyqtSignal(bool)
+
+	# Stop searching once this many matching lines have been found
+	MAX_RESULTS = 10000
+
+	def __init__(self, window, directory, *args):
+		QWidget.__init__(self, *args)
+		self.window = window
+		self.path = None
+		self._job = None
+		self._pattern = None
+		self._searched = 0
+		self._fileCount = 0
+		self._resultCount = 0
+		self._locations = [] # The (editor or path, path, line) of each result
+
+		layout = QVBoxLayout()
+		layout.setContentsMargins(0, 0, 0, 0)
+		layout.setSpacing(0)
+		self.setLayout(layout)
+
+		form = QHBoxLayout()
+		form.setContentsMargins(4, 4, 4, 4)
+		form.setSpacing(4)
+		layout.addLayout(form)
+
+		self.patternEdit = QLineEdit()
+		self.directoryEdit = QLineEdit(directory)
+		self.excludesEdit = QLineEdit()
+		self.excludesEdit.setToolTip(
+			"Files to skip, separated by commas (e.g. *.pyc, build/)")
+		browseButton = QPushButton("...")
+		safe_connect(browseButton.clicked, self._browse)
+		self.caseBox = QCheckBox("Match case")
+		self.regexBox = QCheckBox("Regex")
+		self.searchButton = QPushButton("Search")
+		safe_connect(self.searchButton.clicked, self._searchClicked)
+
+		form.addWidget(QLabel("Find:"))
+		form.addWidget(self.patternEdit, 2)
+		form.addWidget(QLabel("In:"))
+		form.addWidget(self.directoryEdit, 2)
+		form.addWidget(browseButton)
+		form.addWidget(QLabel("Exclude:"))
+		form.addWidget(self.excludesEdit, 1)
+		form.addWidget(self.caseBox)
+		form.addWidget(self.regexBox)
+		form.addWidget(self.searchButton)
+		for each in (self.patternEdit, self.directoryEdit, self.excludesEdit):
+			safe_connect(each.returnPressed, self.search)
+
+		self.results = QTreeWidget()
+		self.results.setHeaderHidden(True)
+		self.results.setUniformRowHeights(True)
+		self.results.setFrameShape(QFrame.NoFrame)
+		font = editorFont()
+		if font:
+			self.results.setFont(font)
+		safe_connect(self.results.itemClicked, self._itemActivated)
+		safe_connect(self.results.itemActivated, self._itemActivated)
+		layout.addWidget(self.results)
+
+		self.statusLabel = QLabel()
+		self.statusLabel.setContentsMargins(4, 2, 4, 2)
+		layout.addWidget(self.statusLabel)
+
+		self.setFocusProxy(self.patternEdit)
+		self.patternEdit.installEventFilter(window.keyFilter)
+		self.results.installEventFilter(window.keyFilter)
+
+	def search(self):
+		self.stop()
+		pattern = unicode(self.patternEdit.text())
+		if len(pattern) == 0:
+			return
+		regex = self.regexBox.isChecked()
+		caseSensitive = self.caseBox.isChecked()
+		try:
+			compiled = search.compile_pattern(pattern, regex, caseSensitive)
+		except re.error, e:
+			self.statusLabel.setText("Invalid regular expression: %s" % e)
+			return
+
+		self.results.clear()
+		self._locations = []
+		self._pattern = pattern
+		self._searched = 0
+		self._fileCount = 0
+		self._resultCount = 0
+		self.titleChanged.emit(self.getTitle())
+
+		# Open files are searched as they are in the editor, not on disk
+		skip = []
+		for editor in self.window.editors():
+			if editor.isLoading():
+				continue
+			if editor.path:
+				skip.append(editor.path)
+			text = editor.textEdit.searchIndex.text()
+			matches = findinfiles.find_lines(text, compiled)
+			if matches:
+				self._addResults(editor, editor.getTitle(), matches)
+
+		root = unicode(self.directoryEdit.text())
+		if root and os.path.isdir(root):
+			excludes = [x.strip() for x in unicode(self.excludesEdit.text()).split(",")]
+			self._job = findinfiles.FindInFilesJob(root, pattern, regex,
+				caseSensitive, [x for x in excludes if x], skip, self)
+			safe_connect(self._job.resultsFound, self._jobResultsFound)
+			safe_connect(self._job.progress, self._jobProgressed)
+			safe_connect(self._job.finished, self._jobFinished)
+			self._job.start()
+			self.searchButton.setText("Stop")
+		self._updateStatus()
+
+	def stop(self):
+		if self._job:
+			self._job.cancel()
+			self._job = None
+			self.searchButton.setText("Search")
+			self._updateStatus()
+
+	def _searchClicked(self, checked):
+		if self._job:
+			self.stop()
+		else:
+			self.search()
+
+	def _browse(self, checked):
+		directory = QFileDialog.getExistingDirectory(
+			self, "Search In", self.directoryEdit.text())
+		if len(directory) > 0:
+			self.directoryEdit.setText(directory)
+
+	def _addResults(self, location, label, matches):
+		fileItem = QTreeWidgetItem(self.results, ["%s (%d)" % (label, len(matches))])
+		for line, column, text in matches:
+			item = QTreeWidgetItem(fileItem, [u"%d: %s" % (line, text.strip())])
+			item.setData(0, Qt.UserRole, QVariant(len(self._locations)))
+			path = location if isinstance(location, basestring) else location.path
+			self._locations.append((location, path, line))
+		fileItem.setExpanded(True)
+		self._fileCount += 1
+		self._resultCount += len(matches)
+
+	def _jobResultsFound(self, results):
+		self.results.setUpdatesEnabled(False)
+		for path, matches in results:
+			self._addResults(path, os.path.relpath(path, self._job.root), matches)
+		self.results.setUpdatesEnabled(True)
+		if self._resultCount >= self.MAX_RESULTS:
+			self.stop()
+			self.statusLabel.setText("Stopped after %d matching lines"
+				% self._resultCount)
+
+	def _jobProgressed(self, searched):
+		self._searched = searched
+		self._updateStatus()
+
+	def _jobFinished(self):
+		self._job = None
+		self.searchButton.setText("Search")
+		self._updateStatus()
+
+	def _updateStatus(self):
+		status = "%d matching lines in %d files" % (self._resultCount, self._fileCount)
+		if self._job:
+			status += " (searched %d files...)" % self._searched
+		self.statusLabel.setText(status)
+
+	def _itemActivated(self, item, column):
+		data = item.data(0, Qt.UserRole)
+		if not data.isValid():
+			return # A file, not a matching line
+		location, path, line = self._locations[data.toInt()[0]]
+		if isinstance(location, basestring):
+			self.window.showLocation(location, line)
+		elif not sip.isdeleted(location) and self.window.getTabIndex(location) >= 0:
+			self.window.tabWidget.setCurrentWidget(location)
+			location.setCursorLine(line)
+			location.setFocus()
+		else:
+			# The editor has been hibernated or closed since the search (and
+			# may have been deleted), so go by the path it had then
+			if not sip.isdeleted(location) and location.path:
+				path = location.path
+			if path:
+				self.window.showLocation(path, line)
+
+	def getTitle(self):
+		if self._pattern:
+			return u'Find "%s"' % self._pattern
+		return "Find in Files"
+
+	def isModified(self):
+		return False
+
+	def save(self, wait=False):
+		pass
+
+	def find(self):
+		self.patternEdit.selectAll()
+		self.patternEdit.setFocus()
+
+	def replace(self):
+		self.find()
+
+	def closeTab(self):
+		self.stop()
+		self.window.close_tab(self)
+
+	def gotoLine(self):
+		pass
 
 class MainWindow(QMainWindow):
 
@@ -603,12 +2028,47 @@ class MainWindow(QMainWindow):
 	
 	# Emitted when tabs are opened or closed, etc.
 	contentsChanged = pyqtSignal()
+
+	# Emitted once the cursor or scroll position of a tab has stopped
+	# changing for VIEW_SETTLE_MSECS
+	viewChanged = pyqtSignal()
+
+	VIEW_SETTLE_MSECS = 1000
 	
 	# Emitted when the window is closed (by user action)
 	windowClosed = pyqtSignal(bool)
 
-	def __init__(self, *args):
+	def __init__(self, settings=None, *args):
 		QMainWindow.__init__(self, *args)
+		self.settings = settings
+		self.journal = None # Crash-recovery journal for unsaved edits
+		self.snapshotDir = None # Where hibernated documents are kept
+
+		# When each tab was last switched to, for choosing which to hibernate
+		self._lastUsed = {}
+		self._useCount = 0
+		self.keyFilter = KeyFilter(self)
+		self.setStyleSheet(STYLESHEET)
+
+		# Reload open files when they are changed by other programs
+		self.watcher = watcher.FileWatcher(self)
+		safe_connect(self.watcher.changed, self.filesChanged)
+		self.reloader = watcher.Reloader(self)
+		safe_connect(self.reloader.reloaded, self._reloaded)
+
+		# Symbols of the open Python files, for gotoSymbol
+		self.symbolIndex = symbols.SymbolIndex(self)
+
+		# Words in all the open documents, for completion
+		self.wordIndex = completion.WordIndex()
+		safe_connect(self.contentsChanged, self._updateWatchedFiles)
+
+		# Cursor and scroll changes are passed on once they stop, so that
+		# scrolling doesn't keep the session dirty
+		self._viewTimer = QTimer(self)
+		self._viewTimer.setSingleShot(True)
+		signal_connect(self._viewTimer.timeout, self.viewChanged)
+
 		self.tabWidget = QTabWidget()
 		self.tabWidget.setMovable(True)
 		self.tabWidget.setDocumentMode(True)
@@ -664,7 +2124,7 @@ class MainWindow(QMainWindow):
 		event.acceptProposedAction()
 		
 	def reloadAndRestart(self):
-		self.currentTab().save()
+		self.currentTab().save(wait=True)
 		filename = inspect.getfile(inspect.currentframe())
 		try:
 			execfile(filename, {"__name__": "kurt"})
@@ -679,35 +2139,178 @@ class MainWindow(QMainWindow):
 
 	def currentTab(self):
 		return self.tabWidget.currentWidget()
+
+	def setting(self, key, default):
+		return get_setting(self.settings, key, default)
 		
 	def updateWindowTitle(self):
 		editor = self.tabWidget.currentWidget()
-		filename = os.path.basename(editor.path) if editor.path else "New File"
+		filename = os.path.basename(editor.path) if editor.path else editor.getTitle()
 		self.setWindowTitle(filename + " - Kurt")
 
 	def tabSwitched(self, index):
 		# Handle the case when the last tab is closed
 		if index >= 0:
+			tab = self.materialize(self.getTab(index))
+			self._useCount += 1
+			self._lastUsed[tab] = self._useCount
+			self._hibernateIdleTabs()
 			self.updateWindowTitle()
 
-	def new_tab(self, filename=None, contents=None):
+	def _hibernateIdleTabs(self):
+		# Hibernate the least recently used tabs until there are no more than
+		# tabs/max-live editors, using no more than tabs/memory-budget-mb
+		maxLive = self.setting("tabs/max-live", 20)
+		budget = self.setting("tabs/memory-budget-mb", 512) * 1024 * 1024
+		if maxLive <= 0:
+			maxLive = sys.maxint
+		editors = self.editors()
+		usage = dict((x, x.memoryUsage()) for x in editors)
+		count = len(editors)
+		total = sum(usage.values())
+		current = self.currentTab()
+		editors.sort(key=lambda x: self._lastUsed.get(x, 0))
+		for editor in editors:
+			if count <= maxLive and total <= budget:
+				break
+			if editor is not current and self.hibernate(editor):
+				count -= 1
+				total -= usage[editor]
+
+	def hibernate(self, editor):
+		"""Replace an Editor with a TabPlaceholder, freeing its document. The
+		document comes back when the tab is next shown. Returns False if the
+		editor couldn't be hibernated."""
+		hibernated = editor.hibernate(self.snapshotDir)
+		if hibernated is None:
+			return False
+		index = self.getTabIndex(editor)
+		placeholder = TabPlaceholder(self, editor.path, editor.viewState(), hibernated)
+		self.tabWidget.blockSignals(True)
+		self.tabWidget.removeTab(index)
+		self.tabWidget.insertTab(index, placeholder, editor.getTitle())
+		self.tabWidget.blockSignals(False)
+		color = Qt.darkGray if placeholder.isModified() else Qt.black
+		self.tabWidget.tabBar().setTabTextColor(index, color)
+		self._lastUsed.pop(editor, None)
+		if not editor.path:
+			# Symbols are only kept for hibernated tabs with a file
+			self.symbolIndex.remove(editor)
+		editor.deleteLater()
+		return True
+
+	def memoryReport(self):
+		"""Return a list of (title, bytes) with the estimated memory used by
+		each tab. Tabs that are hibernated or not loaded yet use none."""
+		return [(x.getTitle(), getattr(x, "memoryUsage", lambda: 0)())
+			for x in self.tabs()]
+
+	def materialize(self, tab):
+		"""If 'tab' is a TabPlaceholder, replace it with a real tab for its
+		file. Returns the real tab."""
+		if not isinstance(tab, TabPlaceholder):
+			return tab
+		index = self.getTabIndex(tab)
+		current = self.tabWidget.currentIndex() == index
+		editor = self._createTab(tab.path)
+
+		# Swapping the tabs shouldn't look like switching tabs
+		self.tabWidget.blockSignals(True)
+		self.tabWidget.removeTab(index)
+		self.tabWidget.insertTab(index, editor, tab.getTitle())
+		if current:
+			self.tabWidget.setCurrentIndex(index)
+		self.tabWidget.blockSignals(False)
+		tab.deleteLater()
+		self._lastUsed.pop(tab, None)
+
+		if tab.hibernated and tab.hibernated["snapshot"]:
+			editor.restoreHibernated(tab.path, tab.hibernated)
+			editor.diskChanged() # In case it changed while hibernated
+		else:
+			editor.open_file(tab.path)
+		self._updateWatchedFiles()
+		if tab.state:
+			editor.restoreViewState(tab.state)
+		if current:
+			editor.setFocus()
+		return editor
+
+	def open_files(self, paths):
+		"""Open a batch of files, e.g. for another process. Files that are
+		already open are just switched to. The last file is shown, and the
+		others are only loaded once they are shown."""
+		new = []
+		for path in paths:
+			path = os.path.abspath(path)
+			if path not in new and self.findTab(path) is None:
+				new.append(path)
+		self.setUpdatesEnabled(False)
+		try:
+			self.restore_tabs([(x, None) for x in new])
+			tab = self.findTab(paths[-1])
+			if tab is not None and tab is not self.currentTab():
+				self.tabWidget.setCurrentWidget(tab)
+		finally:
+			self.setUpdatesEnabled(True)
+		self.currentTab().setFocus()
+
+	def restore_tabs(self, tabs, current=None):
+		"""Add a tab for each (path, view state) in 'tabs', and switch to the
+		one at index 'current' (by default, the last one). Only that one is
+		actually loaded; the others are loaded when they are first shown."""
+		self.tabWidget.blockSignals(True)
+		for path, state in tabs:
+			placeholder = TabPlaceholder(self, path, state)
+			self.tabWidget.addTab(placeholder, placeholder.getTitle())
+		self.tabWidget.blockSignals(False)
+		if tabs:
+			if current is None or not 0 <= current < len(tabs):
+				current = len(tabs) - 1
+			self.tabWidget.setCurrentIndex(self.tabWidget.count() - len(tabs) + current)
+			self.tabSwitched(self.tabWidget.currentIndex())
+		self.contentsChanged.emit()
+
+	def new_tab(self, filename=None, contents=None, line=None):
 		"""Open a new editor tab. If filename is specified, it will be loaded
-		into the tab. Otherwise, if contents (a string) is specified, the
-		editor text will be set to that.
+		into the tab, and the cursor placed at the start of 'line' (if given).
+		Otherwise, if contents (a string) is specified, the editor text will
+		be set to that.
 		"""
-		editor = Editor(self)
-		safe_connect(editor.modificationChanged, self.tabModificationChanged)
-		safe_connect(editor.titleChanged, self.tabTitleChanged)
-
+		editor = self._createTab(filename)
 		index = self.tabWidget.addTab(editor, editor.getTitle())
 
 		if filename:
 			editor.open_file(str(filename))
+			if line is not None:
+				editor.setCursorLine(line)
 		elif contents:
 			editor.textEdit.setText(contents)
 		self.tabWidget.setCurrentIndex(index) # Switch to the new tab
 		self.contentsChanged.emit()
 		editor.setFocus()
+		return editor
+
+	def _createTab(self, filename=None):
+		if filename and self._isLargeFile(str(filename)):
+			editor = LargeFileTab(self)
+		else:
+			editor = Editor(self)
+		safe_connect(editor.modificationChanged, self.tabModificationChanged)
+		safe_connect(editor.titleChanged, self.tabTitleChanged)
+		safe_connect(editor.viewChanged, self._tabViewChanged)
+		if isinstance(editor, Editor):
+			safe_connect(editor.saveFailed, self.tabSaveFailed)
+			safe_connect(editor.diskConflict, self.tabDiskConflict)
+		return editor
+
+	def _tabViewChanged(self):
+		self._viewTimer.start(self.VIEW_SETTLE_MSECS)
+
+	def _isLargeFile(self, path):
+		"""Return True if the file should be opened in a LargeFileTab."""
+		limit = self.setting("viewer/threshold-mb", 256) * 1024 * 1024
+		return os.path.isfile(path) and os.path.getsize(path) > limit
 
 	def getTab(self, widgetOrIndex):
 		"""Given either the widget or its index, return the widget."""
@@ -726,6 +2329,7 @@ class MainWindow(QMainWindow):
 		
 	def close_tab(self, tab):
 		self.tabWidget.removeTab(self.tabWidget.indexOf(tab))
+		self._lastUsed.pop(tab, None)
 		if self.tabWidget.count() == 0:
 			self.new_tab()
 		self.tabWidget.currentWidget().setFocus()
@@ -745,6 +2349,35 @@ class MainWindow(QMainWindow):
 		index = self.getTabIndex(self.sender())
 		color = Qt.darkGray if modified else Qt.black
 		self.tabWidget.tabBar().setTabTextColor(index, color)
+		if not modified:
+			self.tabWidget.setTabToolTip(index, "")
+
+	def tabSaveFailed(self, message):
+		index = self.getTabIndex(self.sender())
+		self.tabWidget.tabBar().setTabTextColor(index, Qt.red)
+		self.tabWidget.setTabToolTip(index, "Could not save: %s" % message)
+
+	def tabDiskConflict(self):
+		index = self.getTabIndex(self.sender())
+		self.tabWidget.tabBar().setTabTextColor(index, Qt.red)
+		self.tabWidget.setTabToolTip(index,
+			"Changed on disk. Saving will overwrite the changes.")
+
+	def _updateWatchedFiles(self):
+		# Only loaded documents are watched; the others are read from disk
+		# when they are materialized
+		self.watcher.setPaths([x.path for x in self.editors() if x.path])
+
+	def filesChanged(self, paths):
+		paths = set(paths)
+		for editor in self.editors():
+			if editor.path in paths:
+				editor.diskChanged()
+
+	def _reloaded(self, result):
+		editor = result[0]
+		if self.getTabIndex(editor) >= 0 and isinstance(editor, Editor):
+			editor.applyReload(*result[1:])
 		
 	def open_file(self, filename=None):
 		if filename is None:
@@ -752,12 +2385,74 @@ class MainWindow(QMainWindow):
 		if len(filename) > 0:
 			self.new_tab(filename)
 			
+	def showLocation(self, path, line):
+		"""Show the given (1-based) line of a file, opening it if needed."""
+		tab = self.findTab(path)
+		if tab is None:
+			self.new_tab(path, line=line)
+		else:
+			tab = self.materialize(tab)
+			self.tabWidget.setCurrentWidget(tab)
+			tab.setCursorLine(line)
+			tab.setFocus()
+
+	def findInFiles(self):
+		"""Switch to the find in files tab, opening it if necessary."""
+		current = self.currentTab()
+		tab = None
+		for i in xrange(self.tabWidget.count()):
+			if isinstance(self.getTab(i), FindInFilesTab):
+				tab = self.getTab(i)
+		if tab is None:
+			path = getattr(current, "path", None)
+			directory = os.path.dirname(path) if path else os.getcwd()
+			tab = FindInFilesTab(self, directory)
+			safe_connect(tab.modificationChanged, self.tabModificationChanged)
+			safe_connect(tab.titleChanged, self.tabTitleChanged)
+			self.tabWidget.addTab(tab, tab.getTitle())
+
+		# Search for the selected text, if there is any
+		textEdit = getattr(current, "textEdit", None)
+		if textEdit and textEdit.textCursor().hasSelection():
+			tab.patternEdit.setText(textEdit.textCursor().selectedText())
+		self.tabWidget.setCurrentWidget(tab)
+		tab.find()
+
+	def gotoSymbol(self):
+		"""Pick a symbol from any of the open Python files, and show it."""
+		textEdit = getattr(self.currentTab(), "textEdit", None)
+		text = ""
+		if textEdit and textEdit.textCursor().hasSelection():
+			text = textEdit.textCursor().selectedText()
+		SymbolPicker(self, text).show()
+
+	def showSymbol(self, location, line):
+		"""Show the (0-based) line of a symbol found by the SymbolIndex."""
+		if isinstance(location, basestring):
+			self.showLocation(location, line + 1)
+		elif self.getTabIndex(location) >= 0:
+			self.tabWidget.setCurrentWidget(location)
+			location.setCursorLine(line + 1)
+			location.setFocus()
+
+	def findTab(self, path):
+		"""Return the tab that has the file at 'path' open, or None."""
+		path = os.path.abspath(path)
+		for i in xrange(self.tabWidget.count()):
+			if self.getTab(i).path == path:
+				return self.getTab(i)
+		return None
+
+	def tabs(self):
+		return [self.getTab(i) for i in xrange(self.tabWidget.count())]
+
+	def editors(self):
+		"""Return all the Editor tabs."""
+		return [x for x in self.tabs() if isinstance(x, Editor)]
+
 	def getOpenFiles(self):
 		"""Return a list of the full paths of all the files open in the window."""
-		result = []
-		for i in xrange(self.tabWidget.count()):
-			result.append(self.getTab(i).path)
-		return result
+		return [x.path for x in self.tabs()]
 		
 					
 class Kurt(QObject):
@@ -774,62 +2469,84 @@ class Kurt(QObject):
 
 		self._listener = listener
 		if listener:
-			safe_connect(self._listener.remoteOpenRequest, self._openFromExternalProcess)
+			safe_connect(self._listener.requestsReady, self._openFromExternalProcess)
 
+		# Before there are any other threads; see findinfiles.start_pool()
+		findinfiles.start_pool()
 		self.app = QApplication(sys.argv)
+		if latency.enabled:
+			latency.start()
 		safe_connect(self.app.lastWindowClosed, self.shutDown)
 
-		self.win = MainWindow()
-		safe_connect(self.win.geometryChanged, self.geometryChanged)
-		safe_connect(self.win.contentsChanged, self.saveTabs)
+		self.win = MainWindow(settings)
+		configDirName = os.path.dirname(str(settings.fileName()))
+		self.journal = journal.Journal(os.path.join(configDirName, "journal"))
+		self.win.journal = self.journal
+		self.win.snapshotDir = os.path.join(configDirName, "hibernate")
+		if os.path.isdir(self.win.snapshotDir):
+			# Left over from a previous session
+			shutil.rmtree(self.win.snapshotDir, True)
+		self.session = session.SessionStore(
+			os.path.join(configDirName, "session.json"), self.sessionState, settings)
+		safe_connect(self.win.geometryChanged, self.sessionChanged)
+		safe_connect(self.win.contentsChanged, self.sessionChanged)
+		safe_connect(self.win.viewChanged, self.sessionChanged)
 		safe_connect(self.win.windowClosed, self.windowClosed)
 		
 		self.restoring = False
 
-	def _openFromExternalProcess(self, filename):
-		if len(filename) > 0:
-			self.win.new_tab(filename)
+	def _openFromExternalProcess(self):
+		paths = self._listener.takeRequests()
+		if paths:
+			self.win.open_files(paths)
 		self.win.raise_()
 	
-	def geometryChanged(self):
-		"""Saves the width, height, and position of the window."""
+	def sessionChanged(self):
 		if not self.restoring:
-			self.settings.setValue("session/geometry", self.win.saveGeometry())
+			self.session.markDirty()
 			
 	def windowClosed(self, closed_cleanly):
 		self.closed_cleanly = closed_cleanly
 		self.settings.setValue("session/closed-cleanly", closed_cleanly)
 			
-	def saveTabs(self):
-		"""Saves a list of all the files that are currently open in tabs."""
-		if not self.restoring:
-			paths = os.pathsep.join((x for x in self.win.getOpenFiles() if x is not None))
-			self.settings.setValue("session/tabs", paths)
-
-	def restoreTabs(self):
+	def sessionState(self):
+		"""Return the window geometry and the open tabs, for the SessionStore."""
+		tabs = []
+		current = None
+		for tab in self.win.tabs():
+			if tab.path is None:
+				continue
+			if tab is self.win.currentTab():
+				current = len(tabs)
+			state = {"path": tab.path}
+			state.update(tab.viewState() or {})
+			tabs.append(state)
+		geometry = str(self.win.saveGeometry().toBase64())
+		return {"geometry": geometry, "tabs": tabs, "current": current}
+
+	def restore_geometry(self, state):
+		if state.get("geometry"):
+			self.win.restoreGeometry(QByteArray.fromBase64(str(state["geometry"])))
+		
+	def restore_session(self, state):
 		self.restoring = True
-		paths = str(self.settings.value("session/tabs").toPyObject())
-		for path in paths.split(os.pathsep):
-			self.win.open_file(path)
+		self.restore_geometry(state)
+		tabs = [(x["path"], x) for x in state.get("tabs", []) if x.get("path")]
+		self.win.restore_tabs(tabs, state.get("current"))
 		self.restoring = False
 		
-	def restore_geometry(self):
-		# Try to restore the previous settings
-		if self.settings.contains("session/geometry"):
-			self.win.restoreGeometry(self.settings.value("session/geometry").toByteArray())
-		
-	def restore_session(self):
-		self.restore_geometry()
-		self.restoreTabs()
-		
 	def start(self, files=[], contents=[]):
 		if self._listener:
 			self._listener.start()
 		
+		state = self.session.load() or {}
 		if not self.closed_cleanly or len(files) == 0:
-			self.restore_session()
+			self.restore_session(state)
 		else:
-			self.restore_geometry()
+			self.restore_geometry(state)
+		# After a clean shutdown, the only journals left are those of
+		# documents that conflicted with changes on disk
+		self.recoverUnsavedChanges()
 	
 		for each in files:
 			self.win.new_tab(filename=each)
@@ -840,9 +2557,47 @@ class Kurt(QObject):
 		self.win.raise_()
 		return self.app.exec_()
 		
+	def recoverUnsavedChanges(self):
+		"""Restore the unsaved edits recorded in the journal by the previous
+		session: all of them if it didn't shut down cleanly, or else those
+		that couldn't be saved because of a conflict."""
+		entries = self.journal.recover()
+		for entry in entries:
+			if entry.path is None:
+				editor = self.win.new_tab()
+			else:
+				if loader.file_stamp(entry.path) != entry.stamp:
+					logging.warning("Not recovering changes to %s, the file has changed"
+						% entry.path)
+					continue
+				editor = self.win.findTab(entry.path) or self.win.new_tab(entry.path)
+				editor = self.win.materialize(editor)
+			if isinstance(editor, Editor):
+				logging.info("Recovering %d unsaved edits to %s"
+					% (len(entry.edits), entry.path or "a new file"))
+				editor.applyJournal(entry.base, entry.edits)
+				if entry.conflict:
+					editor.markConflict()
+		self.journal.removeRecovered(entries)
+
 	def shutDown(self):
 		if self._listener:
 			self._listener.shutdown()
+		# Don't lose edits that haven't been autosaved yet
+		for tab in self.win.tabs():
+			if isinstance(tab, TabPlaceholder) and tab.path and tab.isModified():
+				self.win.materialize(tab)
+		kept = []
+		for editor in self.win.editors():
+			if editor.path and editor.isModified():
+				if editor.hasConflict():
+					# Saving would overwrite the other program's changes
+					kept.append(editor.keepInJournal())
+				else:
+					editor.save(wait=True)
+		self.journal.close(discardAll=self.closed_cleanly, keep=kept)
+		self.session.close()
+		findinfiles.stop_pool()
 		rc = 0 if self.closed_cleanly else 1
 		self.app.exit(rc)
 	
@@ -862,6 +2617,12 @@ def main():
 	parser = optparse.OptionParser()
 	parser.add_option("-w", "--wait", action="store_true",
 		help="Open a new Kurt instance and wait until it exists")
+	# Checked by profiling.py when it is imported
+	parser.add_option("--profile", action="store_true",
+		help="Time the callbacks from Qt, and write a trace at exit")
+	# Likewise checked by latency.py
+	parser.add_option("--latency", action="store_true",
+		help="Measure key press to paint latency, and log event loop stalls")
 
 	options, args = parser.parse_args()
 
@@ -878,17 +2639,8 @@ def main():
 		Kurt(settings, listener).start(args)
 	else:
 		logging.debug("Connecting to existing instance")
-		conn = pipe.Client(configDirName)
-		logging.debug("Connected")
-		
-		# TODO: Parse the command line properly
-		# For now, we assume that everything is a filename
-		if len(sys.argv) > 1:
-			for each in sys.argv[1:]:
-				conn.send("open " + each)
-		else:
-			conn.send("raise")
-		conn.close()
+		if not launcher.forward(args, configDirName):
+			logging.error("The running instance has gone away")
 
 if __name__ == "__main__":
 	main()	
@@ -0,0 +1,163 @@
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Measuring how long it takes for a keystroke to show up on screen.
+
+Latency mode is on if KURT_LATENCY is set in the environment, or --latency
+is on the command line. Then start() creates a LatencyMonitor, which
+timestamps each key press in an editor and records the time until the
+editor has finished painting, per tab, and a Watchdog, which logs the UI
+thread's stack whenever the event loop stalls for longer than STALL_MSECS.
+At exit, the latency percentiles for each tab are logged.
+
+bench/keystrokes.py uses this to replay typing into a file.
+"""
+
+import atexit
+import logging
+import os
+import sys
+import thread
+import threading
+import time
+import traceback
+
+from PyQt4.QtCore import *
+
+from util import *
+
+__all__ = ["enabled", "monitor", "start", "LatencyMonitor", "Watchdog",
+	"percentile"]
+
+enabled = bool(os.environ.get("KURT_LATENCY")) or "--latency" in sys.argv
+
+# Event loop stalls longer than this are logged
+STALL_MSECS = float(os.environ.get("KURT_LATENCY_STALL_MSECS", 250))
+
+# The LatencyMonitor, once start() has been called
+monitor = None
+
+def percentile(samples, p):
+	"""Return the p'th percentile of a sorted list of samples."""
+	if not samples:
+		return 0
+	return samples[min(len(samples) - 1, int(len(samples) * p / 100.))]
+
+class LatencyMonitor(QObject):
+	"""Records the time from each key press in a text edit to the end of
+	the next paint of its viewport. The text edits report their paints by
+	calling painted()."""
+
+	# Keys which always cause a repaint, besides those which type text.
+	# Others (e.g. shortcuts) might not, and the next paint could be e.g.
+	# the cursor blinking, long after.
+	EDITING_KEYS = set([Qt.Key_Return, Qt.Key_Enter, Qt.Key_Backspace,
+		Qt.Key_Delete, Qt.Key_Tab, Qt.Key_Backtab, Qt.Key_Left, Qt.Key_Right,
+		Qt.Key_Up, Qt.Key_Down, Qt.Key_Home, Qt.Key_End, Qt.Key_PageUp,
+		Qt.Key_PageDown])
+
+	# Samples kept per tab
+	MAX_SAMPLES = 100000
+
+	def __init__(self, parent=None):
+		QObject.__init__(self, parent)
+		self._tabs = {} # Maps each text edit to its tab
+		self._samples = {} # Maps each tab's title to its latencies, in msecs
+
+	def watch(self, textEdit, tab):
+		"""Measure key presses in 'textEdit', which belongs to 'tab'."""
+		textEdit.installEventFilter(self)
+		textEdit.keyPressTime = None
+		self._tabs[textEdit] = tab
+		safe_connect(textEdit.destroyed, lambda: self._tabs.pop(textEdit, None))
+
+	@pyqt_override
+	def eventFilter(self, obj, event):
+		# Installed after the window's KeyFilter, so it sees keys first
+		if (event.type() == QEvent.KeyPress and obj.keyPressTime is None
+		and (event.key() in self.EDITING_KEYS
+		or (event.text().length() > 0 and not event.modifiers() & Qt.ControlModifier))):
+			obj.keyPressTime = time.time()
+		return False
+
+	def painted(self, textEdit):
+		"""Called when 'textEdit' has finished painting."""
+		start = getattr(textEdit, "keyPressTime", None)
+		if start is None:
+			return
+		textEdit.keyPressTime = None
+		tab = self._tabs.get(textEdit)
+		name = tab.getTitle() if tab else "?"
+		samples = self._samples.setdefault(name, [])
+		if len(samples) < self.MAX_SAMPLES:
+			samples.append((time.time() - start) * 1000)
+
+	def samples(self):
+		"""Return a dict mapping each tab's title to its latencies."""
+		return self._samples
+
+	def report(self):
+		"""Return a table of the latency percentiles for each tab."""
+		lines = ["%-40s %8s %8s %8s %8s" % ("tab", "keys", "p50 ms", "p99 ms", "max ms")]
+		for name, samples in sorted(self._samples.items()):
+			samples = sorted(samples)
+			lines.append("%-40s %8d %8.1f %8.1f %8.1f" % (name[-40:], len(samples),
+				percentile(samples, 50), percentile(samples, 99), samples[-1]))
+		return "\n".join(lines)
+
+class Watchdog(QObject):
+	"""Logs the UI thread's stack when its event loop stalls. A timer on the
+	UI thread updates a heartbeat, which a thread of its own watches."""
+
+	HEARTBEAT_MSECS = 50
+
+	def __init__(self, threshold_msecs=STALL_MSECS, parent=None):
+		QObject.__init__(self, parent)
+		self.threshold = threshold_msecs / 1000.
+		self._uiThread = thread.get_ident()
+		self._beat = time.time()
+		self._timer = QTimer(self)
+		safe_connect(self._timer.timeout, self._heartbeat)
+		self._timer.start(self.HEARTBEAT_MSECS)
+		worker = threading.Thread(target=self._run)
+		worker.setDaemon(True)
+		worker.start()
+
+	def _heartbeat(self):
+		self._beat = time.time()
+
+	def _run(self):
+		reported = None # The heartbeat of the stall that has been logged
+		while True:
+			time.sleep(self.HEARTBEAT_MSECS / 1000.)
+			beat = self._beat
+			stalled = time.time() - beat
+			if stalled < self.threshold or beat == reported:
+				continue
+			reported = beat
+			frame = sys._current_frames().get(self._uiThread)
+			stack = "".join(traceback.format_stack(frame)).rstrip() if frame else "?"
+			logging.warning("Event loop stalled for %d ms; the UI thread is at:\n%s"
+				% (stalled * 1000, stack))
+
+def _atexit():
+	if monitor:
+		logging.info("Key press to paint latency:\n" + monitor.report())
+
+def start(parent=None):
+	"""Start measuring. Must be called on the UI thread, once there is a
+	QApplication."""
+	global monitor
+	if monitor is None:
+		monitor = LatencyMonitor(parent)
+		Watchdog(STALL_MSECS, monitor)
+		atexit.register(_atexit)
+	return monitor
@@ -0,0 +1,135 @@
+#! /usr/bin/env python2.6
+
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""The command line entry point.
+
+If Kurt is already running, all there is to do is pass the arguments to the
+running instance over its socket, which doesn't need Qt. So this module
+only uses the standard library, and imports the rest of Kurt only when no
+instance is running.
+"""
+
+import errno
+import os
+import socket
+import struct
+import sys
+
+__all__ = ["config_dir", "decode_messages", "encode_message", "forward",
+	"remove_stale_socket", "socket_path"]
+
+# The organization name used for the QSettings in kurt.main
+ORGANIZATION = "dubroy.com"
+
+def config_dir():
+	"""Return the directory that Kurt keeps its settings in. This is the
+	same directory that Qt puts the settings file in (see kurt.main)."""
+	if sys.platform.startswith("win"):
+		base = os.environ.get("APPDATA") or os.path.expanduser("~")
+	else:
+		base = (os.environ.get("XDG_CONFIG_HOME")
+			or os.path.join(os.path.expanduser("~"), ".config"))
+	return os.path.join(base, ORGANIZATION)
+
+# Messages on the socket are a 4-byte, big-endian length, followed by that
+# many bytes: the command and its arguments, separated by NUL characters.
+_HEADER = struct.Struct(">I")
+
+# Longer messages are assumed to be garbage
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+def encode_message(command, args=()):
+	"""Return the bytes to send for a command (e.g. "open") and a list of
+	arguments. Unicode strings are sent as UTF-8."""
+	parts = [command] + list(args)
+	parts = [x.encode("utf-8") if isinstance(x, unicode) else x for x in parts]
+	payload = "\0".join(parts)
+	return _HEADER.pack(len(payload)) + payload
+
+def decode_messages(data):
+	"""Split the bytes received so far into messages. Returns a tuple
+	(messages, rest), where each message is a list [command, arg, ...] and
+	'rest' is the start of an incomplete message. Raises ValueError if the
+	data can't be a message."""
+	messages = []
+	while len(data) >= _HEADER.size:
+		length = _HEADER.unpack(data[:_HEADER.size])[0]
+		if length > MAX_MESSAGE_SIZE:
+			raise ValueError("Message too long (%d bytes)" % length)
+		end = _HEADER.size + length
+		if len(data) < end:
+			break
+		messages.append(data[_HEADER.size:end].split("\0"))
+		data = data[end:]
+	return messages, data
+
+def socket_path(directory):
+	"""Return the path of the socket that the running instance listens on."""
+	return os.path.join(directory, "sock")
+
+def remove_stale_socket(path):
+	"""If the socket at 'path' was left behind by an instance that didn't
+	exit cleanly, remove it. Returns True if it was removed."""
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		try:
+			sock.connect(path)
+		except socket.error, e:
+			if e[0] != errno.ECONNREFUSED:
+				return False
+			try:
+				os.remove(path)
+			except OSError:
+				return False
+			return True
+		return False # Someone is listening
+	finally:
+		sock.close()
+
+def forward(paths, directory=None):
+	"""Ask the running instance to open the files in 'paths', or if there
+	are none, to come to the front. Returns False if no instance is running.
+	"""
+	if not hasattr(socket, "AF_UNIX"):
+		return False
+	path = socket_path(directory or config_dir())
+	if paths:
+		message = encode_message("open", [os.path.abspath(x) for x in paths])
+	else:
+		message = encode_message("raise")
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		try:
+			sock.connect(path)
+		except socket.error, e:
+			if e[0] not in (errno.ENOENT, errno.ECONNREFUSED):
+				raise
+			if e[0] == errno.ECONNREFUSED:
+				remove_stale_socket(path)
+			return False
+		sock.sendall(message)
+	finally:
+		sock.close()
+	return True
+
+def main():
+	args = sys.argv[1:]
+	# Options (e.g. --wait, --profile or --latency) are left to kurt.main
+	options = [x for x in args if x.startswith("-")]
+	if not options and forward(args):
+		return
+	import kurt
+	kurt.main()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,277 @@
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Lexers for syntax highlighting, and a registry of them by file extension.
+
+A lexer is declared as a set of states, each with a list of rules. A rule is
+a tuple (regex, kind) or (regex, kind, next_state), where 'kind' is one of:
+
+ - the name of a kind of token ("comment", "string", "keyword", ...)
+ - None, for text that isn't highlighted
+ - a tuple with a kind for each group in the regex
+ - a dict mapping the matched text to its kind, e.g. made with words()
+
+The rules of each state are compiled once into a single regex, with a group
+per rule. Text that no rule matches gets the state's default kind, if it
+has one. Lexing works a line at a time, and the state at the end of a
+line is a small integer (0 being "root"), so it can be used directly as a
+QSyntaxHighlighter block state.
+
+This module doesn't depend on Qt.
+"""
+
+import keyword
+import os
+import re
+
+__all__ = ["Lexer", "words", "register", "for_path", "lexers",
+	"PYTHON", "JAVASCRIPT", "C", "JSON", "MARKDOWN", "SHELL"]
+
+def words(**kinds):
+	"""Return a dict for use as a rule's kind, mapping each of the given
+	words to its kind, e.g. words(keyword=["if", "else"])."""
+	result = {}
+	for kind, each in kinds.iteritems():
+		for word in each:
+			result[word] = kind
+	return result
+
+class _Rule(object):
+	def __init__(self, kind, next, group, groups):
+		self.kind = kind
+		self.next = next
+		self.group = group # Index of the group around the whole rule
+		self.groups = groups # Number of groups inside the rule
+
+class _State(object):
+	def __init__(self, pattern, rules, default):
+		self.pattern = pattern
+		self.rules = rules # Maps the index of each rule's group to the _Rule
+		self.default = default
+
+class Lexer(object):
+	"""A lexer compiled from a declaration (see the module docstring).
+	'states' maps each state's name to its list of rules, and must include
+	"root". 'defaults' maps state names to the kind of the text that isn't
+	matched by any rule."""
+
+	def __init__(self, name, extensions, states, defaults=None):
+		self.name = name
+		self.extensions = extensions
+		defaults = defaults or {}
+		names = ["root"] + sorted(x for x in states if x != "root")
+		numbers = dict((x, i) for i, x in enumerate(names))
+		self._states = []
+		for each in names:
+			self._states.append(self._compile(each, states[each], numbers,
+				defaults.get(each)))
+
+	def _compile(self, name, rules, numbers, default):
+		parts = []
+		compiled = {}
+		group = 1
+		for rule in rules:
+			regex, kind = rule[0], rule[1]
+			next = numbers[rule[2]] if len(rule) > 2 else None
+			pattern = re.compile(regex)
+			if pattern.match(""):
+				raise ValueError("Rule %r in state %s of the %s lexer matches "
+					"the empty string" % (regex, name, self.name))
+			if isinstance(kind, tuple) and len(kind) != pattern.groups:
+				raise ValueError("Rule %r in state %s of the %s lexer needs %d "
+					"kinds" % (regex, name, self.name, pattern.groups))
+			parts.append("(%s)" % regex)
+			compiled[group] = _Rule(kind, next, group, pattern.groups)
+			group += 1 + pattern.groups
+		return _State(re.compile("|".join(parts)), compiled, default)
+
+	def lex(self, text, state=0):
+		"""Lex a single line, starting in the given state. Returns a tuple
+		(runs, end_state), where runs is a tuple of (start, length, kind)
+		triples."""
+		runs = []
+		def add(start, length, kind):
+			# Runs of the same kind that touch are merged
+			if runs and runs[-1][2] == kind and sum(runs[-1][:2]) == start:
+				runs[-1] = (runs[-1][0], runs[-1][1] + length, kind)
+			else:
+				runs.append((start, length, kind))
+		pos = 0
+		end = len(text)
+		while pos < end:
+			current = self._states[state]
+			match = current.pattern.search(text, pos)
+			if match is None:
+				if current.default:
+					add(pos, end - pos, current.default)
+				break
+			start = match.start()
+			if start > pos and current.default:
+				add(pos, start - pos, current.default)
+			# The rule's group encloses any others in it, so it's the last
+			# to close
+			rule = current.rules[match.lastindex]
+			kind = rule.kind
+			if isinstance(kind, tuple):
+				for i, each in enumerate(kind):
+					group = rule.group + 1 + i
+					if each and match.start(group) >= 0:
+						add(match.start(group), match.end(group) - match.start(group), each)
+			else:
+				if isinstance(kind, dict):
+					kind = kind.get(match.group())
+				if kind:
+					add(start, match.end() - start, kind)
+			if rule.next is not None:
+				state = rule.next
+			pos = match.end()
+		return tuple(runs), state
+
+_registry = {} # Maps each file extension to its lexer
+
+def register(lexer):
+	"""Use 'lexer' for files with any of its extensions."""
+	for each in lexer.extensions:
+		_registry[each.lower()] = lexer
+
+def for_path(path):
+	"""Return the lexer for the file at 'path', or None."""
+	return _registry.get(os.path.splitext(path)[1].lower())
+
+def lexers():
+	"""Return all the registered lexers."""
+	return list(set(_registry.values()))
+
+# Pieces shared by several lexers
+_DQ_STRING = r'"(?:\\.|[^\\"])*"?'
+_SQ_STRING = r"'(?:\\.|[^\\'])*'?"
+_NUMBER = r"\b(?:0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)[a-zA-Z]*\b"
+_NAME = r"[A-Za-z_$][\w$]*"
+
+PYTHON = Lexer("Python", [".py", ".pyw"], {
+	"root": [
+		(r"#.*", "comment"),
+		(r"[uUbB]?[rR]?'''", "string", "single-triple"),
+		(r'[uUbB]?[rR]?"""', "string", "double-triple"),
+		(r"[uUbB]?[rR]?" + _SQ_STRING, "string"),
+		(r"[uUbB]?[rR]?" + _DQ_STRING, "string"),
+		(r"\b(def|class)\s+([A-Za-z_]\w*)", ("keyword", "identifier")),
+		(r"[A-Za-z_]\w*", words(keyword=keyword.kwlist))
+	],
+	"single-triple": [
+		(r"(?:\\.|[^\\])*?'''", "string", "root")
+	],
+	"double-triple": [
+		(r'(?:\\.|[^\\])*?"""', "string", "root")
+	]
+}, defaults={"single-triple": "string", "double-triple": "string"})
+
+_JS_KEYWORDS = ["break", "case", "catch", "class", "const", "continue",
+	"debugger", "default", "delete", "do", "else", "export", "extends",
+	"finally", "for", "function", "if", "import", "in", "instanceof", "let",
+	"new", "return", "super", "switch", "this", "throw", "try", "typeof",
+	"var", "void", "while", "with", "yield", "async", "await", "of",
+	"static", "get", "set", "true", "false", "null", "undefined"]
+
+JAVASCRIPT = Lexer("JavaScript", [".js", ".mjs", ".jsx"], {
+	"root": [
+		(r"//.*", "comment"),
+		(r"/\*", "comment", "comment"),
+		(_SQ_STRING, "string"),
+		(_DQ_STRING, "string"),
+		(r"`", "string", "template"),
+		(r"\b(function|class)\s+(" + _NAME + ")", ("keyword", "identifier")),
+		(_NUMBER, "number"),
+		(_NAME, words(keyword=_JS_KEYWORDS))
+	],
+	"comment": [
+		(r".*?\*/", "comment", "root")
+	],
+	"template": [
+		(r"(?:\\.|[^\\`])*`", "string", "root")
+	]
+}, defaults={"comment": "comment", "template": "string"})
+
+_C_KEYWORDS = ["auto", "break", "case", "char", "const", "continue",
+	"default", "do", "double", "else", "enum", "extern", "float", "for",
+	"goto", "if", "inline", "int", "long", "register", "restrict", "return",
+	"short", "signed", "sizeof", "static", "struct", "switch", "typedef",
+	"union", "unsigned", "void", "volatile", "while", "bool", "true",
+	"false", "NULL"]
+
+C = Lexer("C", [".c", ".h", ".cc", ".cpp", ".cxx", ".hpp", ".m"], {
+	"root": [
+		(r"^\s*#\s*\w+", "keyword"),
+		(r"//.*", "comment"),
+		(r"/\*", "comment", "comment"),
+		(r"L?" + _DQ_STRING, "string"),
+		(r"L?'(?:\\.|[^\\'])*'", "string"),
+		(r"\b(struct|union|enum)\s+([A-Za-z_]\w*)", ("keyword", "identifier")),
+		(_NUMBER, "number"),
+		(r"[A-Za-z_]\w*", words(keyword=_C_KEYWORDS))
+	],
+	"comment": [
+		(r".*?\*/", "comment", "root")
+	]
+}, defaults={"comment": "comment"})
+
+JSON = Lexer("JSON", [".json"], {
+	"root": [
+		(r'"(?:\\.|[^\\"])*"(?=\s*:)', "identifier"),
+		(_DQ_STRING, "string"),
+		(r"-?" + _NUMBER, "number"),
+		(r"\b(?:true|false|null)\b", "keyword")
+	]
+})
+
+MARKDOWN = Lexer("Markdown", [".md", ".markdown", ".mkd"], {
+	"root": [
+		(r"^#{1,6}\s.*", "heading"),
+		(r"^\s*(?:```|~~~).*", "code", "fence"),
+		(r"^>.*", "comment"),
+		(r"^\s*(?:[-*+]|\d+\.)\s", "keyword"),
+		(r"`[^`]+`", "code"),
+		(r"\*\*[^*]+\*\*|__[^_]+__|\*[^*\s][^*]*\*|\b_[^_\s][^_]*_\b", "emphasis"),
+		(r"!?\[[^\]]*\]\([^)]*\)", "identifier")
+	],
+	"fence": [
+		(r"^\s*(?:```|~~~)\s*$", "code", "root")
+	]
+}, defaults={"fence": "code"})
+
+_SHELL_KEYWORDS = ["if", "then", "else", "elif", "fi", "for", "while",
+	"until", "do", "done", "case", "esac", "in", "function", "return",
+	"local", "export", "readonly", "declare", "unset", "shift", "exit",
+	"break", "continue", "source", "select", "time"]
+
+_SHELL_VARIABLE = r"\$\{[^}]*\}|\$[A-Za-z_]\w*|\$[@*#?$!0-9-]"
+
+SHELL = Lexer("Shell", [".sh", ".bash", ".zsh", ".ksh"], {
+	"root": [
+		(r"(?<![^\s;|&(])#.*", "comment"),
+		(r"'", "string", "single"),
+		(r'"', "string", "double"),
+		(_SHELL_VARIABLE, "identifier"),
+		(r"\b([A-Za-z_]\w*)\s*\(\)", ("identifier",)),
+		(r"[A-Za-z_][\w-]*", words(keyword=_SHELL_KEYWORDS))
+	],
+	# Quoted strings may span lines
+	"single": [
+		(r"[^']*'", "string", "root")
+	],
+	"double": [
+		(_SHELL_VARIABLE, "identifier"),
+		(r'(?:\\.|[^\\"$])*"', "string", "root")
+	]
+}, defaults={"single": "string", "double": "string"})
+
+for _lexer in [PYTHON, JAVASCRIPT, C, JSON, MARKDOWN, SHELL]:
+	register(_lexer)
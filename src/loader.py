@@ -0,0 +1,236 @@
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Reading files from disk into the editor.
+
+Small files are read in one go. Larger ones are read in chunks on a worker
+thread by a FileLoader, which hands the decoded text back to the UI thread
+in batches, so that the event loop keeps running while the file loads.
+
+The encoding of a large file is guessed from its first chunk. If a later
+chunk turns out not to be in that encoding, the file is read again from the
+start as Latin-1 (which any bytes are), rather than loading it with
+replacement characters that would be written back when it's saved.
+"""
+
+import codecs
+import logging
+import os
+import Queue
+import thread
+import time
+
+from PyQt4.QtCore import *
+
+from util import *
+
+__all__ = ["FileLoader", "file_stamp", "read_file", "SYNC_LOAD_LIMIT"]
+
+# Files up to this size (in bytes) are read synchronously
+SYNC_LOAD_LIMIT = 256 * 1024
+
+CHUNK_SIZE = 256 * 1024
+
+# The number of chunks the worker may read ahead of the UI thread
+QUEUE_SIZE = 8
+
+# Queued when the text loaded so far should be thrown away
+_RESTART = "restart"
+
+def detect_encoding(data):
+	"""Guess the encoding of a file from its first bytes."""
+	if data.startswith(codecs.BOM_UTF8):
+		return "utf-8-sig"
+	if data.startswith(codecs.BOM_UTF16_LE) or data.startswith(codecs.BOM_UTF16_BE):
+		return "utf-16"
+	try:
+		# Don't count a multibyte character cut off at the end of the chunk
+		codecs.getincrementaldecoder("utf-8")().decode(data, False)
+		return "utf-8"
+	except UnicodeDecodeError:
+		return "latin-1"
+
+def detect_line_ending(text):
+	"""Return the first line ending used in 'text', or None if there is no
+	line break in it."""
+	lf = text.find(u"\n")
+	cr = text.find(u"\r")
+	if cr >= 0 and (lf < 0 or cr < lf):
+		return "\r\n" if lf == cr + 1 else "\r"
+	if lf >= 0:
+		return "\n"
+	return None
+
+def normalize_line_endings(text):
+	return text.replace(u"\r\n", u"\n").replace(u"\r", u"\n")
+
+def file_stamp(path):
+	"""Return the (mtime, size) of a file, which is used to tell whether it
+	has changed, or None if it doesn't exist."""
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	return (st.st_mtime, st.st_size)
+
+def read_file(path):
+	"""Read a whole file. Returns a tuple (text, encoding, line_ending),
+	where text is unicode with '\\n' line endings."""
+	data = open(path, "rb").read()
+	encoding = detect_encoding(data)
+	try:
+		text = data.decode(encoding)
+	except UnicodeDecodeError:
+		encoding = "latin-1"
+		text = data.decode(encoding)
+	line_ending = detect_line_ending(text) or os.linesep
+	return normalize_line_endings(text), encoding, line_ending
+
+class FileLoader(QObject):
+	"""Loads a file on a worker thread. The text is delivered on the UI
+	thread, in batches, through the textLoaded signal."""
+
+	# Emitted with a unicode string to be appended to the document
+	textLoaded = pyqtSignal(object)
+
+	# Emitted with the percentage of the file that has been loaded so far
+	progress = pyqtSignal(int)
+
+	# Emitted when the text delivered so far should be thrown away, because
+	# the file is being read again in another encoding
+	restarted = pyqtSignal()
+
+	finished = pyqtSignal()
+	failed = pyqtSignal(str)
+
+	# How often to check for new text, and how much time to spend per batch
+	DRAIN_INTERVAL_MSECS = 10
+	BATCH_MSECS = 20
+
+	def __init__(self, path, parent=None):
+		QObject.__init__(self, parent)
+		self.path = path
+		self.size = max(1, os.path.getsize(path))
+		self.encoding = None
+		self.lineEnding = None
+
+		self._queue = Queue.Queue(QUEUE_SIZE)
+		self._cancelled = False
+		self._bytesLoaded = 0
+		self._percent = -1
+
+		self._timer = QTimer(self)
+		safe_connect(self._timer.timeout, self._drain)
+
+	def start(self):
+		thread.start_new_thread(self._run, ())
+		self._timer.start(self.DRAIN_INTERVAL_MSECS)
+
+	def cancel(self):
+		"""Stop loading. No more signals will be emitted after this."""
+		self._cancelled = True
+		self._timer.stop()
+		# Unblock the worker if it's waiting for space in the queue
+		try:
+			while True:
+				self._queue.get_nowait()
+		except Queue.Empty:
+			pass
+
+	def _put(self, item):
+		while not self._cancelled:
+			try:
+				self._queue.put(item, True, 0.1)
+				return
+			except Queue.Full:
+				pass
+
+	def _run(self):
+		f = None
+		try:
+			try:
+				f = open(self.path, "rb")
+				data = f.read(CHUNK_SIZE)
+				self.encoding = detect_encoding(data)
+				try:
+					self._read(f, data)
+				except UnicodeDecodeError, e:
+					logging.warning("%s is not %s after all (%s), reading it as latin-1"
+						% (self.path, self.encoding, e))
+					self._put(_RESTART)
+					self.encoding = "latin-1"
+					f.seek(0)
+					self._read(f, f.read(CHUNK_SIZE))
+				self._put(None)
+			except (IOError, OSError, LookupError), e:
+				self._put(e)
+		finally:
+			if f: f.close()
+
+	def _read(self, f, data):
+		# Decode the rest of the file, starting with 'data'
+		decoder = codecs.getincrementaldecoder(self.encoding)()
+		carry = u""
+		while data and not self._cancelled:
+			text = carry + decoder.decode(data)
+			if self.lineEnding is None:
+				self.lineEnding = detect_line_ending(text)
+			# Hold back a trailing CR, in case it's half of a CRLF
+			if text.endswith(u"\r"):
+				text, carry = text[:-1], u"\r"
+			else:
+				carry = u""
+			self._put((normalize_line_endings(text), len(data)))
+			data = f.read(CHUNK_SIZE)
+		text = carry + decoder.decode("", True)
+		self._put((normalize_line_endings(text), 0))
+
+	def _drain(self):
+		deadline = time.time() + self.BATCH_MSECS / 1000.
+		batch = []
+		done = False
+		error = None
+		while time.time() < deadline:
+			try:
+				item = self._queue.get_nowait()
+			except Queue.Empty:
+				break
+			if item is None:
+				done = True
+				break
+			if isinstance(item, Exception):
+				error = item
+				break
+			if item is _RESTART:
+				batch = []
+				self._bytesLoaded = 0
+				self.restarted.emit()
+				continue
+			text, length = item
+			batch.append(text)
+			self._bytesLoaded += length
+
+		if batch:
+			self.textLoaded.emit(u"".join(batch))
+		percent = min(100, self._bytesLoaded * 100 / self.size)
+		if percent != self._percent:
+			self._percent = percent
+			self.progress.emit(percent)
+
+		if error is not None:
+			self._timer.stop()
+			logging.error("Error loading %s: %s" % (self.path, error))
+			self.failed.emit(str(error))
+		elif done:
+			self._timer.stop()
+			if self.lineEnding is None:
+				self.lineEnding = os.linesep
+			self.finished.emit()
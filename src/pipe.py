@@ -15,11 +15,16 @@ import atexit
 import errno
 import logging
 import os
+import select
 import socket
 import thread
+import threading
+import time
 
 from PyQt4.QtCore import *
 
+from launcher import decode_messages, encode_message, remove_stale_socket, socket_path
+
 __all__ = ["Listener", "Client"]
 
 _socket_files = []
@@ -34,50 +39,125 @@ def _cleanup():
 atexit.register(_cleanup)
 
 class _Listener(QObject):
+	"""Listens for messages from other Kurt processes (see launcher.py) on
+	a thread of its own. Any number of clients can be connected at once."""
 
-	remoteOpenRequest = pyqtSignal(str)
+	# Emitted when there are files to open, or the window should be raised.
+	# The paths are collected with takeRequests(); requests that arrive
+	# before the UI thread gets around to that are batched together.
+	requestsReady = pyqtSignal()
 
 	def __init__(self, sock, *args):
 		super(QObject, self).__init__()
 		self._socket = sock
-		self._socket.listen(1)
+		self._socket.listen(16)
+		self._lock = threading.Lock()
+		self._paths = []
+		self._pending = False
 	
 	def start(self):
 		thread.start_new_thread(self.run, ())
 
-	def _handle_connection(self, conn):
+	def takeRequests(self):
+		"""Return the paths of the files that have been requested since the
+		last call, which may be none if the window just needs raising."""
+		self._lock.acquire()
 		try:
-			logging.debug("Connection accepted")
-			message = conn.recv(1024)
-			logging.debug("Listener received message '%s'" % message)
-			parts = message.split(" ", 1)
-			if parts[0] == "quit":
+			paths = self._paths
+			self._paths = []
+			self._pending = False
+		finally:
+			self._lock.release()
+		return paths
+
+	def _request(self, paths):
+		self._lock.acquire()
+		try:
+			self._paths.extend(paths)
+			notify = not self._pending
+			self._pending = True
+		finally:
+			self._lock.release()
+		if notify:
+			self.requestsReady.emit()
+
+	def _handle_messages(self, messages):
+		"""Handle the messages received from one client. Returns False if
+		the listener should stop."""
+		paths = []
+		requested = False
+		for message in messages:
+			command, args = message[0], message[1:]
+			logging.debug("Listener received '%s' with %d arguments" % (command, len(args)))
+			if command == "quit":
 				return False
-			elif parts[0] == "raise":
-				self.remoteOpenRequest.emit("")
-			elif parts[0] == "open":
-				# Using a signal to pass the message to the UI thread
-				self.remoteOpenRequest.emit(os.path.abspath(parts[1]))
+			elif command == "raise":
+				requested = True
+			elif command == "open":
+				requested = True
+				paths.extend(os.path.abspath(x) for x in args)
 			else:
-				logging.warning("Listener received unrecognized command '%s'" % cmd)
-		finally:
-			conn.close()
+				logging.warning("Listener received unrecognized command '%s'" % command)
+		if requested:
+			self._request(paths)
 		return True
 		
 	def run(self):
 		filename = None
+		clients = {} # Maps each connected socket to the data received so far
 		try:
 			filename = self._socket.getsockname()
 
 			while True:
-				conn, addr = self._socket.accept()
-				if not self._handle_connection(conn):
-					break
+				try:
+					readable = select.select([self._socket] + clients.keys(), [], [])[0]
+				except select.error, e:
+					if e[0] == errno.EINTR:
+						continue
+					raise
+				for sock in readable:
+					if sock is self._socket:
+						self._accept(clients)
+						continue
+					try:
+						data = sock.recv(65536)
+					except socket.error, e:
+						if e[0] in (errno.EINTR, errno.EAGAIN):
+							continue
+						logging.warning("Dropping client: %s" % e)
+						data = None
+					if data:
+						try:
+							messages, clients[sock] = decode_messages(clients[sock] + data)
+						except ValueError, e:
+							logging.warning("Dropping client: %s" % e)
+							data = None
+						else:
+							if not self._handle_messages(messages):
+								return
+					if not data:
+						sock.close()
+						del clients[sock]
 		finally:
+			for each in clients:
+				each.close()
 			self._socket.close()
 			if filename: os.remove(filename) # Clean up the UNIX domain socket file
-		logging.debug("Exiting listener thread")
+			logging.debug("Exiting listener thread")
 		
+	def _accept(self, clients):
+		try:
+			conn, addr = self._socket.accept()
+		except socket.error, e:
+			# The client may have given up already, or we may be out of file
+			# descriptors (in which case the socket stays readable, so wait a
+			# little to give some a chance to be freed)
+			logging.warning("Failed to accept a client: %s" % e)
+			if e[0] in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM):
+				time.sleep(0.1)
+			return
+		clients[conn] = ""
+
 	def shutdown(self):
 		"""Shut down the listener thread. This should be called by an outside
 		thread, usually the one that started the listener thread."""
@@ -88,18 +168,17 @@ class _Listener(QObject):
 		try:
 			client_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
 			client_sock.connect(addr)
-			client_sock.send("quit")
+			client_sock.sendall(encode_message("quit"))
 		finally:
 			if client_sock: client_sock.close()
 
-def _get_pipe_name(config_dir):
-	return os.path.join(config_dir, "sock")
-
 def Listener(config_dir):
 	listener = None	
 	try:
 		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-		filename = _get_pipe_name(config_dir)
+		filename = socket_path(config_dir)
+		if remove_stale_socket(filename):
+			logging.debug("Removed stale socket %s" % filename)
 		sock.bind(filename)
 		_socket_files.append(filename) # Put this in the list to be cleaned up
 		listener = _Listener(sock)
@@ -112,6 +191,6 @@ def Listener(config_dir):
 
 def Client(config_dir):
 	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-	sock.connect(_get_pipe_name(config_dir))
+	sock.connect(socket_path(config_dir))
 	return sock
 
@@ -0,0 +1,214 @@
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Optional profiling of the callbacks from Qt into Python.
+
+Profiling is on if KURT_PROFILE is set in the environment, or --profile is
+on the command line. Then util.pyqt_guarded wraps every callback with
+timed(), which keeps call counts, times and a latency histogram for each
+one, and records a trace of every call. Callbacks on the UI thread that take
+longer than SLOW_MSECS are logged, along with a sample of the stack taken
+while they were running. At exit, a summary is logged and the trace is
+written in Chrome's trace event format (see chrome://tracing), to the file
+named by KURT_PROFILE_TRACE or to kurt-trace-PID.json in the temporary
+directory.
+
+The decision is made when util is imported, and when profiling is off
+nothing is wrapped, so it costs nothing.
+
+This module only uses the standard library.
+"""
+
+import atexit
+import bisect
+import logging
+import os
+import sys
+import tempfile
+import thread
+import threading
+import time
+import traceback
+
+try:
+	import json
+except ImportError:
+	import simplejson as json
+
+__all__ = ["enabled", "callback_name", "timed", "report", "write_trace"]
+
+enabled = bool(os.environ.get("KURT_PROFILE")) or "--profile" in sys.argv
+
+# Callbacks on the UI thread that take longer than this are logged
+SLOW_MSECS = float(os.environ.get("KURT_PROFILE_SLOW_MSECS", 100))
+
+# How often to check whether the UI thread is in a slow callback
+SAMPLE_INTERVAL_SECS = 0.005
+
+# Calls beyond this many aren't added to the trace
+MAX_TRACE_EVENTS = 1000000
+
+# Upper bounds of the histogram buckets, in milliseconds. The last bucket
+# holds everything slower.
+BUCKETS_MSECS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+class CallStats(object):
+	"""The count, times and latency histogram of one callback."""
+
+	def __init__(self):
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+		self.buckets = [0] * (len(BUCKETS_MSECS) + 1)
+
+	def add(self, msecs):
+		self.count += 1
+		self.total += msecs
+		self.max = max(self.max, msecs)
+		self.buckets[bisect.bisect_left(BUCKETS_MSECS, msecs)] += 1
+
+	def percentile(self, p):
+		"""Return an upper bound on the p'th percentile, in milliseconds."""
+		wanted = self.count * p / 100.
+		seen = 0
+		for i, n in enumerate(self.buckets):
+			seen += n
+			if seen >= wanted and n:
+				return min(BUCKETS_MSECS[i], self.max) if i < len(BUCKETS_MSECS) else self.max
+		return self.max
+
+_lock = threading.Lock()
+_stats = {} # Maps each callback name to its CallStats
+_trace = [] # (name, start, end, thread id) for each call
+_epoch = time.time()
+
+# The UI thread is the one that imports this, via util
+_uiThread = thread.get_ident()
+
+# The outermost callback running on the UI thread, if any, as a list
+# [name, start time, stack sample]
+_active = None
+_depth = 0
+
+def callback_name(f):
+	"""Return a name for the callable 'f' to use in reports."""
+	target = getattr(f, "im_self", None)
+	name = getattr(f, "__name__", None) or repr(f)
+	if target is not None:
+		return "%s.%s" % (type(target).__name__, name)
+	code = getattr(f, "func_code", None)
+	if code is not None:
+		return "%s.%s:%d" % (getattr(f, "__module__", "?"), name, code.co_firstlineno)
+	return name
+
+def timed(f, name):
+	"""Return a wrapper around 'f' which records its calls as 'name'."""
+	def wrapper(*args):
+		global _active, _depth
+		outermost = None
+		ui = thread.get_ident() == _uiThread
+		start = time.time()
+		if ui:
+			_depth += 1
+			if _depth == 1:
+				_active = outermost = [name, start, None]
+		try:
+			return f(*args)
+		finally:
+			end = time.time()
+			if ui:
+				_depth -= 1
+				if outermost:
+					_active = None
+			_record(name, start, end, outermost)
+	return wrapper
+
+def _record(name, start, end, outermost):
+	msecs = (end - start) * 1000
+	_lock.acquire()
+	try:
+		stats = _stats.get(name)
+		if stats is None:
+			stats = _stats[name] = CallStats()
+		stats.add(msecs)
+		if len(_trace) < MAX_TRACE_EVENTS:
+			_trace.append((name, start, end, thread.get_ident()))
+	finally:
+		_lock.release()
+	if outermost and msecs > SLOW_MSECS:
+		stack = outermost[2]
+		if stack:
+			stack = "; sampled at:\n" + "".join(stack).rstrip()
+		logging.warning("Slow callback %s took %.1f ms%s" % (name, msecs, stack or ""))
+
+def _sample():
+	# Runs on a thread of its own. Takes one stack sample from the UI
+	# thread during each callback that runs for longer than SLOW_MSECS.
+	while True:
+		time.sleep(SAMPLE_INTERVAL_SECS)
+		active = _active
+		if active is None or active[2] is not None:
+			continue
+		if (time.time() - active[1]) * 1000 < SLOW_MSECS:
+			continue
+		frame = sys._current_frames().get(_uiThread)
+		if frame is not None:
+			active[2] = traceback.format_stack(frame)
+
+def report(limit=30):
+	"""Return a table of the callbacks that took the most time in total."""
+	_lock.acquire()
+	try:
+		rows = sorted(_stats.items(), key=lambda x: -x[1].total)[:limit]
+	finally:
+		_lock.release()
+	lines = ["%-50s %8s %10s %8s %8s %8s %8s" % ("callback", "calls",
+		"total ms", "mean", "p50", "p99", "max")]
+	for name, stats in rows:
+		lines.append("%-50s %8d %10.1f %8.2f %8.2f %8.2f %8.1f" % (name[-50:],
+			stats.count, stats.total, stats.total / stats.count,
+			stats.percentile(50), stats.percentile(99), stats.max))
+	return "\n".join(lines)
+
+def write_trace(path):
+	"""Write the calls recorded so far to 'path', as Chrome trace events."""
+	_lock.acquire()
+	try:
+		calls = list(_trace)
+	finally:
+		_lock.release()
+	pid = os.getpid()
+	events = []
+	for name, start, end, tid in calls:
+		events.append({"name": name, "cat": "callback", "ph": "X", "pid": pid,
+			"tid": tid, "ts": (start - _epoch) * 1e6, "dur": (end - start) * 1e6})
+	f = open(path, "w")
+	try:
+		json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+	finally:
+		f.close()
+
+def _atexit():
+	logging.info("Callback profile:\n" + report())
+	path = os.environ.get("KURT_PROFILE_TRACE") or os.path.join(
+		tempfile.gettempdir(), "kurt-trace-%d.json" % os.getpid())
+	try:
+		write_trace(path)
+	except (IOError, OSError), e:
+		logging.error("Couldn't write the trace to %s: %s" % (path, e))
+	else:
+		logging.info("Wrote the trace to %s" % path)
+
+if enabled:
+	sampler = threading.Thread(target=_sample)
+	sampler.setDaemon(True)
+	sampler.start()
+	atexit.register(_atexit)
@@ -0,0 +1,146 @@
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Saving documents to disk.
+
+A SaveJob takes a snapshot of the document text on the UI thread, and does
+the rest on a worker thread: it encodes the text a chunk at a time, writes
+it to a temporary file next to the destination, syncs it to disk, and then
+renames it over the destination. If anything goes wrong, the original file
+is left untouched.
+"""
+
+import codecs
+import logging
+import os
+import shutil
+import tempfile
+import thread
+import threading
+
+from PyQt4.QtCore import *
+
+__all__ = ["SaveJob", "write_atomically"]
+
+# Number of characters to convert and encode at a time
+CHUNK_SIZE = 1024 * 1024
+
+# mkstemp() creates files that only the owner can read, so new files get
+# their permissions from the umask instead.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def _sync_directory(dirname):
+	# Make sure the rename itself is on disk. Not possible on Windows.
+	if os.name != "posix":
+		return
+	fd = os.open(dirname, os.O_RDONLY)
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+def write_atomically(path, chunks):
+	"""Write the byte strings in 'chunks' to the file at 'path', replacing
+	it atomically. If 'path' is a symlink, the file it points to is replaced.
+	"""
+	path = os.path.realpath(path)
+	dirname, basename = os.path.split(path)
+	fd, temp_path = tempfile.mkstemp(
+		prefix="." + basename + ".", suffix=".tmp", dir=dirname)
+	try:
+		f = os.fdopen(fd, "wb")
+		try:
+			for chunk in chunks:
+				f.write(chunk)
+			f.flush()
+			os.fsync(f.fileno())
+		finally:
+			f.close()
+
+		if os.path.exists(path):
+			shutil.copymode(path, temp_path)
+		else:
+			os.chmod(temp_path, 0666 & ~_UMASK)
+
+		try:
+			os.rename(temp_path, path)
+		except OSError:
+			# On Windows, rename() won't replace an existing file
+			if os.name == "posix" or not os.path.exists(path):
+				raise
+			os.remove(path)
+			os.rename(temp_path, path)
+	except:
+		if os.path.exists(temp_path):
+			os.remove(temp_path)
+		raise
+	_sync_directory(dirname)
+
+def _encode_chunks(snapshot, encoding, line_ending):
+	"""Generate the encoded contents of a QString, one chunk at a time, so
+	that there is never more than one chunk of it in Python at once."""
+	encoder = codecs.getincrementalencoder(encoding)()
+	length = snapshot.length()
+	for start in xrange(0, length, CHUNK_SIZE):
+		text = unicode(snapshot.mid(start, CHUNK_SIZE))
+		if line_ending != "\n":
+			text = text.replace(u"\n", line_ending)
+		yield encoder.encode(text)
+	yield encoder.encode(u"", True)
+
+class SaveJob(QObject):
+	"""Saves a snapshot of a document's text to a file in the background."""
+
+	# Emitted with the encoding that was used, which is only different from
+	# the requested one if the text couldn't be represented in it
+	saved = pyqtSignal(str)
+
+	failed = pyqtSignal(str)
+
+	def __init__(self, path, snapshot, encoding, line_ending, parent=None):
+		"""'snapshot' is the document text as a QString, which can safely be
+		read from another thread (unlike the QTextDocument)."""
+		QObject.__init__(self, parent)
+		self.path = path
+		self.encoding = encoding
+		self._snapshot = snapshot
+		self._line_ending = line_ending
+		self._done = threading.Event()
+
+	def start(self):
+		thread.start_new_thread(self.run, ())
+
+	def wait(self):
+		"""Block until the save is finished. The result is still delivered
+		through the signals."""
+		self._done.wait()
+
+	def run(self):
+		"""Do the save. Normally runs on a worker thread, but can be called
+		directly to save synchronously."""
+		try:
+			try:
+				write_atomically(self.path, _encode_chunks(
+					self._snapshot, self.encoding, self._line_ending))
+			except UnicodeEncodeError:
+				logging.warning("Can't save %s as %s, using UTF-8"
+					% (self.path, self.encoding))
+				self.encoding = "utf-8"
+				write_atomically(self.path, _encode_chunks(
+					self._snapshot, self.encoding, self._line_ending))
+		except (IOError, OSError), e:
+			logging.error("Error saving %s: %s" % (self.path, e))
+			self.failed.emit(str(e))
+		else:
+			self.saved.emit(self.encoding)
+		self._snapshot = None
+		self._done.set()
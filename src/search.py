@@ -0,0 +1,325 @@
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Searching documents.
+
+A SearchIndex keeps a copy of a document's text as a Python string, which
+the re module can search much faster than QTextDocument.find can. The copy
+is made the first time the index is used, and after that it is kept up to
+date from the document's contentsChange signal. Offsets into the copy must
+be positions in the document, which count UTF-16 code units, so on Python
+builds where a character outside the BMP is a single character, the copy
+has it split into its two surrogates.
+
+The matches of the last query are kept too. When the document changes, the
+matches the edit touched are dropped and the ones after it are shifted, and
+the next query only searches the lines that were edited. That relies on
+matches not spanning lines, so patterns that could match a line break are
+searched for again from scratch.
+"""
+
+import bisect
+import re
+import sys
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+
+from util import *
+
+__all__ = ["SearchIndex", "compile_pattern", "text_at", "utf16"]
+
+# Regular expression syntax that may match a line break: a line break or a
+# control character (which could start a range that includes one), escapes
+# for classes and character codes, negated sets, and the DOTALL flag
+_LINE_BREAK_RE = re.compile(ur"[\x00-\n]|\\[nsSWDx0-9]|\[\^|\(\?[a-zA-Z]*s")
+
+if sys.maxunicode > 0xffff:
+	_ASTRAL_RE = re.compile(u"[\U00010000-\U0010ffff]")
+
+	def _surrogates(match):
+		n = ord(match.group()) - 0x10000
+		return unichr(0xd800 + (n >> 10)) + unichr(0xdc00 + (n & 0x3ff))
+
+	def utf16(text):
+		"""Return 'text' with each character outside the BMP split into a
+		surrogate pair, so that it is indexed like a QString."""
+		return _ASTRAL_RE.sub(_surrogates, text)
+else:
+	def utf16(text):
+		"""Return 'text' with each character outside the BMP split into a
+		surrogate pair, which on this build it already is."""
+		return text
+
+def _single_line(pattern, regex):
+	"""Return True if the matches of 'pattern' can't span lines."""
+	if regex:
+		return _LINE_BREAK_RE.search(pattern) is None
+	return u"\n" not in pattern
+
+def compile_pattern(pattern, regex=False, caseSensitive=True):
+	"""Compile a search string into a regular expression object. Raises
+	re.error if 'regex' is True and the pattern isn't valid."""
+	if not regex:
+		pattern = re.escape(pattern)
+	flags = re.UNICODE | re.MULTILINE
+	if not caseSensitive:
+		flags |= re.IGNORECASE
+	return re.compile(pattern, flags)
+
+def text_at(doc, position, length):
+	"""Return 'length' characters of the QTextDocument 'doc' as unicode,
+	with '\\n' line breaks."""
+	end = min(position + length, doc.characterCount() - 1)
+	if end <= position:
+		return u""
+	cursor = QTextCursor(doc)
+	cursor.setPosition(position)
+	cursor.setPosition(end, QTextCursor.KeepAnchor)
+	# selectedText() uses U+2029 as the paragraph separator
+	return unicode(cursor.selectedText()).replace(u"\u2029", u"\n")
+
+class SearchIndex(QObject):
+
+	# Stop collecting matches for the count after this many
+	MAX_MATCHES = 50000
+
+	# Applying more edits than this costs more than copying the text again
+	MAX_PENDING_EDITS = 1000
+
+	def __init__(self, doc):
+		QObject.__init__(self, doc)
+		self._doc = doc
+		self._text = None
+		self._edits = [] # Edits not yet applied to _text
+		self._expectedLength = 0
+		self._connected = False
+
+		# The last query, and the start and end offsets of its matches
+		self._key = None
+		self._compiled = None
+		self._starts = []
+		self._ends = []
+		self._capped = False
+		self._singleLine = False
+		self._dirty = None # The (start, end) of the text edited since then
+
+	def _contentsChange(self, position, removed, added):
+		if self._text is None:
+			self._key = None
+			return
+		if len(self._edits) >= self.MAX_PENDING_EDITS:
+			self._text = None
+			self._edits = []
+			self._key = None
+			return
+		self._edits.append((position, removed,
+			utf16(text_at(self._doc, position, added))))
+		self._expectedLength = self._doc.characterCount() - 1
+		if self._key is not None:
+			if self._capped or not self._singleLine:
+				self._key = None
+			else:
+				self._shiftMatches(position, removed, added)
+
+	def _shiftMatches(self, position, removed, added):
+		# Drop the matches that overlap the edit, move the ones after it,
+		# and add it to the span to search again
+		end = position + removed
+		delta = added - removed
+		i = bisect.bisect_right(self._ends, position)
+		j = bisect.bisect_left(self._starts, end)
+		self._starts[i:] = [x + delta for x in self._starts[j:]]
+		self._ends[i:] = [x + delta for x in self._ends[j:]]
+		dirtyStart, dirtyEnd = position, position + added
+		if self._dirty is not None:
+			start, stop = self._dirty
+			if start >= end:
+				start += delta
+			elif start > position:
+				start = position
+			if stop >= end:
+				stop += delta
+			elif stop > position:
+				stop = position + added
+			dirtyStart = min(dirtyStart, start)
+			dirtyEnd = max(dirtyEnd, stop)
+		self._dirty = (dirtyStart, dirtyEnd)
+
+	def text(self):
+		"""Return the text of the document as a unicode string, in which
+		offsets are document positions (see utf16)."""
+		if self._text is not None and self._edits:
+			text = self._text
+			for position, removed, added in self._edits:
+				text = text[:position] + added + text[position + removed:]
+			self._edits = []
+			# contentsChange sometimes reports more than actually changed
+			# (e.g. for setPlainText), in which case start over.
+			if len(text) != self._expectedLength:
+				text = None
+				self._key = None
+			self._text = text
+
+		if self._text is None:
+			self._text = utf16(unicode(self._doc.toPlainText()))
+			if not self._connected:
+				safe_connect(self._doc.contentsChange, self._contentsChange)
+				self._connected = True
+		return self._text
+
+	def memoryUsage(self):
+		"""Return the approximate size of the copy of the text, in bytes."""
+		if self._text is None:
+			return 0
+		# Python stores unicode strings as UCS-2 or UCS-4
+		return len(self._text) * (4 if sys.maxunicode > 0xffff else 2)
+
+	def _update(self, pattern, regex, caseSensitive):
+		key = (unicode(pattern), regex, caseSensitive)
+		text = self.text()
+		if key == self._key:
+			if self._dirty is not None:
+				self._rescan(text)
+			return
+		compiled = compile_pattern(utf16(key[0]), regex, caseSensitive)
+		starts = []
+		ends = []
+		for match in compiled.finditer(text):
+			if match.end() == match.start():
+				continue
+			starts.append(match.start())
+			ends.append(match.end())
+			if len(starts) >= self.MAX_MATCHES:
+				break
+		self._key = key
+		self._starts, self._ends = starts, ends
+		self._capped = len(starts) >= self.MAX_MATCHES
+		self._compiled = compiled
+		self._singleLine = _single_line(key[0], regex)
+		self._dirty = None
+
+	def _rescan(self, text):
+		# Search the lines that were edited again
+		start, end = self._dirty
+		self._dirty = None
+		start = text.rfind(u"\n", 0, start) + 1
+		end = text.find(u"\n", end)
+		if end < 0:
+			end = len(text)
+		starts = []
+		ends = []
+		for match in self._compiled.finditer(text, start, end):
+			if match.end() > match.start():
+				starts.append(match.start())
+				ends.append(match.end())
+		i = bisect.bisect_left(self._starts, start)
+		j = bisect.bisect_right(self._starts, end)
+		self._starts[i:j] = starts
+		self._ends[i:j] = ends
+		if len(self._starts) >= self.MAX_MATCHES:
+			del self._starts[self.MAX_MATCHES:]
+			del self._ends[self.MAX_MATCHES:]
+			self._capped = True
+
+	def count(self, pattern, regex=False, caseSensitive=True):
+		"""Return a tuple (count, exact). If there are more than MAX_MATCHES
+		matches, the count is MAX_MATCHES and 'exact' is False."""
+		self._update(pattern, regex, caseSensitive)
+		return len(self._starts), not self._capped
+
+	def indexOf(self, start, pattern, regex=False, caseSensitive=True):
+		"""Return the 0-based index of the match starting at 'start', or None
+		if it isn't one of the counted matches."""
+		self._update(pattern, regex, caseSensitive)
+		i = bisect.bisect_left(self._starts, start)
+		if i < len(self._starts) and self._starts[i] == start:
+			return i
+		return None
+
+	def find(self, pattern, position, forwards=True, regex=False, caseSensitive=True):
+		"""Return the (start, end) of the first match at or after 'position',
+		or if 'forwards' is False, the last match before it. Returns None if
+		there is no such match."""
+		self._update(pattern, regex, caseSensitive)
+		if forwards:
+			i = bisect.bisect_left(self._starts, position)
+			if i < len(self._starts):
+				return self._starts[i], self._ends[i]
+			if not self._capped:
+				return None
+			# Past the counted matches; search the text directly
+			compiled = self._compiled
+			match = compiled.search(self._text, max(position, self._starts[-1] + 1))
+			while match and match.start() == match.end():
+				match = compiled.search(self._text, match.end() + 1)
+			return match and match.span()
+		else:
+			i = bisect.bisect_left(self._starts, position)
+			if i == len(self._starts) and self._capped:
+				last = self._findLastBefore(position)
+				if last:
+					return last
+			if i > 0:
+				return self._starts[i - 1], self._ends[i - 1]
+			return None
+
+	def _findLastBefore(self, position):
+		# Look in a window before the position, doubling it until a match is
+		# found or it reaches the last of the counted matches
+		lower = self._starts[-1]
+		window = 4096
+		while True:
+			start = max(lower, position - window)
+			last = None
+			for match in self._compiled.finditer(self._text, start, position):
+				if match.end() > match.start():
+					last = match.span()
+			if last or start == lower:
+				return last
+			window *= 2
+
+	def matchesIn(self, start, end, pattern, regex=False, caseSensitive=True):
+		"""Return a list of the (start, end) of every match between the
+		offsets 'start' and 'end'."""
+		self._update(pattern, regex, caseSensitive)
+		i = bisect.bisect_left(self._starts, start)
+		j = bisect.bisect_left(self._starts, end)
+		if j < len(self._starts) or not self._capped:
+			return zip(self._starts[i:j], self._ends[i:j])
+		return [m.span() for m in self._compiled.finditer(self._text, start, end)
+			if m.end() > m.start()]
+
+	def _expand(self, match, template, regex):
+		return match.expand(template) if regex else template
+
+	def replacement(self, start, end, pattern, template, regex=False,
+			caseSensitive=True):
+		"""If the text from 'start' to 'end' is a match, return what it
+		should be replaced with, or else None. With 'regex', 'template' may
+		refer to groups as in re.sub (e.g. \\1); raises re.error if it
+		refers to a group that doesn't exist."""
+		self._update(pattern, regex, caseSensitive)
+		match = self._compiled.match(self._text, start)
+		if match is None or match.end() != end or end == start:
+			return None
+		return self._expand(match, template, regex)
+
+	def replacements(self, pattern, template, regex=False, caseSensitive=True):
+		"""Return a list of (start, end, replacement) for every match, in one
+		pass over the text. See replacement()."""
+		self._update(pattern, regex, caseSensitive)
+		result = []
+		for match in self._compiled.finditer(self._text):
+			if match.end() > match.start():
+				result.append((match.start(), match.end(),
+					self._expand(match, template, regex)))
+		return result
@@ -0,0 +1,160 @@
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Saving and restoring the editor session.
+
+The session (window geometry, open tabs, and where the cursor was in each
+one) is stored as a single JSON file. Changes only mark the session dirty;
+it is collected at most once per FLUSH_INTERVAL_MSECS, and written to disk
+by a background thread.
+"""
+
+import logging
+import os
+import Queue
+import threading
+
+try:
+	import json
+except ImportError:
+	import simplejson as json
+
+from PyQt4.QtCore import *
+
+from saver import write_atomically
+from util import *
+
+__all__ = ["SessionStore"]
+
+class SessionStore(QObject):
+
+	# Version of the file format
+	VERSION = 1
+
+	FLUSH_INTERVAL_MSECS = 2000
+
+	def __init__(self, filename, collect, settings=None, parent=None):
+		"""'collect' is called on the UI thread to get the current session,
+		as a dict with "geometry", "tabs" and "current" keys. 'settings' is
+		the QSettings object that older versions stored the session in."""
+		QObject.__init__(self, parent)
+		self.filename = filename
+		self._collect = collect
+		self._settings = settings
+		self._dirty = False
+
+		self._queue = Queue.Queue()
+		self._writer = None
+
+		self._timer = QTimer(self)
+		self._timer.setSingleShot(True)
+		safe_connect(self._timer.timeout, self.flush)
+
+	def load(self):
+		"""Read the saved session. Returns a dict like the ones returned by
+		'collect', or None if there is no saved session."""
+		try:
+			f = open(self.filename, "rb")
+			try:
+				state = json.load(f)
+			finally:
+				f.close()
+		except IOError:
+			state = None
+		except ValueError, e:
+			logging.warning("Ignoring corrupt session file %s: %s" % (self.filename, e))
+			state = None
+		if state is not None:
+			if state.get("version") == self.VERSION:
+				return state
+			logging.warning("Ignoring session file with unknown version %s"
+				% state.get("version"))
+			return None
+		return self._loadLegacy()
+
+	def _loadLegacy(self):
+		# Sessions used to be stored in the QSettings
+		settings = self._settings
+		if settings is None or not settings.contains("session/tabs"):
+			return None
+		state = {"tabs": [], "current": None}
+		if settings.contains("session/geometry"):
+			geometry = settings.value("session/geometry").toByteArray()
+			state["geometry"] = str(geometry.toBase64())
+		paths = get_setting(settings, "session/tabs", "")
+		try:
+			views = json.loads(get_setting(settings, "session/tab-states", "[]"))
+		except ValueError:
+			views = []
+		for i, path in enumerate(paths.split(os.pathsep)):
+			if len(path) > 0:
+				tab = {"path": path}
+				if i < len(views) and views[i]:
+					tab.update(views[i])
+				state["tabs"].append(tab)
+		return state
+
+	def markDirty(self):
+		"""Note that the session has changed. It will be saved soon."""
+		self._dirty = True
+		if not self._timer.isActive():
+			self._timer.start(self.FLUSH_INTERVAL_MSECS)
+
+	def _serialize(self):
+		state = self._collect()
+		state["version"] = self.VERSION
+		return json.dumps(state, separators=(",", ":"))
+
+	def flush(self):
+		"""Hand the current session to the writer thread, if it's changed."""
+		self._timer.stop()
+		if not self._dirty:
+			return
+		self._dirty = False
+		if self._writer is None:
+			self._writer = threading.Thread(target=self._run)
+			self._writer.setDaemon(True)
+			self._writer.start()
+		self._queue.put(self._serialize())
+
+	def close(self):
+		"""Stop the writer thread, and save the session one last time."""
+		self._timer.stop()
+		if self._writer:
+			self._queue.put(None)
+			self._writer.join()
+			self._writer = None
+		self._dirty = False
+		self._write(self._serialize())
+
+	def _write(self, data):
+		try:
+			write_atomically(self.filename, [data])
+		except (IOError, OSError), e:
+			logging.error("Error saving session to %s: %s" % (self.filename, e))
+
+	def _run(self):
+		done = False
+		while not done:
+			data = self._queue.get()
+			done = data is None
+			# Only the most recent session needs to be written
+			try:
+				while not done:
+					newer = self._queue.get_nowait()
+					if newer is None:
+						done = True
+					else:
+						data = newer
+			except Queue.Empty:
+				pass
+			if data is not None:
+				self._write(data)
@@ -0,0 +1,540 @@
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""The nesting structure of a document, for bracket matching and folding.
+
+Each block of the document gets a BlockData (as its QTextBlockUserData)
+holding the brackets in the block and its indentation. The highlighter
+creates it as it lexes the block, so that brackets in strings and comments
+are left out; blocks that haven't been highlighted get one from their text
+alone when it's first needed. The data is tied to the block's revision, so
+it's only computed again for blocks that have changed.
+
+Looking up the structure around the cursor only touches the cursor's block
+(which QTextDocument finds in logarithmic time). To match brackets, a
+NestingIndex keeps a summary of each block's brackets -- how much the block
+changes the nesting depth, and the lowest depth it reaches -- in a balanced
+tree ordered by block number, which also holds the totals for each subtree.
+The depth at any block is then a sum along one path of the tree, and the
+block holding the match is found by descending the tree, so matching takes
+logarithmic time however far apart the brackets are. Depth counts all kinds
+of bracket; a match of the wrong kind counts as unmatched.
+
+Folding hides the blocks that are indented further than the block the
+region starts with.
+"""
+
+import random
+import re
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+
+from util import *
+
+__all__ = ["BlockData", "block_data", "bracket_at", "NestingIndex",
+	"fold", "unfold", "BracketMatcher"]
+
+OPENING = u"([{"
+CLOSING = u")]}"
+PARTNERS = dict(zip(OPENING + CLOSING, CLOSING + OPENING))
+
+# Kinds of token whose brackets don't count
+IGNORED_KINDS = set(["comment", "string", "code"])
+
+# Columns per tab, for comparing indentation
+TAB_WIDTH = 4
+
+# Stands in for the lowest depth of a block without brackets
+_NO_DEPTH = 1 << 40
+
+_BRACKET_RE = re.compile(u"[()\\[\\]{}]")
+
+class BlockData(QTextBlockUserData):
+	"""The brackets in a block, as a tuple of (column, character), and its
+	indentation in columns (None for blank lines)."""
+
+	def __init__(self, text, runs, revision):
+		QTextBlockUserData.__init__(self)
+		self.runs = runs # The lexer's runs, or None
+		self.revision = revision
+		self.folded = False # Whether the blocks after it are hidden
+		stripped = text.lstrip(u" \t")
+		if stripped:
+			self.indent = len(text[:len(text) - len(stripped)].expandtabs(TAB_WIDTH))
+		else:
+			self.indent = None
+		brackets = []
+		if _BRACKET_RE.search(text):
+			ignored = [(x[0], x[0] + x[1]) for x in runs or () if x[2] in IGNORED_KINDS]
+			i = 0
+			for match in _BRACKET_RE.finditer(text):
+				column = match.start()
+				while i < len(ignored) and ignored[i][1] <= column:
+					i += 1
+				if i < len(ignored) and ignored[i][0] <= column:
+					continue
+				brackets.append((column, match.group()))
+		self.brackets = tuple(brackets)
+		self.nesting = _nesting(self.brackets)
+
+def _nesting(brackets):
+	"""Return (delta, after, before) for a block's brackets: the change in
+	depth over the block, and the lowest depth just after and just before
+	any of its brackets, relative to the depth at the start of the block."""
+	depth = 0
+	after = before = _NO_DEPTH
+	for column, c in brackets:
+		if depth < before:
+			before = depth
+		depth += 1 if c in OPENING else -1
+		if depth < after:
+			after = depth
+	return depth, after, before
+
+def block_data(block):
+	"""Return the BlockData of 'block', creating it if it's missing or out
+	of date."""
+	data = block.userData()
+	if isinstance(data, BlockData) and data.revision == block.revision():
+		return data
+	new = BlockData(unicode(block.text()), None, block.revision())
+	if isinstance(data, BlockData):
+		new.folded = data.folded
+	block.setUserData(new)
+	return new
+
+def bracket_at(document, position):
+	"""Return (position, character) for the bracket just after 'position',
+	or failing that, just before it. Returns None if there is neither."""
+	block = document.findBlock(position)
+	if not block.isValid():
+		return None
+	column = position - block.position()
+	brackets = dict(block_data(block).brackets)
+	for each in (column, column - 1):
+		if each in brackets:
+			return block.position() + each, brackets[each]
+	return None
+
+class _Node(object):
+	"""A block in a NestingIndex, and the root of a subtree of blocks."""
+
+	__slots__ = ["delta", "after", "before", "priority", "left", "right",
+		"size", "total", "minAfter", "minBefore"]
+
+	def __init__(self, nesting):
+		self.delta, self.after, self.before = nesting
+		self.priority = random.random()
+		self.left = self.right = None
+		self.size = 1
+		self.total = self.delta
+		self.minAfter = self.after
+		self.minBefore = self.before
+
+def _update(node):
+	# Recompute the totals of the subtree at 'node' from its children
+	size = 1
+	depth = 0
+	minAfter = minBefore = _NO_DEPTH
+	left = node.left
+	if left is not None:
+		size += left.size
+		depth = left.total
+		minAfter = left.minAfter
+		minBefore = left.minBefore
+	minAfter = min(minAfter, depth + node.after)
+	minBefore = min(minBefore, depth + node.before)
+	depth += node.delta
+	right = node.right
+	if right is not None:
+		size += right.size
+		minAfter = min(minAfter, depth + right.minAfter)
+		minBefore = min(minBefore, depth + right.minBefore)
+		depth += right.total
+	node.size = size
+	node.total = depth
+	node.minAfter = minAfter
+	node.minBefore = minBefore
+
+def _split(node, count):
+	# Split a subtree into its first 'count' blocks and the rest
+	if node is None:
+		return None, None
+	leftSize = node.left.size if node.left is not None else 0
+	if count <= leftSize:
+		first, rest = _split(node.left, count)
+		node.left = rest
+		_update(node)
+		return first, node
+	first, rest = _split(node.right, count - leftSize - 1)
+	node.right = first
+	_update(node)
+	return node, rest
+
+def _merge(first, rest):
+	if first is None:
+		return rest
+	if rest is None:
+		return first
+	if first.priority > rest.priority:
+		first.right = _merge(first.right, rest)
+		_update(first)
+		return first
+	rest.left = _merge(first, rest.left)
+	_update(rest)
+	return rest
+
+def _build(nodes):
+	# Build a tree from a list of nodes in linear time, by keeping the path
+	# down the right-hand side of the tree on a stack
+	stack = []
+	for node in nodes:
+		last = None
+		while stack and stack[-1].priority < node.priority:
+			last = stack.pop()
+			_update(last)
+		node.left = last
+		if stack:
+			stack[-1].right = node
+		stack.append(node)
+	root = stack[0] if stack else None
+	while stack:
+		_update(stack.pop())
+	return root
+
+def _first_after(node, start, depth, target):
+	"""Return the index of the first block at or after 'start' in the
+	subtree at 'node' (which starts at 'depth') where the depth after one of
+	its brackets is 'target' or less, or None."""
+	if node is None or depth + node.minAfter > target:
+		return None
+	leftSize = 0
+	leftTotal = 0
+	if node.left is not None:
+		leftSize = node.left.size
+		leftTotal = node.left.total
+		if start < leftSize:
+			found = _first_after(node.left, start, depth, target)
+			if found is not None:
+				return found
+	if start <= leftSize and depth + leftTotal + node.after <= target:
+		return leftSize
+	found = _first_after(node.right, max(0, start - leftSize - 1),
+		depth + leftTotal + node.delta, target)
+	return None if found is None else leftSize + 1 + found
+
+def _last_before(node, end, depth, target):
+	"""Return the index of the last block before 'end' in the subtree at
+	'node' (which starts at 'depth') where the depth before one of its
+	brackets is 'target' or less, or None."""
+	if node is None or end <= 0 or depth + node.minBefore > target:
+		return None
+	leftSize = 0
+	leftTotal = 0
+	if node.left is not None:
+		leftSize = node.left.size
+		leftTotal = node.left.total
+	if end > leftSize + 1:
+		found = _last_before(node.right, end - leftSize - 1,
+			depth + leftTotal + node.delta, target)
+		if found is not None:
+			return leftSize + 1 + found
+	if end > leftSize and depth + leftTotal + node.before <= target:
+		return leftSize
+	return _last_before(node.left, min(end, leftSize), depth, target)
+
+class NestingIndex(QObject):
+	"""The nesting depth of the brackets in a QTextDocument, kept up to date
+	as it changes, for matching brackets. It is built the first time it's
+	needed."""
+
+	def __init__(self, document, parent=None):
+		QObject.__init__(self, parent)
+		self._document = document
+		self._root = None
+		self._built = False
+		safe_connect(document.contentsChange, self._contentsChange)
+
+	def _rebuild(self):
+		nodes = []
+		block = self._document.begin()
+		while block.isValid():
+			nodes.append(_Node(block_data(block).nesting))
+			block = block.next()
+		self._root = _build(nodes)
+		self._built = True
+
+	def _replace(self, start, end, nodes):
+		# Replace the blocks from 'start' up to (not including) 'end'
+		first, rest = _split(self._root, start)
+		middle, rest = _split(rest, end - start)
+		self._root = _merge(_merge(first, _build(nodes)), rest)
+
+	def _node(self, number):
+		node = self._root
+		while node is not None:
+			leftSize = node.left.size if node.left is not None else 0
+			if number == leftSize:
+				return node
+			if number < leftSize:
+				node = node.left
+			else:
+				number -= leftSize + 1
+				node = node.right
+		return None
+
+	def _depth(self, number):
+		# The depth at the start of block 'number'
+		depth = 0
+		node = self._root
+		while node is not None:
+			leftSize = node.left.size if node.left is not None else 0
+			if number <= leftSize:
+				node = node.left
+			else:
+				if node.left is not None:
+					depth += node.left.total
+				depth += node.delta
+				number -= leftSize + 1
+				node = node.right
+		return depth
+
+	def blockChanged(self, block):
+		"""Called when the brackets of 'block' change without its text
+		changing, e.g. when it's highlighted."""
+		if not self._built or self._root.size != self._document.blockCount():
+			return # The index will catch up from contentsChange
+		number = block.blockNumber()
+		nesting = block_data(block).nesting
+		node = self._node(number)
+		if node is not None and (node.delta, node.after, node.before) != nesting:
+			self._replace(number, number + 1, [_Node(nesting)])
+
+	def _contentsChange(self, position, removed, added):
+		if not self._built:
+			return
+		doc = self._document
+		end = min(position + added, doc.characterCount() - 1)
+		first = doc.findBlock(position)
+		last = doc.findBlock(end)
+		start = first.blockNumber()
+		# The changed blocks replaced the blocks from 'first' to 'oldLast'
+		oldLast = last.blockNumber() - (doc.blockCount() - self._root.size)
+		if (not first.isValid() or not last.isValid()
+				or oldLast < start - 1 or oldLast >= self._root.size):
+			self._rebuild()
+			return
+		nesting = []
+		block = first
+		while True:
+			nesting.append(block_data(block).nesting)
+			if block == last:
+				break
+			block = block.next()
+		if oldLast == last.blockNumber() and len(nesting) == 1:
+			node = self._node(start)
+			if (node.delta, node.after, node.before) == nesting[0]:
+				return # E.g. only the formatting changed
+		self._replace(start, oldLast + 1, [_Node(x) for x in nesting])
+
+	def match(self, position, char):
+		"""Return the position of the bracket matching the 'char' at
+		'position', or None if it isn't matched."""
+		if not self._built:
+			self._rebuild()
+		doc = self._document
+		block = doc.findBlock(position)
+		column = position - block.position()
+		number = block.blockNumber()
+		brackets = block_data(block).brackets
+		depth = self._depth(number)
+		before = [] # The depth before each of the block's brackets
+		for each, c in brackets:
+			before.append(depth)
+			depth += 1 if c in OPENING else -1
+		i = [x[0] for x in brackets].index(column)
+		if char in OPENING:
+			# The match is the first bracket after it that brings the depth
+			# back to where it was before it
+			target = before[i]
+			found = self._scanForward(block, brackets[i + 1:], before[i] + 1, target)
+			if found is None:
+				number = _first_after(self._root, number + 1, 0, target)
+				if number is None:
+					return None
+				block = doc.findBlockByNumber(number)
+				found = self._scanForward(block, block_data(block).brackets,
+					self._depth(number), target)
+		else:
+			# The match is the last bracket before it where the depth was
+			# one less than before it
+			target = before[i] - 1
+			found = self._scanBackward(block, brackets[:i], before[:i], target)
+			if found is None:
+				number = _last_before(self._root, number, 0, target)
+				if number is None:
+					return None
+				block = doc.findBlockByNumber(number)
+				brackets = block_data(block).brackets
+				depth = self._depth(number)
+				before = []
+				for each, c in brackets:
+					before.append(depth)
+					depth += 1 if c in OPENING else -1
+				found = self._scanBackward(block, brackets, before, target)
+		if found is None or found[1] != PARTNERS[char]:
+			return None
+		return found[0]
+
+	def _scanForward(self, block, brackets, depth, target):
+		for column, c in brackets:
+			depth += 1 if c in OPENING else -1
+			if depth <= target:
+				return block.position() + column, c
+		return None
+
+	def _scanBackward(self, block, brackets, before, target):
+		for i in xrange(len(brackets) - 1, -1, -1):
+			if before[i] <= target:
+				return block.position() + brackets[i][0], brackets[i][1]
+		return None
+
+def _region(block):
+	"""Return the last block of the region that starts with 'block', i.e.
+	the blocks after it that are blank or indented further, or None if
+	there are none."""
+	indent = block_data(block).indent
+	if indent is None:
+		return None
+	last = None
+	next = block.next()
+	while next.isValid():
+		nextIndent = block_data(next).indent
+		if nextIndent is not None:
+			if nextIndent <= indent:
+				break
+			last = next
+		next = next.next()
+	return last
+
+def _enclosing(block):
+	"""Return the block that starts the innermost region containing
+	'block', or None."""
+	indent = block_data(block).indent
+	if indent == 0:
+		return None
+	previous = block.previous()
+	while previous.isValid():
+		data = block_data(previous)
+		if data.indent is not None and (indent is None or data.indent < indent):
+			return previous
+		previous = previous.previous()
+	return None
+
+def _setVisible(first, last, visible):
+	block = first
+	while block.isValid():
+		block.setVisible(visible)
+		if visible:
+			block_data(block).folded = False
+		if block == last:
+			break
+		block = block.next()
+	document = first.document()
+	start = first.position()
+	document.markContentsDirty(start, last.position() + last.length() - start)
+
+def fold(textEdit):
+	"""Hide the region around the cursor. Returns False if there's nothing
+	to fold."""
+	cursor = textEdit.textCursor()
+	header = cursor.block()
+	if _region(header) is None:
+		header = _enclosing(header)
+	if header is None or block_data(header).folded:
+		return False
+	last = _region(header)
+	_setVisible(header.next(), last, False)
+	block_data(header).folded = True
+	# Keep the cursor out of the hidden blocks
+	if cursor.position() > header.position() + header.length() - 1:
+		cursor.setPosition(header.position() + header.length() - 1)
+		textEdit.setTextCursor(cursor)
+	textEdit.viewport().update()
+	return True
+
+def _hidden(header):
+	"""Return the last of the hidden blocks right after 'header', or None if
+	the next block isn't hidden."""
+	last = None
+	block = header.next()
+	while block.isValid() and not block.isVisible():
+		last = block
+		block = block.next()
+	return last
+
+def unfold(textEdit):
+	"""Show the folded region that starts at the cursor's block, or failing
+	that, the innermost one that contains it. Returns False if there isn't
+	one."""
+	block = textEdit.textCursor().block()
+	header = block if block_data(block).folded else _enclosing(block)
+	while header is not None and not block_data(header).folded:
+		header = _enclosing(header)
+	if header is None:
+		return False
+	block_data(header).folded = False
+	# The region may have changed since it was folded, so show the blocks
+	# that are hidden now, rather than those the region covers
+	last = _hidden(header)
+	if last is not None:
+		_setVisible(header.next(), last, True)
+	textEdit.viewport().update()
+	return True
+
+class BracketMatcher(QObject):
+	"""Highlights the bracket next to the cursor in a KTextEdit, and its
+	match (or just the bracket, in red, if it's unmatched)."""
+
+	def __init__(self, textEdit):
+		QObject.__init__(self, textEdit)
+		self.textEdit = textEdit
+		self._matchFormat = QTextCharFormat()
+		self._matchFormat.setBackground(QColor("#3a5f7a"))
+		self._unmatchedFormat = QTextCharFormat()
+		self._unmatchedFormat.setBackground(QColor("#8b2a2a"))
+		self.index = NestingIndex(textEdit.document(), self)
+		safe_connect(textEdit.cursorPositionChanged, self.update)
+
+	def _selection(self, position, format):
+		selection = QTextEdit.ExtraSelection()
+		selection.cursor = QTextCursor(self.textEdit.document())
+		selection.cursor.setPosition(position)
+		selection.cursor.setPosition(position + 1, QTextCursor.KeepAnchor)
+		selection.format = format
+		return selection
+
+	def update(self):
+		selections = []
+		cursor = self.textEdit.textCursor()
+		if not cursor.hasSelection():
+			doc = self.textEdit.document()
+			found = bracket_at(doc, cursor.position())
+			if found:
+				position, char = found
+				match = self.index.match(position, char)
+				if match is None:
+					selections.append(self._selection(position, self._unmatchedFormat))
+				else:
+					selections.append(self._selection(position, self._matchFormat))
+					selections.append(self._selection(match, self._matchFormat))
+		self.textEdit.setExtraSelectionGroup("brackets", selections)
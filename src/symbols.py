@@ -0,0 +1,269 @@
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""An index of the classes, functions and assignments in Python documents.
+
+Documents are parsed with the ast module on a worker thread. Each document
+is split into top-level statements, and the symbols found in each one are
+cached by its text, so after an edit only the statements that changed are
+parsed again.
+"""
+
+import ast
+import logging
+import Queue
+import threading
+import time
+
+from PyQt4.QtCore import *
+
+from util import *
+
+__all__ = ["SymbolIndex", "split_statements", "statement_symbols"]
+
+def _triple_quotes(line, inside):
+	"""Return the triple quote that 'line' ends inside of, given the one it
+	starts inside of (or None). Good enough for splitting statements; the
+	parser has the final say."""
+	pos = 0
+	while True:
+		if inside:
+			pos = line.find(inside, pos)
+			if pos < 0:
+				return inside
+			pos += 3
+			inside = None
+		else:
+			single = line.find("'''", pos)
+			double = line.find('"""', pos)
+			comment = line.find("#", pos)
+			starts = [x for x in (single, double) if x >= 0]
+			if not starts:
+				return None
+			pos = min(starts)
+			if 0 <= comment < pos:
+				return None
+			inside = line[pos:pos + 3]
+			pos += 3
+
+def split_statements(text):
+	"""Split Python source into its top-level statements. Returns a list of
+	(first line, source) pairs, where lines are 0-based."""
+	statements = []
+	lines = text.split("\n")
+	start = 0
+	decorated = False
+	inside = None
+	for i, line in enumerate(lines):
+		continues = (inside is not None or not line or line[0] in " \t#)]}"
+			or decorated or line.startswith(("else", "elif", "except", "finally")))
+		if not continues and i > start:
+			statements.append((start, "\n".join(lines[start:i])))
+			start = i
+		if line and line[0] not in " \t#":
+			decorated = line.startswith("@")
+		inside = _triple_quotes(line, inside)
+	if start < len(lines):
+		statements.append((start, "\n".join(lines[start:])))
+	return statements
+
+def _walk(nodes, prefix, symbols, inFunction=False):
+	for node in nodes:
+		if isinstance(node, ast.ClassDef):
+			name = prefix + node.name
+			symbols.append((name, "class", node.lineno - 1))
+			_walk(node.body, name + ".", symbols)
+		elif isinstance(node, ast.FunctionDef):
+			name = prefix + node.name
+			kind = "method" if prefix and not inFunction else "function"
+			symbols.append((name, kind, node.lineno - 1))
+			# Only nested definitions are interesting inside a function
+			_walk(node.body, name + ".", symbols, True)
+		elif isinstance(node, ast.Assign) and not inFunction:
+			for target in node.targets:
+				if isinstance(target, ast.Name):
+					symbols.append((prefix + target.id, "variable", node.lineno - 1))
+		elif isinstance(node, (ast.If, ast.TryExcept, ast.TryFinally, ast.With)):
+			# E.g. definitions that depend on the platform
+			for each in ("body", "orelse", "handlers", "finalbody"):
+				children = getattr(node, each, None) or []
+				for child in children:
+					if isinstance(child, ast.ExceptHandler):
+						_walk(child.body, prefix, symbols, inFunction)
+					else:
+						_walk([child], prefix, symbols, inFunction)
+
+def statement_symbols(source):
+	"""Return the symbols defined in a top-level statement, as a list of
+	(name, kind, line) where 'line' is 0-based and relative to the
+	statement, and 'kind' is "class", "function", "method" or "variable".
+	Raises SyntaxError if the statement can't be parsed."""
+	symbols = []
+	_walk(ast.parse(source.encode("utf-8") if isinstance(source, unicode)
+		else source).body, "", symbols)
+	return symbols
+
+class SymbolIndex(QObject):
+	"""The symbols of all the open Python documents. Documents are added
+	(and updated) with update(), which parses them on a worker thread."""
+
+	# Emitted when the symbols of a document have changed
+	updated = pyqtSignal()
+
+	# Upper bound on the number of statements whose symbols are cached
+	CACHE_SIZE = 50000
+
+	DRAIN_INTERVAL_MSECS = 50
+
+	def __init__(self, parent=None):
+		QObject.__init__(self, parent)
+		self._documents = {} # Maps each key to (location, symbols)
+		self._entries = None # Flattened for searching, built when needed
+		self._cache = {} # Statement source to symbols; worker thread only
+
+		# The latest text of each document waiting to be parsed
+		self._pending = {}
+		self._busy = False # Whether the worker is parsing a document
+		self._condition = threading.Condition()
+
+		# Each update gets a generation number, and only the result for a
+		# document's latest one is kept. Removed documents have none.
+		self._generation = 0
+		self._current = {}
+		self._results = Queue.Queue()
+		self._worker = None
+		self._timer = QTimer(self)
+		safe_connect(self._timer.timeout, self._drain)
+
+	def update(self, key, location, text):
+		"""Parse (again) the document identified by 'key', whose text is
+		'text'. 'location' is passed back with each symbol from search()."""
+		if self._worker is None:
+			self._worker = threading.Thread(target=self._run)
+			self._worker.setDaemon(True)
+			self._worker.start()
+		self._generation += 1
+		self._current[key] = self._generation
+		self._condition.acquire()
+		try:
+			self._pending[key] = (self._generation, location, unicode(text))
+			self._condition.notify()
+		finally:
+			self._condition.release()
+		if not self._timer.isActive():
+			self._timer.start(self.DRAIN_INTERVAL_MSECS)
+
+	def remove(self, key):
+		"""Forget the document identified by 'key'."""
+		# A parse of it that is already running is dropped when it's done
+		self._current.pop(key, None)
+		self._condition.acquire()
+		try:
+			self._pending.pop(key, None)
+		finally:
+			self._condition.release()
+		if self._documents.pop(key, None):
+			self._entries = None
+			self.updated.emit()
+
+	def _run(self):
+		while True:
+			self._condition.acquire()
+			try:
+				while not self._pending:
+					self._condition.wait()
+				key, (generation, location, text) = self._pending.popitem()
+				self._busy = True
+			finally:
+				self._condition.release()
+			start = time.time()
+			symbols = self._parse(text)
+			logging.debug("Indexed %d symbols in %.1f ms" % (len(symbols),
+				(time.time() - start) * 1000))
+			self._results.put((key, generation, location, symbols))
+			# Only after the result is queued, so that _drain doesn't stop
+			# in between
+			self._condition.acquire()
+			try:
+				self._busy = False
+			finally:
+				self._condition.release()
+
+	def _parse(self, text):
+		symbols = []
+		statements = split_statements(text)
+		if len(self._cache) + len(statements) > self.CACHE_SIZE:
+			self._cache.clear()
+		for i, (line, source) in enumerate(statements):
+			found = self._cache.get(source)
+			if found is None:
+				try:
+					found = statement_symbols(source)
+				except (SyntaxError, ValueError, TypeError):
+					# Probably being edited; leave it out until it parses
+					found = []
+				self._cache[source] = found
+			for name, kind, offset in found:
+				symbols.append((name, kind, line + offset))
+		return symbols
+
+	def _drain(self):
+		changed = False
+		while True:
+			try:
+				key, generation, location, symbols = self._results.get_nowait()
+			except Queue.Empty:
+				break
+			# Drop the results of documents that have since been updated
+			# again, or removed
+			if self._current.get(key) == generation:
+				self._documents[key] = (location, symbols)
+				changed = True
+		if changed:
+			self._entries = None
+			self.updated.emit()
+		self._condition.acquire()
+		try:
+			idle = not self._pending and not self._busy
+		finally:
+			self._condition.release()
+		# Keep checking while the worker is still parsing
+		if idle and self._results.empty():
+			self._timer.stop()
+
+	def symbols(self, key):
+		"""Return the symbols of one document, as a list of (name, kind,
+		line), where 'line' is 0-based."""
+		return self._documents.get(key, (None, []))[1]
+
+	def search(self, query, limit=200):
+		"""Return up to 'limit' symbols whose names contain 'query' (ignoring
+		case), as (name, kind, line, location), best matches first: exact
+		matches, then prefixes of the last part of the name, then the rest."""
+		if self._entries is None:
+			self._entries = []
+			for key, (location, symbols) in self._documents.iteritems():
+				for name, kind, line in symbols:
+					short = name.rsplit(".", 1)[-1].lower()
+					self._entries.append((short, name.lower(), name, kind, line, location))
+		query = query.lower()
+		matches = []
+		for short, lower, name, kind, line, location in self._entries:
+			if query in lower:
+				if short == query:
+					rank = 0
+				elif short.startswith(query):
+					rank = 1
+				else:
+					rank = 2
+				matches.append((rank, len(name), name, kind, line, location))
+		matches.sort()
+		return [x[2:] for x in matches[:limit]]
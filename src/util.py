@@ -0,0 +1,70 @@
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it 
+# under the terms of the GNU General Public License version 2 as published 
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT 
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for 
+# more details.
+
+"""Helpers shared by all of Kurt's modules for talking to PyQt."""
+
+import logging
+import os
+import sys
+import traceback
+
+import profiling
+
+__all__ = ["abs_path", "pyqt_guarded", "pyqt_override", "safe_connect",
+	"signal_connect", "get_setting"]
+
+def abs_path(relpath):
+	"""Given a path relative to this script, return the absolute path."""
+	return os.path.join(os.path.dirname(__file__), relpath)
+
+def pyqt_guarded(f):
+	"""A decorator to prevent unhandled exceptions to be thrown outside of
+	Python code. Should be used for any methods that are called directly
+	from PyQt."""
+	def wrapper(*args):
+		try:
+			return f(*args)
+		except Exception, e:
+			sys.stderr.write("Unhandled exception in wrapper around %s\n" % f)
+			traceback.print_exc()
+	if profiling.enabled:
+		return profiling.timed(wrapper, profiling.callback_name(f))
+	return wrapper
+
+# A decorator to be used for Python methods which override a Qt method.
+pyqt_override = pyqt_guarded
+
+def safe_connect(signal, slot):
+	"""Connects a PyQt signal to a slot (a Python callable), while ensuring
+	that no unhandled exceptions are raised in the slot.
+	"""
+	signal.connect(pyqt_guarded(slot))
+	
+def signal_connect(signal1, signal2):
+	"""Connects two PyQt signals together. Not necessary, but here to provide
+	symmetry with safe_connect().
+	"""
+	signal1.connect(signal2)
+
+def get_setting(settings, key, default):
+	"""Look up 'key' in a QSettings object, returning 'default' if it is
+	not set. The result is converted to the type of 'default'.
+	"""
+	if settings is None or not settings.contains(key):
+		return default
+	value = str(settings.value(key).toString())
+	if isinstance(default, bool):
+		return value.lower() in ("true", "1", "yes")
+	try:
+		return type(default)(value)
+	except ValueError:
+		logging.warning("Ignoring bad value '%s' for setting %s" % (value, key))
+		return default
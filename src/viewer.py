@@ -0,0 +1,380 @@
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""A read-only viewer for files that are too big to load into a document.
+
+The file is memory-mapped, and only the lines that are on screen are ever
+decoded. A sparse index of line offsets is built in the background, so
+opening a file takes the same time no matter how big it is. Searches run
+in the background too, a chunk at a time, so that a new search (e.g. as
+the search text is typed) can cancel the one before it.
+"""
+
+import bisect
+import mmap
+import thread
+import threading
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+
+from loader import detect_encoding
+from util import *
+
+__all__ = ["LineIndex", "LargeFileViewer"]
+
+class LineIndex(object):
+	"""Maps line numbers to byte offsets and back. Rather than recording
+	where every line starts, it records the number of line breaks before
+	every BLOCK_SIZE bytes, and scans the mapped data for the rest.
+
+	The index can be used while it is being built; lookups past the indexed
+	part of the file just have to scan further.
+	"""
+
+	BLOCK_SIZE = 64 * 1024
+
+	def __init__(self, data):
+		self._data = data
+		self._size = len(data)
+		# _lines[i] is the number of line breaks before offset i * BLOCK_SIZE
+		self._lines = [0]
+		self._total = None # Total number of line breaks, once known
+		self._cancelled = False
+
+	def isComplete(self):
+		return self._total is not None
+
+	def progress(self):
+		"""Return the percentage of the file that has been indexed."""
+		if self.isComplete():
+			return 100
+		return min(99, len(self._lines) * self.BLOCK_SIZE * 100 / max(1, self._size))
+
+	def build(self):
+		"""Index the whole file. Meant to be run on a worker thread."""
+		data = self._data
+		block = self.BLOCK_SIZE
+		count = 0
+		pos = 0
+		while pos + block <= self._size:
+			if self._cancelled:
+				return
+			count += data[pos:pos + block].count("\n")
+			pos += block
+			self._lines.append(count)
+		self._total = count + data[pos:self._size].count("\n")
+
+	def cancel(self):
+		self._cancelled = True
+
+	def lineCount(self):
+		"""Return the number of lines in the file. While the index is being
+		built, this is an estimate."""
+		if self.isComplete():
+			return self._total + 1
+		indexed = (len(self._lines) - 1) * self.BLOCK_SIZE
+		if indexed == 0:
+			return 1
+		return int(self._lines[-1] * float(self._size) / indexed) + 1
+
+	def _countBreaks(self, start, end):
+		count = 0
+		block = self.BLOCK_SIZE
+		while start < end:
+			stop = min(end, start + block)
+			count += self._data[start:stop].count("\n")
+			start = stop
+		return count
+
+	def lineOfOffset(self, offset):
+		"""Return the (0-based) number of the line containing the given
+		byte offset."""
+		offset = max(0, min(offset, self._size))
+		i = min(offset / self.BLOCK_SIZE, len(self._lines) - 1)
+		start = i * self.BLOCK_SIZE
+		return self._lines[i] + self._countBreaks(start, offset)
+
+	def offsetOfLine(self, line):
+		"""Return the byte offset at which the given (0-based) line starts,
+		or None if the file doesn't have that many lines."""
+		if line <= 0:
+			return 0
+		# Find the last indexed block that starts before the line does
+		i = bisect.bisect_left(self._lines, line) - 1
+		pos = i * self.BLOCK_SIZE
+		need = line - self._lines[i]
+
+		# Skip whole blocks until the line break we're after is in this one
+		data = self._data
+		while True:
+			stop = min(self._size, pos + self.BLOCK_SIZE)
+			count = data[pos:stop].count("\n")
+			if count >= need:
+				break
+			if stop >= self._size:
+				return None
+			need -= count
+			pos = stop
+		while need > 0:
+			pos = data.find("\n", pos) + 1
+			need -= 1
+		return pos
+
+class LargeFileViewer(QAbstractScrollArea):
+	"""Displays a memory-mapped file, painting only the visible lines."""
+
+	# Emitted when a search started by find() is over, with whether it found
+	# a match
+	searchFinished = pyqtSignal(bool)
+
+	# Emitted by the search thread with the search's number and the offset
+	# of the match (or -1)
+	_searchDone = pyqtSignal(int, object)
+
+	# Lines longer than this are cut off for display
+	MAX_LINE_BYTES = 4096
+
+	# Bytes searched at a time. The interpreter lock is held while searching
+	# a chunk, and searches are only cancelled between chunks.
+	SEARCH_CHUNK = 4 * 1024 * 1024
+
+	TAB_WIDTH = 4
+
+	def __init__(self, path, parent=None):
+		QAbstractScrollArea.__init__(self, parent)
+		self.path = path
+		f = open(path, "rb")
+		try:
+			self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		finally:
+			f.close()
+
+		# Only ASCII-compatible encodings can be searched for line breaks
+		# byte by byte, so this doesn't try to handle UTF-16.
+		if detect_encoding(self.data[:4096]) == "latin-1":
+			self.encoding = "latin-1"
+		else:
+			self.encoding = "utf-8"
+
+		self.index = LineIndex(self.data)
+
+		# Byte offset and length of the current search match, if any
+		self.match = None
+
+		# The number of the latest search; older ones stop when they see it
+		# has changed
+		self._search = 0
+		self._needleLength = 0
+		safe_connect(self._searchDone, self._searchFinished)
+
+		# The number of worker threads using the mapped data, which is only
+		# unmapped once they have all stopped
+		self._lock = threading.Lock()
+		self._workers = 0
+		self._closed = False
+
+		self.setFocusPolicy(Qt.StrongFocus)
+		self.setFrameShape(QFrame.NoFrame)
+		self.updateScrollBars()
+
+	def startIndexing(self):
+		self._startWorker(self.index.build)
+
+	def close(self):
+		"""Close the viewer, stop indexing and searching, and unmap the file
+		as soon as the worker threads have stopped. The viewer can't be used
+		after this."""
+		self.index.cancel()
+		self.cancelSearch()
+		self._lock.acquire()
+		try:
+			self._closed = True
+			idle = self._workers == 0
+		finally:
+			self._lock.release()
+		if idle:
+			self.data.close()
+		return QAbstractScrollArea.close(self)
+
+	def _startWorker(self, f, *args):
+		self._lock.acquire()
+		try:
+			self._workers += 1
+		finally:
+			self._lock.release()
+		thread.start_new_thread(self._runWorker, (f,) + args)
+
+	def _runWorker(self, f, *args):
+		try:
+			f(*args)
+		finally:
+			self._lock.acquire()
+			try:
+				self._workers -= 1
+				last = self._closed and self._workers == 0
+			finally:
+				self._lock.release()
+			if last:
+				self.data.close()
+
+	def lineHeight(self):
+		return self.fontMetrics().lineSpacing()
+
+	def visibleLineCount(self):
+		return max(1, self.viewport().height() / self.lineHeight())
+
+	def topLine(self):
+		return self.verticalScrollBar().value()
+
+	def updateScrollBars(self):
+		page = self.visibleLineCount()
+		vbar = self.verticalScrollBar()
+		vbar.setRange(0, max(0, self.index.lineCount() - page))
+		vbar.setPageStep(page)
+		vbar.setSingleStep(1)
+
+		width = self.fontMetrics().width("0") * self.MAX_LINE_BYTES
+		hbar = self.horizontalScrollBar()
+		hbar.setRange(0, max(0, width - self.viewport().width()))
+		hbar.setPageStep(self.viewport().width())
+		hbar.setSingleStep(self.fontMetrics().width("0") * 4)
+
+	def _decode(self, data):
+		text = data.decode(self.encoding, "replace").rstrip(u"\r")
+		return text.expandtabs(self.TAB_WIDTH)
+
+	def lines(self, first, count):
+		"""Generate (line_number, offset, bytes) for 'count' lines, starting
+		at line 'first'."""
+		data = self.data
+		size = len(data)
+		offset = self.index.offsetOfLine(first)
+		if offset is None:
+			return
+		for line in xrange(first, first + count):
+			if offset > size:
+				return
+			end = data.find("\n", offset)
+			if end < 0:
+				end = size
+			yield line, offset, data[offset:min(end, offset + self.MAX_LINE_BYTES)]
+			offset = end + 1
+
+	def scrollToLine(self, line):
+		"""Scroll so that the given line is about a third of the way down."""
+		self.verticalScrollBar().setValue(line - self.visibleLineCount() / 3)
+
+	def find(self, text, forwards=True, includeMatch=True):
+		"""Start searching the file for 'text' in the background, from the
+		current match (or the top of the view). When it's done, a match is
+		scrolled to, and searchFinished is emitted. Any search that is still
+		running is cancelled."""
+		needle = unicode(text).encode(self.encoding, "replace")
+		if self.match:
+			offset, length = self.match
+		else:
+			offset, length = self.index.offsetOfLine(self.topLine()) or 0, 0
+		if forwards:
+			start = offset if includeMatch else offset + length
+		else:
+			start = offset + len(needle) - 1
+		self._search += 1
+		self._needleLength = len(needle)
+		self._startWorker(self._runSearch, self._search, needle, start, forwards)
+
+	def cancelSearch(self):
+		self._search += 1
+
+	def _runSearch(self, search, needle, start, forwards):
+		# Runs on a worker thread. Searches for 'needle' after 'start', or
+		# before it if not 'forwards', in overlapping chunks.
+		data = self.data
+		size = len(data)
+		chunk = self.SEARCH_CHUNK
+		overlap = len(needle) - 1
+		found = -1
+		if forwards:
+			while start < size and search == self._search:
+				found = data.find(needle, start, min(size, start + chunk + overlap))
+				if found >= 0:
+					break
+				start += chunk
+		else:
+			end = min(size, start)
+			while end > 0 and search == self._search:
+				found = data.rfind(needle, max(0, end - chunk - overlap), end)
+				if found >= 0:
+					break
+				end -= chunk
+		if search == self._search:
+			self._searchDone.emit(search, found)
+
+	def _searchFinished(self, search, found):
+		if search != self._search:
+			return # Superseded by another search
+		if found >= 0:
+			self.match = (found, self._needleLength)
+			line = self.index.lineOfOffset(found)
+			if not self.topLine() <= line < self.topLine() + self.visibleLineCount():
+				self.scrollToLine(line)
+			self.viewport().update()
+		self.searchFinished.emit(found >= 0)
+
+	def clearMatch(self):
+		self.match = None
+		self.viewport().update()
+
+	@pyqt_override
+	def resizeEvent(self, event):
+		self.updateScrollBars()
+		QAbstractScrollArea.resizeEvent(self, event)
+
+	@pyqt_override
+	def scrollContentsBy(self, dx, dy):
+		self.viewport().update()
+
+	@pyqt_override
+	def keyPressEvent(self, event):
+		vbar = self.verticalScrollBar()
+		actions = {
+			Qt.Key_Up: QAbstractSlider.SliderSingleStepSub,
+			Qt.Key_Down: QAbstractSlider.SliderSingleStepAdd,
+			Qt.Key_PageUp: QAbstractSlider.SliderPageStepSub,
+			Qt.Key_PageDown: QAbstractSlider.SliderPageStepAdd,
+			Qt.Key_Home: QAbstractSlider.SliderToMinimum,
+			Qt.Key_End: QAbstractSlider.SliderToMaximum
+		}
+		action = actions.get(event.key())
+		if action is None:
+			QAbstractScrollArea.keyPressEvent(self, event)
+		else:
+			vbar.triggerAction(action)
+
+	@pyqt_override
+	def paintEvent(self, event):
+		p = QPainter(self.viewport())
+		p.fillRect(event.rect(), QColor("#303030"))
+		metrics = self.fontMetrics()
+		height = self.lineHeight()
+		x = 4 - self.horizontalScrollBar().value()
+		y = 0
+		for line, offset, data in self.lines(self.topLine(), self.visibleLineCount() + 1):
+			if self.match and offset <= self.match[0] <= offset + len(data):
+				# Highlight the match, measuring the text before it
+				start = self.match[0] - offset
+				before = self._decode(data[:start])
+				matched = self._decode(data[start:start + self.match[1]])
+				p.fillRect(x + metrics.width(before), y,
+					metrics.width(matched), height, QColor("#606060"))
+			p.setPen(QColor("#eeeeee"))
+			p.drawText(x, y + metrics.ascent(), self._decode(data))
+			y += height
@@ -0,0 +1,363 @@
+# Copyright (c) 2010 Patrick Dubroy <pdubroy@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+"""Noticing when open files change on disk, and reloading them.
+
+A FileWatcher watches the directories containing the open files (with
+inotify on Linux, or by polling elsewhere), and reports the files that
+changed in batches. A Reloader reads changed files on a worker thread and
+works out the edits that turn the document into the new contents, so that
+the UI thread only has to apply them.
+"""
+
+import ctypes
+import ctypes.util
+import difflib
+import errno
+import logging
+import os
+import Queue
+import select
+import struct
+import thread
+import threading
+import time
+
+from PyQt4.QtCore import *
+
+import loader
+from util import *
+
+__all__ = ["FileWatcher", "Reloader", "diff_edits"]
+
+def _common_prefix(a, b):
+	"""Return the length of the common prefix of two strings."""
+	n = min(len(a), len(b))
+	i = 0
+	step = 4096
+	# Compare a block at a time; slices compare in C
+	while i + step <= n and a[i:i + step] == b[i:i + step]:
+		i += step
+	while i < n and a[i] == b[i]:
+		i += 1
+	return i
+
+def _common_suffix(a, b, limit):
+	"""Return the length of the common suffix of two strings, up to 'limit'."""
+	i = 0
+	step = 4096
+	while i + step <= limit and a[len(a) - i - step:len(a) - i] == b[len(b) - i - step:len(b) - i]:
+		i += step
+	while i < limit and a[len(a) - i - 1] == b[len(b) - i - 1]:
+		i += 1
+	return i
+
+# Beyond this (number of old lines times new lines), don't diff the changed
+# part of the text line by line; just replace it
+MAX_DIFF_WORK = 10 ** 8
+
+def diff_edits(old, new):
+	"""Return a list of (position, removed, text) edits which turn the
+	string 'old' into 'new'. They are in order of decreasing position, so
+	each one can be applied to the result of the one before."""
+	if old == new:
+		return []
+
+	# Usually only a small part in the middle has changed. Find it, and
+	# widen it to whole lines.
+	start = _common_prefix(old, new)
+	start = old.rfind("\n", 0, start) + 1
+	suffix = _common_suffix(old, new, min(len(old), len(new)) - start)
+	oldEnd = len(old) - suffix
+	newEnd = len(new) - suffix
+	if oldEnd > start and old[oldEnd - 1] != "\n":
+		lineEnd = old.find("\n", oldEnd)
+		lineEnd = len(old) if lineEnd < 0 else lineEnd + 1
+		newEnd += lineEnd - oldEnd
+		oldEnd = lineEnd
+
+	oldLines = old[start:oldEnd].splitlines(True)
+	newLines = new[start:newEnd].splitlines(True)
+	if len(oldLines) * len(newLines) > MAX_DIFF_WORK:
+		return [(start, oldEnd - start, new[start:newEnd])]
+
+	offsets = [start]
+	for line in oldLines:
+		offsets.append(offsets[-1] + len(line))
+	edits = []
+	matcher = difflib.SequenceMatcher(None, oldLines, newLines)
+	for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+		if tag != "equal":
+			edits.append((offsets[i1], offsets[i2] - offsets[i1], "".join(newLines[j1:j2])))
+	edits.reverse()
+	return edits
+
+class _Inotify(object):
+	"""Watches directories with inotify, and calls 'notify' with the path
+	of every file that changes in them, on a thread of its own."""
+
+	# From <sys/inotify.h>
+	IN_MODIFY = 0x2
+	IN_ATTRIB = 0x4
+	IN_CLOSE_WRITE = 0x8
+	IN_MOVED_FROM = 0x40
+	IN_MOVED_TO = 0x80
+	IN_CREATE = 0x100
+	IN_DELETE = 0x200
+	IN_Q_OVERFLOW = 0x4000
+
+	MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM
+		| IN_MOVED_TO | IN_CREATE | IN_DELETE)
+
+	_EVENT = struct.Struct("iIII")
+
+	def __init__(self, notify, notifyAll):
+		self._notify = notify
+		self._notifyAll = notifyAll
+		self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+		self._fd = self._libc.inotify_init()
+		if self._fd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_init failed")
+		self._lock = threading.Lock()
+		self._dirs = {} # Maps each directory to [watch descriptor, count]
+		self._wds = {} # Maps each watch descriptor to its directory
+		thread.start_new_thread(self._run, ())
+
+	def add(self, path):
+		directory = os.path.dirname(path)
+		self._lock.acquire()
+		try:
+			if directory in self._dirs:
+				self._dirs[directory][1] += 1
+				return
+			wd = self._libc.inotify_add_watch(self._fd, directory, self.MASK)
+			if wd < 0:
+				logging.warning("Can't watch %s: %s"
+					% (directory, os.strerror(ctypes.get_errno())))
+				return
+			self._dirs[directory] = [wd, 1]
+			self._wds[wd] = directory
+		finally:
+			self._lock.release()
+
+	def remove(self, path):
+		directory = os.path.dirname(path)
+		self._lock.acquire()
+		try:
+			entry = self._dirs.get(directory)
+			if entry is None:
+				return
+			entry[1] -= 1
+			if entry[1] == 0:
+				self._libc.inotify_rm_watch(self._fd, entry[0])
+				del self._dirs[directory]
+				del self._wds[entry[0]]
+		finally:
+			self._lock.release()
+
+	def _run(self):
+		size = self._EVENT.size
+		while True:
+			try:
+				select.select([self._fd], [], [])
+				data = os.read(self._fd, 64 * 1024)
+			except (select.error, OSError), e:
+				if e[0] == errno.EINTR:
+					continue
+				logging.error("Stopped watching files: %s" % (e,))
+				return
+			pos = 0
+			while pos + size <= len(data):
+				wd, mask, cookie, length = self._EVENT.unpack_from(data, pos)
+				name = data[pos + size:pos + size + length].rstrip("\0")
+				pos += size + length
+				if mask & self.IN_Q_OVERFLOW:
+					self._notifyAll()
+					continue
+				self._lock.acquire()
+				directory = self._wds.get(wd)
+				self._lock.release()
+				if directory and name:
+					self._notify(os.path.join(directory, name))
+
+class _Poller(object):
+	"""Checks the files' modification times and sizes every POLL_SECS,
+	for platforms without inotify."""
+
+	POLL_SECS = 2.0
+
+	def __init__(self, notify, getPaths):
+		self._notify = notify
+		self._getPaths = getPaths
+		self._stamps = {}
+		thread.start_new_thread(self._run, ())
+
+	def add(self, path):
+		pass
+
+	def remove(self, path):
+		pass
+
+	def _run(self):
+		while True:
+			time.sleep(self.POLL_SECS)
+			stamps = {}
+			for path in self._getPaths():
+				stamps[path] = loader.file_stamp(path)
+				if path in self._stamps and self._stamps[path] != stamps[path]:
+					self._notify(path)
+			self._stamps = stamps
+
+class FileWatcher(QObject):
+	"""Reports when any of a set of files changes on disk."""
+
+	# Emitted with a list of the paths of the files that have changed. The
+	# changes are collected for BATCH_MSECS, so that e.g. switching branches
+	# results in a single signal.
+	changed = pyqtSignal(object)
+
+	BATCH_MSECS = 200
+
+	def __init__(self, parent=None):
+		QObject.__init__(self, parent)
+		self._lock = threading.Lock()
+		self._paths = set()
+		self._changed = set()
+		try:
+			self._backend = _Inotify(self._notify, self._notifyAll)
+		except (OSError, AttributeError, TypeError), e:
+			# No inotify (or no C library) on this platform
+			logging.debug("Polling for file changes: %s" % e)
+			self._backend = _Poller(self._notify, self.paths)
+
+		self._timer = QTimer(self)
+		safe_connect(self._timer.timeout, self._drain)
+		self._timer.start(self.BATCH_MSECS)
+
+	def paths(self):
+		self._lock.acquire()
+		try:
+			return list(self._paths)
+		finally:
+			self._lock.release()
+
+	def setPaths(self, paths):
+		"""Watch exactly the files in 'paths'."""
+		paths = set(os.path.abspath(x) for x in paths)
+		self._lock.acquire()
+		try:
+			added = paths - self._paths
+			removed = self._paths - paths
+			self._paths = paths
+			self._changed &= paths
+		finally:
+			self._lock.release()
+		for each in added:
+			self._backend.add(each)
+		for each in removed:
+			self._backend.remove(each)
+
+	def _notify(self, path):
+		# Called on the backend's thread
+		self._lock.acquire()
+		try:
+			if path in self._paths:
+				self._changed.add(path)
+		finally:
+			self._lock.release()
+
+	def _notifyAll(self):
+		# Some events were lost, so any of the files may have changed
+		self._lock.acquire()
+		try:
+			self._changed |= self._paths
+		finally:
+			self._lock.release()
+
+	def _drain(self):
+		self._lock.acquire()
+		try:
+			changed = list(self._changed)
+			self._changed.clear()
+		finally:
+			self._lock.release()
+		if changed:
+			self.changed.emit(changed)
+
+class Reloader(QObject):
+	"""Reads changed files on a worker thread, and diffs them against the
+	text of the documents they are open in."""
+
+	# Emitted for each reload request that succeeds, with a tuple
+	# (key, edits, encoding, line_ending, stamp, revision), where 'edits' is
+	# the list returned by diff_edits. The rest are passed through from
+	# request(), or describe the file.
+	reloaded = pyqtSignal(object)
+
+	# How often to check for finished reloads, and how much time to spend
+	# delivering them at a time
+	DRAIN_INTERVAL_MSECS = 20
+	BATCH_MSECS = 20
+
+	def __init__(self, parent=None):
+		QObject.__init__(self, parent)
+		self._requests = Queue.Queue()
+		self._results = Queue.Queue()
+		self._worker = None
+		# Requests whose results haven't been delivered yet, including the
+		# one the worker is busy with
+		self._outstanding = 0
+		self._timer = QTimer(self)
+		safe_connect(self._timer.timeout, self._drain)
+
+	def request(self, key, path, snapshot, revision):
+		"""Reload the file at 'path'. 'snapshot' is the current text of the
+		document as a QString, and 'revision' its revision number."""
+		if self._worker is None:
+			self._worker = threading.Thread(target=self._run)
+			self._worker.setDaemon(True)
+			self._worker.start()
+		self._requests.put((key, path, snapshot, revision))
+		self._outstanding += 1
+		if not self._timer.isActive():
+			self._timer.start(self.DRAIN_INTERVAL_MSECS)
+
+	def _run(self):
+		while True:
+			key, path, snapshot, revision = self._requests.get()
+			# There is a result (None on failure) for every request, so that
+			# _drain knows when it's done
+			result = None
+			try:
+				try:
+					stamp = loader.file_stamp(path)
+					text, encoding, line_ending = loader.read_file(path)
+					edits = diff_edits(unicode(snapshot), text)
+				except (IOError, OSError), e:
+					logging.warning("Couldn't reload %s: %s" % (path, e))
+				else:
+					result = (key, edits, encoding, line_ending, stamp, revision)
+			finally:
+				self._results.put(result)
+
+	def _drain(self):
+		deadline = time.time() + self.BATCH_MSECS / 1000.
+		while time.time() < deadline:
+			try:
+				result = self._results.get_nowait()
+			except Queue.Empty:
+				break
+			self._outstanding -= 1
+			if result is not None:
+				self.reloaded.emit(result)
+		# Keep checking while the worker is still reading or diffing
+		if self._outstanding == 0:
+			self._timer.stop()